@@ -32,6 +32,45 @@ r"""
 #       - Seem to work fine when testing connecting to 15 rooms at once \- asl97
 #       * Mostly cleaning up my mess and modernizing the code base - asl97
 #       * Python 2 is no longer supported for good, it's EoL since 2020 - asl97
+#       * Reconnect lost rooms and PM with exponential backoff and jitter
+#           - Enable with `autoReconnect = True`, concurrent attempts are capped and a circuit breaker holds off failing servers
+#       * Detect dead connections with a read timeout watchdog
+#           - Set `readTimeout` to reconnect connections that stayed silent for too long, TCP keepalive and `TCP_USER_TIMEOUT` can be enabled too
+#       * Lean room mode to skip userlist, banlist and history traffic
+#           - Toggle `trackParticipants`, `fetchBanlist` and `loadHistory` on the manager or per room through joinRoom, banlists are only requested when we can moderate
+#       * Skip dispatching and building events nobody listens for
+#           - Overridden `on*` handlers are detected at class creation, use `subscribe` for handlers assigned later
+#       * Deliver history in batches through the opt-in `onHistoryBatch` event
+#       * Pipelined deep history fetching with `Room.fetchHistory`
+#       * Follow banlist pages till the end, merging them into records indexed by user, ip and unid
+#           - Use `Room.isBanned` for constant time lookups
+#       * Metrics registry with per connection traffic, per event and per task timings
+#           - Enable with `metricsEnabled = True`, pull with `metrics.snapshot()` or scrape `metrics.serve(address)` with Prometheus
+#       * Performance warning system
+#           - Warn about slow event handlers and tasks with `slowEventThreshold` and `slowTaskThreshold`, dump the stack of a blocked loop with `blockedLoopThreshold`, loop lag is tracked in `loopLag`
+#       * Measure the round trip of our own messages with `trackLatency`
+#           - Per room percentiles in `Room.latency`, `onLatencyDegraded` fires when a tag server gets slow
+#       * Protocol trace recording (RoomManager.startTrace) and offline replay (python -m ch.trace)
+#       * Local stand-in server for load testing (ch.fakeserver), rooms pick their server through RoomManager.getServer and roomPort
+#       * Benchmark suite with JSON results (python -m ch.bench)
+#       * Pluggable transports under Room and PM
+#           - Override `RoomManager.createTransport`, the in memory `LoopbackTransport` skips sockets entirely, `FakeServer.loopback` uses it
+#       * WebSocket transport with permessage-deflate compression
+#           - Add the `ch.mixin.WebSocket` mixin, `FakeServer(websocket=True)` speaks it too
+#       * Multi-process cluster mode with consistent hash room placement (ch.cluster)
+#       * Added ch.mixin.Sharded, spreading rooms over several loop threads with their own scheduler
+#           - Task queues can be per loop through Task.scheduler(), the select step of main is RoomManager._poll
+#       * Added listenHandoff/takeOver, handing live room and PM sockets over to a new process (ch.handoff)
+#       * Added RoomManager.snapshot/restore, warm restarts from a compressed on-disk snapshot (ch.snapshot)
+#       * Added an optional SQLite message archive written from a background thread (archivePath, ch.archive)
+#           - maxPMMessages caps PM.msgs
+#       * Added an optional full-text index over every room's history (indexHistory, ch.search)
+#       * Added an optional cross-room presence and last-seen index (trackPresence, presencePath, ch.presence)
+#       * Added a sliding-window flood and spam detector (spamRules, ch.spam) raising onSpamDetected
+#           - Rules can delete, clear or ban through Room.moderation, a paced lane of moderation commands where urgent ones skip the queue
+#       * Added Room.bulkModerate, batched delete/clear/ban with deduplicated targets, paced through Room.moderation
+#       * Room.getLevel is a constant time lookup in a role index kept by the ok and mods commands
+#           - Moderator flag bits are kept, check them with Room.getModFlags and Room.hasModFlag
 # Description:
 #   A mostly abandoned event-based library for connecting
 #   to one or multiple Chatango rooms, has support for several things
@@ -55,12 +94,16 @@ r"""
 # Imports
 ################################################################
 from __future__ import annotations
-from typing import Any, Generator, Protocol, Self, Callable, Optional
+from typing import Any, Generator, Iterable, Protocol, Self, Callable, Optional
 import typing
 import enum
 
+import os
+import sys
+import traceback
 import socket
 import threading
+import queue
 import time
 import random
 import re
@@ -69,10 +112,21 @@ import urllib.request
 import urllib.parse
 import urllib.error
 import bisect
+import collections
 import heapq
 import html as _html
 
 from .ch_weights import specials, tsweights  # pylint: disable=E0401
+from .metrics import Metrics, ConnStats, LatencyTracker, Sample
+from .trace import TraceRecorder, TRACE_IN, TRACE_OUT
+from .transport import Transport
+from .archive import Archive
+from .search import SearchIndex
+from .presence import PresenceIndex
+from .spam import SpamDetector, SpamRule
+
+if typing.TYPE_CHECKING:
+    from .handoff import HandoffListener
 
 
 ################################################################
@@ -102,6 +156,92 @@ class BanRecord(typing.NamedTuple):
     src: User
 
 
+class BanList:
+    """
+    Ban or unban records of a room, indexed by user, ip and unid
+
+    Pages of the list get merged into the existing records,
+    records missing from every page of a fetch get dropped once it ends.
+    """
+    pageSize = 500
+
+    def __init__(self):
+        self.records: dict[User, BanRecord] = dict()
+        self.byIp: dict[str, set[User]] = dict()
+        self.byUnid: dict[str, set[User]] = dict()
+        # users seen by the fetch in progress, None if not fetching
+        self._seen: set[User] | None = None
+        self._cursor: float | None = None
+
+    def add(self, rec: BanRecord):
+        self.remove(rec.target)
+        self.records[rec.target] = rec
+        self.byIp.setdefault(rec.ip, set()).add(rec.target)
+        self.byUnid.setdefault(rec.unid, set()).add(rec.target)
+        if self._seen is not None:
+            self._seen.add(rec.target)
+
+    def remove(self, user: User) -> BanRecord | None:
+        if (rec := self.records.pop(user, None)) is not None:
+            for index, key in ((self.byIp, rec.ip), (self.byUnid, rec.unid)):
+                users = index[key]
+                users.discard(user)
+                if not users:
+                    del index[key]
+        return rec
+
+    def get(self, user: User) -> BanRecord | None:
+        return self.records.get(user)
+
+    def begin(self):
+        """Start fetching the list from the first page."""
+        self._seen = set()
+        self._cursor = None
+
+    def merge(self, data: str) -> str | None:
+        """
+        Merge a page of the list.
+
+        @param data: the raw page
+
+        @return: cursor of the next page, or None if this was the last page
+        """
+        if self._seen is None:
+            # a list we didn't ask for, treat it as complete
+            self.begin()
+        count = 0
+        oldest: tuple[float, str] | None = None
+        for section in data.split(";"):
+            p = section.split(":")
+            if len(p) != 5:
+                continue
+            count += 1
+            mtime = float(p[3])
+            # keep the server's own formatting of the timestamp for the cursor
+            if oldest is None or mtime < oldest[0]:
+                oldest = (mtime, p[3])
+            if p[2] == "":
+                continue
+            user = User(p[2])
+            self.add(BanRecord(p[0], p[1], user, mtime, User(p[4])))
+
+        if count >= self.pageSize and oldest is not None:
+            mtime, cursor = oldest
+            if mtime == self._cursor:
+                # a whole page of one timestamp, pages start at the cursor
+                # so the only way on is just past it, in the server's precision
+                digits = len(cursor.partition(".")[2])
+                cursor = f"{mtime - 10 ** -digits:.{digits}f}"
+            self._cursor = float(cursor)
+            return cursor
+
+        for user in set(self.records) - self._seen:
+            self.remove(user)
+        self._seen = None
+        self._cursor = None
+        return None
+
+
 ################################################################
 # Tag server stuff
 ################################################################
@@ -139,9 +279,34 @@ def getServer(group: str) -> str:
     return "s" + str(specials.get(group, _getServer(group))) + ".chatango.com"
 
 
+def _setSockOpts(sock: socket.socket, mgr: RoomManager):
+    """
+    Apply the TCP keepalive and user timeout options of the manager to a socket.
+
+    Options missing on the current platform are skipped.
+
+    @param sock: socket to configure
+    @param mgr: manager holding the options
+    """
+    if mgr.tcpKeepAlive:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for opt, val in (("TCP_KEEPIDLE", mgr.tcpKeepIdle),
+                         ("TCP_KEEPINTVL", mgr.tcpKeepInterval),
+                         ("TCP_KEEPCNT", mgr.tcpKeepCount)):
+            if hasattr(socket, opt):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, opt), val)
+    if mgr.tcpUserTimeout and hasattr(socket, "TCP_USER_TIMEOUT"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, mgr.tcpUserTimeout)
+
+
 ################################################################
 # Uid
 ################################################################
+def _historyKey(msg: Message) -> tuple[float, str, str]:
+    """Identify a message of the history, they have no message id."""
+    return (msg.time, msg.user.name, msg.raw)
+
+
 def _genUid():
     """
     generate a uid
@@ -231,9 +396,10 @@ class User:
     def __new__(cls, name: str, **_kw: ...) -> Self:
         """Return existing User Object for given user name"""
         lname = name.lower()
-        if lname not in cls._users:
-            cls._users[lname] = super().__new__(cls)
-        return cls._users[lname]
+        if (user := cls._users.get(lname)) is None:
+            # setdefault keeps whichever object another thread stored first
+            user = cls._users.setdefault(lname, super().__new__(cls))
+        return user
 
     ####
     # Init
@@ -395,11 +561,12 @@ class Task:
 
     def __init__(self, mgr: RoomManager, timeout: int, func: Callable[..., None],
                  isInterval: bool, args: ..., kw: ...):
-        Task._counter += 1
+        cls = type(self)
+        cls._counter += 1
 
         self.mgr = mgr
         self.target = time.time() + timeout
-        self.counter = Task._counter
+        self.counter = cls._counter
         self.timeout = timeout
         self.func = func
         self.isInterval = isInterval
@@ -410,9 +577,9 @@ class Task:
         if timeout < 0:
             self.queued = True
             if isInterval:
-                Task._tasks.add(self)
+                cls._tasks.add(self)
             else:
-                Task._tasks_once.add(self)
+                cls._tasks_once.add(self)
         else:
             self.queued = False
             self.queue()
@@ -423,7 +590,7 @@ class Task:
 
         Because removing from the list would require reheapifying the list
         """
-        Task._removed += 1
+        type(self)._removed += 1
         self.cancelled = True
 
     def queue(self):
@@ -432,75 +599,344 @@ class Task:
         """
         if not self.queued:
             self.queued = True
-            heapq.heappush(Task._tasks_queue, (self.target, self.counter, self))
+            heapq.heappush(type(self)._tasks_queue, (self.target, self.counter, self))
+
+    @classmethod
+    def scheduler(cls) -> type[Task]:
+        """
+        Return a subclass with queues of its own, for a loop running
+        in another thread, see ch.mixin.Sharded
+        """
+        return type(cls.__name__, (cls,), {
+            "_tasks_queue": [], "_tasks_once": set(), "_tasks": set(),
+            "_removed": 0, "running_task": None,
+        })
 
-    def size(self):
+    @classmethod
+    def size(cls):
         """Return the number of task queued, excluding cancelled task"""
-        return len(Task._tasks_queue) + len(Task._tasks) + len(Task._tasks_once) - Task._removed  # noqa: E501
+        return len(cls._tasks_queue) + len(cls._tasks) + len(cls._tasks_once) - cls._removed  # noqa: E501
 
     # TODO: figure out if there a naming convention for iter/yield function name
     # like there is for length, queue.qsize
-    @staticmethod
-    def _yield_tasks(now: float) -> Generator[Task, None, None]:
+    @classmethod
+    def _yield_tasks(cls, now: float) -> Generator[Task, None, None]:
         """Yield the overdue tasks"""
-        while Task._tasks_queue and (Task._tasks_queue[0][0] <= now or
-                                     Task._tasks_queue[0][2].cancelled):
-            _target, _counter, task = heapq.heappop(Task._tasks_queue)
+        while cls._tasks_queue and (cls._tasks_queue[0][0] <= now or
+                                    cls._tasks_queue[0][2].cancelled):
+            _target, _counter, task = heapq.heappop(cls._tasks_queue)
             task.queued = False
             yield task
 
         # We don't set the queued to False for `run on next tick` tasks
         # so it doesn't get added to the regular queue
-        yield from Task._tasks
+        yield from cls._tasks
 
-        yield from Task._tasks_once
-        Task._tasks_once.clear()
+        yield from cls._tasks_once
+        cls._tasks_once.clear()
 
-    @staticmethod
-    def get_next_tick_target() -> float | None:
-        while Task._tasks_queue:
-            target, _tid, task = Task._tasks_queue[0]
+    @classmethod
+    def get_next_tick_target(cls) -> float | None:
+        while cls._tasks_queue:
+            target, _tid, task = cls._tasks_queue[0]
             if task.cancelled:
-                heapq.heappop(Task._tasks_queue)
+                heapq.heappop(cls._tasks_queue)
                 continue
             return target
 
-    @staticmethod
-    def tick() -> float | None:
+    @classmethod
+    def tick(cls) -> float | None:
         """
         Process the tasks
 
         @return: time in seconds to the next task or None if no task
         """
-        # TODO: Add performance related data gathering and warning if a task took too long
         now = time.time()
         tasks: list[Task] = []
 
-        for task in Task._yield_tasks(now):
+        for task in cls._yield_tasks(now):
             if task.cancelled:
-                Task._removed -= 1
+                cls._removed -= 1
             else:
                 tasks.append(task)
 
         for task in tasks:
-            Task.running_task = task
-            task.func(*task.args, **task.kw)
+            cls.running_task = task
+            if task.mgr._timeTasks:
+                task.mgr._runTimedTask(task)
+            else:
+                task.func(*task.args, **task.kw)
             if task.isInterval:
                 task.target = now + task.timeout
                 task.queue()
 
-        Task.running_task = None
+        cls.running_task = None
 
-        if target := Task.get_next_tick_target():
+        if target := cls.get_next_tick_target():
             return target - now
 
 
+class _LoopState:
+    """What one loop thread is busy with, see LoopWatchdog"""
+    __slots__ = ("busySince", "busyWith", "depth", "reported")
+
+    def __init__(self):
+        self.busySince: float | None = None
+        self.busyWith = ""
+        self.depth = 0
+        self.reported: float | None = None
+
+
+class LoopWatchdog:
+    """
+    Thread dumping the stack of the main loop when a handler or task
+    keeps it blocked for longer than the threshold
+
+    Every thread running a loop, like the shards of the Sharded mixin,
+    is tracked on its own.
+    """
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        # thread ident -> state, each entry only written by its own thread
+        self.loops: dict[int, _LoopState] = dict()
+        threading.Thread(target=self._watch, name="ch-watchdog", daemon=True).start()
+
+    def enter(self, what: str):
+        """Mark the loop busy, nested calls keep the outermost start."""
+        if (state := self.loops.get(threading.get_ident())) is None:
+            state = self.loops[threading.get_ident()] = _LoopState()
+        if state.depth == 0:
+            state.busySince = time.monotonic()
+            state.busyWith = what
+        state.depth += 1
+
+    def leave(self):
+        state = self.loops[threading.get_ident()]
+        state.depth -= 1
+        if state.depth == 0:
+            state.busySince = None
+
+    def _watch(self):
+        while True:
+            time.sleep(self.threshold / 2)
+            frames = sys._current_frames()
+            for ident, state in list(self.loops.items()):
+                if ident not in frames:
+                    # the loop thread is gone
+                    self.loops.pop(ident, None)
+                    continue
+                since = state.busySince
+                if since is None or since == state.reported:
+                    continue
+                if time.monotonic() - since > self.threshold:
+                    state.reported = since
+                    print(f"[LoopWatchdog] Loop blocked for over {self.threshold}s "
+                          f"by {state.busyWith}, stack:", file=sys.stderr)
+                    traceback.print_stack(frames[ident], file=sys.stderr)
+
+
+################################################################
+# Reconnect stuff
+################################################################
+class Reconnector:
+    """
+    Manager level reconnect policy for lost connections
+
+    Each connection backs off exponentially with jitter between attempts,
+    at most `maxConcurrentReconnects` attempts are in flight at once and
+    a circuit breaker per server holds off every attempt to a server
+    that keeps failing until `serverCooldown` has passed.
+    """
+    def __init__(self, mgr: RoomManager):
+        self.mgr = mgr
+        self._attempts: dict[Conn, int] = dict()
+        self._pending: dict[Conn, Task] = dict()
+        # dict used as an ordered set, waiting for a free slot
+        self._waiting: dict[Conn, None] = dict()
+        self._inflight: dict[Conn, Task] = dict()
+        self._lostAt: dict[Conn, float] = dict()
+        self._failures: dict[str, int] = dict()
+        self._openUntil: dict[str, float] = dict()
+        self.recoverTimes: collections.deque[float] = collections.deque(maxlen=100)
+
+    ####
+    # Events from connections
+    ####
+    def connectionLost(self, conn: Conn, fast: bool = False):
+        """
+        Called after a connection dropped without being asked to.
+
+        @param conn: the connection that got lost
+        @param fast: skip the backoff delay for the first attempt
+        """
+        if (task := self._inflight.pop(conn, None)) is not None:
+            # the reconnect attempt itself failed
+            task.cancel()
+            self._serverFailed(conn._server)
+            self._next()
+        else:
+            self._lostAt.setdefault(conn, time.monotonic())
+
+        if not (self.mgr.autoReconnect or fast):
+            self.cancel(conn)
+            return
+
+        attempt = self._attempts.get(conn, 0)
+        self._attempts[conn] = attempt + 1
+        self._schedule(conn, 0 if fast and attempt == 0 else self.backoff(attempt))
+
+    def connected(self, conn: Conn):
+        """
+        Called when a connection is fully (re)connected.
+
+        @param conn: the connection that got connected
+        """
+        if (task := self._inflight.pop(conn, None)) is not None:
+            task.cancel()
+            self._failures.pop(conn._server, None)
+            self._openUntil.pop(conn._server, None)
+            self._next()
+        # the connection might have been reconnected manually in the meantime
+        if (task := self._pending.pop(conn, None)) is not None:
+            task.cancel()
+        self._waiting.pop(conn, None)
+        self._attempts.pop(conn, None)
+        if (lost := self._lostAt.pop(conn, None)) is not None:
+            self.recoverTimes.append(time.monotonic() - lost)
+
+    def cancel(self, conn: Conn):
+        """
+        Forget about a connection, cancelling any scheduled reconnect.
+
+        @param conn: the connection
+        """
+        if (task := self._pending.pop(conn, None)) is not None:
+            task.cancel()
+        if (task := self._inflight.pop(conn, None)) is not None:
+            task.cancel()
+            self._next()
+        self._waiting.pop(conn, None)
+        self._attempts.pop(conn, None)
+        self._lostAt.pop(conn, None)
+
+    def cancelName(self, name: str):
+        """
+        Cancel the scheduled reconnect of a room by name.
+
+        @param name: room name
+        """
+        for conn in [conn for conn in self._lostAt
+                     if isinstance(conn, Room) and conn.name == name]:
+            self.cancel(conn)
+
+    def cancelAll(self):
+        """Cancel every scheduled reconnect."""
+        for conn in list(self._lostAt):
+            self.cancel(conn)
+
+    def attempting(self, conn: Conn) -> bool:
+        """Return whether a reconnect attempt of the connection is in flight."""
+        return conn in self._inflight
+
+    def scheduled(self, conn: Conn) -> bool:
+        """Return whether the connection is going to be reconnected."""
+        return conn in self._pending or conn in self._waiting or conn in self._inflight
+
+    ####
+    # Policy
+    ####
+    def backoff(self, attempt: int) -> float:
+        """
+        Get the delay before a reconnect attempt.
+
+        @param attempt: number of attempts that came before
+
+        @return: delay in seconds
+        """
+        delay = min(self.mgr.reconnectMaxDelay, self.mgr.reconnectDelay * 2 ** attempt)
+        return delay * (1 - self.mgr.reconnectJitter * random.random())
+
+    def serverAvailable(self, server: str) -> bool:
+        """Return whether the circuit breaker of a server is closed."""
+        return self._openUntil.get(server, 0) <= time.monotonic()
+
+    def _serverFailed(self, server: str):
+        self._failures[server] = failures = self._failures.get(server, 0) + 1
+        if failures >= self.mgr.serverFailThreshold:
+            print("[Reconnector] Too many failures, holding off reconnects to", server,
+                  "for", self.mgr.serverCooldown, "seconds")
+            self._openUntil[server] = time.monotonic() + self.mgr.serverCooldown
+            # allow a single attempt again once the cooldown has passed
+            self._failures[server] = failures - 1
+
+    ####
+    # Scheduling
+    ####
+    def _schedule(self, conn: Conn, delay: float):
+        if (task := self._pending.pop(conn, None)) is not None:
+            task.cancel()
+        self._pending[conn] = self.mgr.setTimeout(delay, self._ready, conn)
+
+    def _ready(self, conn: Conn):
+        del self._pending[conn]
+        if not self.serverAvailable(conn._server):
+            delay = self._openUntil[conn._server] - time.monotonic()
+            self._schedule(conn, delay + self.backoff(0))
+        elif len(self._inflight) >= self.mgr.maxConcurrentReconnects:
+            self._waiting[conn] = None
+        else:
+            self._start(conn)
+
+    def _start(self, conn: Conn):
+        self._inflight[conn] = self.mgr.setTimeout(self.mgr.reconnectTimeout,
+                                                   self._timedOut, conn)
+        conn.reconnect()
+
+    def _timedOut(self, conn: Conn):
+        if conn not in self._inflight:
+            return
+        if conn.connected:
+            conn._connectionLost()
+        else:
+            self.connectionLost(conn)
+
+    def _next(self):
+        # released ones only count as in flight once they start
+        free = self.mgr.maxConcurrentReconnects - len(self._inflight)
+        for conn in list(self._waiting)[:max(free, 0)]:
+            del self._waiting[conn]
+            self._pending[conn] = self.mgr.setTimeout(0, self._ready, conn)
+
+    ####
+    # Stats
+    ####
+    def stats(self) -> dict[str, float | int]:
+        """
+        Get time-to-recover statistics of the recent reconnects.
+
+        @return: dict with the pending, inflight and waiting count and
+                 the count, last, mean and max time to recover in seconds
+        """
+        times = list(self.recoverTimes)
+        return {
+            "pending": len(self._pending),
+            "inflight": len(self._inflight),
+            "waiting": len(self._waiting),
+            "recovered": len(times),
+            "last": times[-1] if times else 0.0,
+            "mean": sum(times) / len(times) if times else 0.0,
+            "max": max(times, default=0.0),
+        }
+
+
 class Conn(Protocol):
     """
     A Class that describes the required members and functions required
     of a Conn object like Room and PM
     """
-    sock: socket.socket
+    sock: Transport
+    connected: bool
+    _server: str
 
     @property
     def pendingWrite(self) -> bool:
@@ -515,6 +951,12 @@ class Conn(Protocol):
     def disconnect(self):
         ...
 
+    def reconnect(self):
+        ...
+
+    def _connectionLost(self, fast: bool = False):
+        ...
+
 
 ################################################################
 # PM class
@@ -527,7 +969,7 @@ class PM:
     PMHost = "c1.chatango.com"
     PMPort = 5222
 
-    def __init__(self, mgr: RoomManager):
+    def __init__(self, mgr: RoomManager, connect: bool = True):
         self.connected = False
         self.blocklist: set[User] = set()
         self.contacts: set[User] = set()
@@ -549,6 +991,8 @@ class PM:
 
         self._auth_re = re.compile(r"auth\.chatango\.com ?= ?([^;]*)", re.IGNORECASE)
         self._mgr = mgr
+        self._server = self.PMHost
+        self._port = self.PMPort
         self._wlock = False
         self._firstCommand = True
         self._wbuf = bytearray()
@@ -556,7 +1000,11 @@ class PM:
         self._rbuf = bytearray()
         self._sbuf = bytearray(2**14)
         self._pingTask = None
-        self._connect()
+        self._watchdogTask = None
+        self._lastRecv = time.monotonic()
+        self._stats: ConnStats | None = None
+        if connect:
+            self._connect()
 
     ####
     # Connections
@@ -565,11 +1013,16 @@ class PM:
         self._wbuf.clear()
         self._firstCommand = True
         if self._auth():
-            self.sock = socket.socket()
-            self.sock.setblocking(False)
-            self.sock.connect_ex((self.PMHost, self.PMPort))
+            self.sock = self._mgr.createTransport(self)
+            self.sock.connect_ex((self._server, self._port))
 
+            self._lastRecv = time.monotonic()
+            self._stats = self._mgr.metrics.conn("pm", self._mgr.name or "") \
+                if self._mgr.metrics.enabled else None
             self._pingTask = self._mgr.setInterval(self._mgr.pingDelay, self.ping)
+            if self._mgr.readTimeout:
+                self._watchdogTask = self._mgr.setInterval(self._mgr.readTimeout / 4,
+                                                           self._checkStale)
             self.connected = True
 
     def _getAuth(self, name: str, password: str) -> str | None:
@@ -608,16 +1061,43 @@ class PM:
         self._setWriteLock(True)
         return True
 
+    def reconnect(self):
+        """Reconnect the bot to PM"""
+        if self.connected:
+            self._disconnect()
+        self._connect()
+        if self.connected:
+            self._mgr.addPMConnection(self)
+
     def disconnect(self):
         """Disconnect the bot from PM"""
+        self._mgr._reconnector.cancel(self)
         self._disconnect()
         self._mgr._callEvent(self, "onPMDisconnect")
 
     def _disconnect(self):
         self.connected = False
+        if self._pingTask:
+            self._pingTask.cancel()
+        if self._watchdogTask:
+            self._watchdogTask.cancel()
         self.sock.close()
         self._mgr.removePMConnection()
 
+    def _connectionLost(self, fast: bool = False):
+        """Called when the connection drops without us asking for it."""
+        attempting = self._mgr._reconnector.attempting(self)
+        self._disconnect()
+        self._mgr._reconnector.connectionLost(self, fast)
+        if not attempting:
+            self._mgr._callEvent(self, "onPMDisconnect")
+
+    def _checkStale(self):
+        """Reconnect if nothing was received for longer than readTimeout."""
+        if time.monotonic() - self._lastRecv > self._mgr.readTimeout:
+            self._mgr._callEvent(self, "onPMStale")
+            self._connectionLost(fast=True)
+
     def _updateStatus(self, user: User, status: str, timestamp: int, idle_duration: str = "0"):
         if status == "off" or status == "offline":
             self.status[user] = (timestamp, False)
@@ -630,14 +1110,21 @@ class PM:
             # unknown status, `online` is not off | on | app
             return False
 
+        self._statusChanged(user)
         return True
 
+    def _statusChanged(self, user: User):
+        if self._mgr.presence is None:
+            return
+        timestamp, online = self.status[user]
+        self._mgr.presence.pmStatus(user.name, time.time() if online else timestamp, online)
+
     ####
     # Feed
     ####
     @property
     def pendingWrite(self) -> bool:
-        return bool(self._wbuf)
+        return bool(self._wbuf) or getattr(self.sock, "pendingWrite", False)
 
     def feed_tick(self):
         # wait till entire message is received, message is delimited by 0
@@ -645,24 +1132,36 @@ class PM:
             del self._rbuf[-1]
 
             lines = self._rbuf.decode().split("\x00")
+            tracer = self._mgr.tracer
             for line in lines:
-                self._process(line.rstrip("\r\n"))
+                line = line.rstrip("\r\n")
+                if tracer is not None:
+                    tracer.record(self, TRACE_IN, line)
+                self._process(line)
             self._rbuf.clear()
 
     def rfeed(self):
         try:
             size = self.sock.recv_into(self._sbuf)
             if size > 0:
+                self._lastRecv = time.monotonic()
+                if self._stats is not None:
+                    self._stats.bytesIn += size
                 self._rbuf += self._sbuf[:size]
                 self.feed_tick()
             else:
-                self.disconnect()
+                self._connectionLost()
+        except (BlockingIOError, InterruptedError):
+            pass
         except socket.error as error:
             print("[PM][rfeed] Socket error", error)
+            self._connectionLost()
 
     def wfeed(self):
         try:
             size = self.sock.send(self._wbuf)
+            if self._stats is not None:
+                self._stats.bytesOut += size
             del self._wbuf[:size]
         except socket.error as error:
             print("[PM][wfeed] Socket error", error)
@@ -679,8 +1178,11 @@ class PM:
         if not self.connected:
             return
 
-        self._mgr._callEvent(self, "onRaw", data)
+        if self._mgr.hasHandler("onRaw"):
+            self._mgr._callEvent(self, "onRaw", data)
         cmd, *args = data.split(":")
+        if self._stats is not None:
+            self._stats.frame(cmd)
         func = "_rcmd_" + cmd
         try:
             getattr(self, func)(args)
@@ -692,6 +1194,7 @@ class PM:
     # Received Commands
     ####
     def _rcmd_OK(self, _args: list[str]):
+        self._mgr._reconnector.connected(self)
         self._setWriteLock(False)
         self._sendCommand("wl")
         self._sendCommand("getblock")
@@ -728,6 +1231,7 @@ class PM:
             self.status[user] = (0, True)
         else:
             self.status[user] = (int(time.time()), True)
+        self._statusChanged(user)
 
     def _rcmd_track(self, args: list[str]):
         user = User(args[0])
@@ -768,6 +1272,11 @@ class PM:
         )
 
         self.msgs[msgtime] = msg
+        if (limit := self._mgr.maxPMMessages) is not None and len(self.msgs) > limit:
+            # dicts keep insertion order, the first one is the oldest
+            del self.msgs[next(iter(self.msgs))]
+        if self._mgr.archive:
+            self._mgr.archive.add(msg, None)
         self._mgr._callEvent(self, "onPMMessage", user, msg)
 
     def _rcmd_msgoff(self, args: list[str]):
@@ -790,17 +1299,20 @@ class PM:
     def _rcmd_wlapp(self, args: list[str]):
         user = User(args[0])
         self.status[user] = (0, True)
+        self._statusChanged(user)
         self._mgr._callEvent(self, "onPMContactOnline", user)
 
     def _rcmd_wlonline(self, args: list[str]):
         user = User(args[0])
         self.status[user] = (0, True)
+        self._statusChanged(user)
         self._mgr._callEvent(self, "onPMContactOnline", user)
 
     def _rcmd_wloffline(self, args: list[str]):
         user = User(args[0])
         last_on = int(float(args[1]))
         self.status[user] = (last_on, False)
+        self._statusChanged(user)
         self._mgr._callEvent(self, "onPMContactOffline", user)
 
     def _rcmd_kickingoff(self, _args: list[str]):
@@ -903,7 +1415,182 @@ class PM:
             self._firstCommand = False
         else:
             terminator = b"\r\n\x00"
-        self._write(":".join(args).encode() + terminator)
+        command = ":".join(args)
+        if self._mgr.tracer is not None:
+            self._mgr.tracer.record(self, TRACE_OUT, command)
+        self._write(command.encode() + terminator)
+
+
+################################################################
+# History fetching
+################################################################
+class HistoryFetcher:
+    """
+    Fetch deep room history by keeping several get_more requests in flight,
+    see Room.fetchHistory
+    """
+    def __init__(self, room: Room, limit: int,
+                 callback: Optional[Callable[[Room, list[Message]], None]],
+                 done: Optional[Callable[[Room, int], None]],
+                 batchSize: int, window: int, oldestFirst: bool = False):
+        self.room = room
+        self.limit = limit
+        self.callback = callback
+        self.done = done
+        self.batchSize = batchSize
+        self.window = window
+        self.oldestFirst = oldestFirst
+        # batches held back till the end with oldestFirst, newest first
+        self._held: list[list[Message]] = []
+        self.received = 0
+        self.finished = False
+        self._outstanding = 0
+
+    def start(self):
+        self.room._historyFetcher = self
+        self.room._gettingmorehistory = True
+        self._fill()
+        if not self._outstanding:
+            self._finish()
+
+    def _fill(self):
+        room = self.room
+        while (not self.finished and room._ihistoryIndex is not None and
+               self._outstanding < self.window and
+               self.received + self._outstanding * self.batchSize < self.limit):
+            room._sendCommand("get_more", str(self.batchSize), str(room._ihistoryIndex))
+            room._ihistoryIndex += 1
+            self._outstanding += 1
+
+    def _deliver(self, msgs: list[Message]):
+        if self.finished or not msgs:
+            return
+        remaining = self.limit - self.received
+        if len(msgs) > remaining:
+            # going back in time, so the newest part of the batch is the wanted part
+            msgs = msgs[len(msgs) - remaining:]
+        self.received += len(msgs)
+        if self.oldestFirst:
+            self._held.append(msgs)
+        elif self.callback:
+            self.callback(self.room, msgs)
+
+    def gotmore(self, msgs: list[Message]):
+        """
+        Called with each batch that arrived.
+
+        @param msgs: the messages of the batch, oldest first
+        """
+        self._outstanding -= 1
+        self._deliver(msgs)
+        if self.received >= self.limit or self.room._ihistoryIndex is None:
+            self._finish()
+        else:
+            self._fill()
+        self._detachIfIdle()
+
+    def nomore(self, msgs: list[Message]):
+        """
+        Called once the server has no more history to give.
+
+        @param msgs: the messages that arrived before it, oldest first
+        """
+        self._outstanding -= 1
+        self._deliver(msgs)
+        self._finish()
+        self._detachIfIdle()
+
+    def abort(self):
+        """Stop fetching, keeping whatever was delivered so far."""
+        self._outstanding = 0
+        self._finish()
+        self._detachIfIdle()
+
+    def _finish(self):
+        if not self.finished:
+            self.finished = True
+            if self._held and self.callback:
+                self.callback(self.room, [msg for msgs in reversed(self._held) for msg in msgs])
+            self._held = []
+            if self.done:
+                self.done(self.room, self.received)
+
+    def _detachIfIdle(self):
+        # responses to requests still in flight are swallowed until they all arrived
+        if self.finished and self._outstanding <= 0 and self.room._historyFetcher is self:
+            self.room._historyFetcher = None
+            self.room._gettingmorehistory = False
+
+
+class ModerationQueue:
+    """
+    Paced lane of moderation commands for a room, see Room.moderation
+
+    Commands go out as a token bucket allows, moderationBurst at once then
+    moderationRate per second, so a cleanup doesn't get the bot flood banned.
+    Urgent commands skip ahead of the ones already waiting.
+    """
+    def __init__(self, room: Room, rate: float, burst: int):
+        self.room = room
+        self.rate = rate
+        self.burst = burst
+        self.sent = 0
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._urgent: collections.deque[tuple[tuple[str, ...], Optional[Callable[[], None]]]] = \
+            collections.deque()
+        self._normal: collections.deque[tuple[tuple[str, ...], Optional[Callable[[], None]]]] = \
+            collections.deque()
+        self._task: Optional[Task] = None
+
+    def __len__(self):
+        return len(self._urgent) + len(self._normal)
+
+    def push(self, args: tuple[str, ...], urgent: bool = False,
+             callback: Optional[Callable[[], None]] = None):
+        """
+        Queue a command.
+
+        @param args: command and arguments, as for _sendCommand
+        @param urgent: send it before the commands already waiting
+        @param callback: called once the command is sent
+        """
+        (self._urgent if urgent else self._normal).append((args, callback))
+        if self._task is None:
+            self._pump()
+
+    def clear(self):
+        """Drop the commands still waiting."""
+        self._urgent.clear()
+        self._normal.clear()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def _pump(self):
+        self._task = None
+        now = time.monotonic()
+        self._tokens = min(float(self.burst), self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        while self._tokens >= 1 and (self._urgent or self._normal):
+            args, callback = (self._urgent or self._normal).popleft()
+            self._tokens -= 1
+            self.room._sendCommand(*args)
+            self.sent += 1
+            if callback:
+                callback()
+        if self._urgent or self._normal:
+            self._task = self.room._mgr.setTimeout((1 - self._tokens) / self.rate, self._pump)
+
+
+def _parseMods(entries: list[str]) -> dict[User, int]:
+    """Parse the name,flags entries of a mods list into moderator -> flag bits."""
+    mods: dict[User, int] = dict()
+    for entry in entries:
+        name, _, flags = entry.partition(",")
+        if name:
+            mods[User(name)] = int(flags) if flags.isdigit() else 0
+    return mods
 
 
 ################################################################
@@ -914,12 +1601,12 @@ class Room:
     ####
     # Init
     ####
-    def __init__(self, room: str, uid: str | None, mgr: RoomManager):
-        """init, don't overwrite"""
+    def __init__(self, room: str, uid: str | None, mgr: RoomManager, connect: bool = True):
+        """init, don't overwrite, connect=False leaves the connecting to _connect"""
         # Basic stuff
         self.name = room
-        self._server = getServer(room)
-        self._port = 443
+        self._server = mgr.getServer(room) if mgr else getServer(room)
+        self._port = mgr.roomPort if mgr else 443
         self._mgr = mgr
 
         # Under the hood
@@ -934,7 +1621,8 @@ class Room:
         self._wlockbuf = bytearray()
 
         self.owner: User
-        self._mods: set[User] = set()
+        # role index, moderator -> flag bits from the server, see getLevel
+        self._modFlags: dict[User, int] = dict()
         self._mqueue: dict[str, Message] = dict()
         # NOTE: Is userlist with recent mode commonly used?
         # if not, we should optimize for better onMessage Performance
@@ -947,12 +1635,22 @@ class Room:
         self._i_log: list[Message] = list()
         self._ihistoryIndex: int | None = 0
         self._gettingmorehistory: bool = False
+        self._historyFetcher: HistoryFetcher | None = None
+        self._moderation: ModerationQueue | None = None
+        # history keys of a room restored from a snapshot, see ch.snapshot
+        self._restored: set[tuple[float, str, str]] | None = None
         self._userlist: list[User] = list()
         self._firstCommand = True
         self._connectAmount = 0
         self.premium = False
         self.usercount = 0
         self.pingTask: Task
+        self._watchdogTask: Task | None = None
+        self._lastRecv = time.monotonic()
+        self._stats: ConnStats | None = None
+        # send times of our own messages waiting for the server to echo them back
+        self._echoes: collections.deque[float] = collections.deque()
+        self.latency = LatencyTracker()
         self._bot_name: str = ""
         self._login_name = ""
         self._anon_name = ""
@@ -961,11 +1659,16 @@ class Room:
         self.msgs: dict[str, "Message"] = dict()
         self._wlock = False
         self.silent = False
-        self._banlist: dict[User, BanRecord] = dict()
-        self._unbanlist: dict[User, BanRecord] = dict()
+        self._banlist = BanList()
+        self._unbanlist = BanList()
+
+        # Lean room mode, defaults to the manager's settings
+        self.trackParticipants: bool = mgr.trackParticipants if mgr else True
+        self.fetchBanlist: bool = mgr.fetchBanlist if mgr else True
+        self.loadHistory: bool = mgr.loadHistory if mgr else True
 
         # Inited vars
-        if self._mgr:
+        if self._mgr and connect:
             self._connect()
 
     ####
@@ -973,14 +1676,19 @@ class Room:
     ####
     def _connect(self):
         """Connect to the server."""
-        self.sock = socket.socket()
-        self.sock.setblocking(False)
+        self.sock = self._mgr.createTransport(self)
         self.sock.connect_ex((self._server, self._port))
         self._mgr.addConnection(self)
         self._firstCommand = True
         self._wbuf.clear()
         self._auth()
+        self._lastRecv = time.monotonic()
+        self._stats = self._mgr.metrics.conn("room", self.name) \
+            if self._mgr.metrics.enabled else None
         self.pingTask: Task = self._mgr.setInterval(self._mgr.pingDelay, self.ping)
+        if self._mgr.readTimeout:
+            self._watchdogTask = self._mgr.setInterval(self._mgr.readTimeout / 4,
+                                                       self._checkStale)
         self.connected = True
 
     def reconnect(self):
@@ -994,16 +1702,58 @@ class Room:
 
     def disconnect(self):
         """Disconnect."""
+        self._mgr._reconnector.cancel(self)
         self._disconnect()
+        # the history of a room we left is gone, unlike on reconnects
+        if self._mgr.search is not None:
+            self._mgr.search.removeRoom(self.name)
         self._mgr._callEvent(self, "onDisconnect")
 
+    def _connectionLost(self, fast: bool = False):
+        """Called when the connection drops without us asking for it."""
+        # failed reconnect attempts were never connected as far as the user knows
+        attempting = self._mgr._reconnector.attempting(self)
+        self._disconnect()
+        self._mgr._reconnector.connectionLost(self, fast)
+        if self._mgr.search is not None and not self._mgr._reconnector.scheduled(self):
+            # not coming back, drop its history like for a room we left
+            self._mgr.search.removeRoom(self.name)
+        if not attempting:
+            self._mgr._callEvent(self, "onDisconnect")
+
+    def _checkStale(self):
+        """Reconnect if nothing was received for longer than readTimeout."""
+        if time.monotonic() - self._lastRecv > self._mgr.readTimeout:
+            self._mgr._callEvent(self, "onStale")
+            self._connectionLost(fast=True)
+
+    def _echoSeen(self):
+        """Match our own message coming back against the oldest one sent."""
+        now = time.monotonic()
+        # forget messages the server never echoed, like ones dropped by flood control
+        while self._echoes and now - self._echoes[0] > self._mgr.echoTimeout:
+            self._echoes.popleft()
+        if self._echoes:
+            rtt = now - self._echoes.popleft()
+            self.latency.add(rtt)
+            self._mgr._latencySample(self, rtt)
+
     def _disconnect(self):
         """Disconnect from the server."""
         self.connected = False
         for user in self._userlist:
             user.clearSessionIds(self)
         self._userlist = list()
+        if self._mgr.presence is not None:
+            self._mgr.presence.roomGone(self.name)
+        self._echoes.clear()
+        if self._historyFetcher:
+            self._historyFetcher.abort()
+        if self._moderation:
+            self._moderation.clear()
         self.pingTask.cancel()
+        if self._watchdogTask:
+            self._watchdogTask.cancel()
         self.sock.close()
         self._mgr.removeConnection(self)
 
@@ -1027,7 +1777,15 @@ class Room:
 
     @property
     def pendingWrite(self) -> bool:
-        return bool(self._wbuf)
+        return bool(self._wbuf) or getattr(self.sock, "pendingWrite", False)
+
+    @property
+    def moderation(self) -> ModerationQueue:
+        """Paced lane of moderation commands, see spamRules and bulkModerate"""
+        if self._moderation is None:
+            self._moderation = ModerationQueue(self, self._mgr.moderationRate,
+                                               self._mgr.moderationBurst)
+        return self._moderation
 
     def getUserlist(self, mode: Optional[Userlist_Mode] = None,
                     unique: Optional[bool] = None, memory: Optional[int] = None):
@@ -1058,17 +1816,17 @@ class Room:
 
     @property
     def mods(self):
-        return set(self._mods)
+        return set(self._modFlags)
 
     @property
     def modnames(self):
-        return [x.name for x in self.mods]
+        return [x.name for x in self._modFlags]
 
     @property
-    def banlist(self): return list(self._banlist.keys())
+    def banlist(self): return list(self._banlist.records.keys())
 
     @property
-    def unbanlist(self): return [[r.target, r.src] for r in self._unbanlist.values()]
+    def unbanlist(self): return [[r.target, r.src] for r in self._unbanlist.records.values()]
 
     ####
     # Feed/process
@@ -1078,24 +1836,36 @@ class Room:
         if self._rbuf[-1] == 0:
             del self._rbuf[-1]
             lines = self._rbuf.decode(errors='ignore').split("\x00")
+            tracer = self._mgr.tracer
             for line in lines:
-                self._process(line.rstrip("\r\n"))
+                line = line.rstrip("\r\n")
+                if tracer is not None:
+                    tracer.record(self, TRACE_IN, line)
+                self._process(line)
             self._rbuf.clear()
 
     def rfeed(self):
         try:
             size = self.sock.recv_into(self._sbuf)
             if size > 0:
+                self._lastRecv = time.monotonic()
+                if self._stats is not None:
+                    self._stats.bytesIn += size
                 self._rbuf += self._sbuf[:size]
                 self.feed_tick()
             else:
-                self.disconnect()
+                self._connectionLost()
+        except (BlockingIOError, InterruptedError):
+            pass
         except socket.error as error:
             print("[Room][rfeed] Socket error", error)
+            self._connectionLost()
 
     def wfeed(self):
         try:
             size = self.sock.send(self._wbuf)
+            if self._stats is not None:
+                self._stats.bytesOut += size
             del self._wbuf[:size]
         except socket.error as error:
             print("[Room][wfeed] Socket error", error)
@@ -1112,8 +1882,11 @@ class Room:
         if not self.connected:
             return
 
-        self._mgr._callEvent(self, "onRaw", line)
+        if self._mgr.hasHandler("onRaw"):
+            self._mgr._callEvent(self, "onRaw", line)
         cmd, *args = line.split(":")
+        if self._stats is not None:
+            self._stats.frame(cmd)
         func = "_rcmd_" + cmd
         if hasattr(self, func):
             getattr(self, func)(args)
@@ -1150,7 +1923,7 @@ class Room:
             self._bot_name: str = self._mgr.name
         self.owner = User(args[0])
         self.uid = args[1]
-        self._mods = set(map(lambda x: User(x.split(",")[0]), args[6].split(";")))
+        self._modFlags = _parseMods(args[6].split(";"))
 
     def _rcmd_aliasok(self, _args: list[str]):
         # Successful Setting Temp Name
@@ -1161,22 +1934,23 @@ class Room:
         self._bot_name = self._login_name
 
     def _rcmd_denied(self, _args: list[str]):
+        self._mgr._reconnector.cancel(self)
         self._disconnect()
         self._mgr._callEvent(self, "onConnectFail")
 
     def _rcmd_inited(self, _args: list[str]):
-        self._sendCommand("g_participants", "start")
+        self._mgr._reconnector.connected(self)
+        if self.trackParticipants:
+            self._sendCommand("g_participants", "start")
         self._sendCommand("getpremium", "1")
-        self.requestBanlist()
-        self.requestUnBanlist()
+        # No point asking for the banlist when we can't moderate
+        if self.fetchBanlist and self.getLevel(self.user) > 0:
+            self.requestBanlist()
+            self.requestUnBanlist()
         if self._connectAmount == 0:
             self._mgr._callEvent(self, "onConnect")
-            for msg in reversed(self._i_log):
-                user = msg.user
-                self._mgr._callEvent(self, "onHistoryMessage", user, msg)
-                self._addHistory(msg)
-            self._i_log.clear()
-            self._mgr._callEvent(self, "onHistoryMessageUpdate")
+            if self.loadHistory:
+                self._flushHistoryLog()
         else:
             self._mgr._callEvent(self, "onReconnect")
             # we do not repeat onHistoryMessage calls but we still need to clear the log
@@ -1196,14 +1970,17 @@ class Room:
             self.premium = False
 
     def _rcmd_mods(self, args: list[str]):
-        modnames = args
-        mods = set(map(lambda x: User(x.split(",")[0]), modnames))
-        premods = self._mods
-        for user in mods - premods:  # modded
-            self._mods.add(user)
+        mods = _parseMods(args)
+        premods = self._modFlags
+        self._modFlags = mods
+        if self.fetchBanlist and self.user in mods and self.user not in premods:
+            # we just became able to moderate, get the lists we skipped
+            self.requestBanlist()
+            self.requestUnBanlist()
+        # in the order of the server's list, the dicts keep it
+        for user in [user for user in mods if user not in premods]:  # modded
             self._mgr._callEvent(self, "onModAdd", user)
-        for user in premods - mods:  # demodded
-            self._mods.remove(user)
+        for user in [user for user in premods if user not in mods]:  # demodded
             self._mgr._callEvent(self, "onModRemove", user)
         self._mgr._callEvent(self, "onModChange")
 
@@ -1230,6 +2007,8 @@ class Room:
         # if name matches the current bot name in room
         # to simplify telling apart the bot (self) for the user
         user = User(name) if name != self._bot_name else self.user
+        if self._echoes and name == self._bot_name:
+            self._echoSeen()
         # Create an anonymous message and queue it because msgid is unknown.
         if f:
             fontColor, fontFace, fontSize = _parseFont(f)
@@ -1250,14 +2029,33 @@ class Room:
             room=self
         )
         self._mqueue[i] = msg
+        # anons get a new name with every session, nothing to remember them by
+        if self._mgr.presence is not None and not name.startswith("!"):
+            self._mgr.presence.message(self.name, user.name, mtime)
 
     def _rcmd_u(self, args: list[str]):
         if msg := self._mqueue.pop(args[0], None):
             msg.attach(self, args[1])
             self._addHistory(msg)
+            if self._mgr.archive:
+                self._mgr.archive.add(msg, self.name)
+            if self._mgr.spam is not None:
+                self._checkSpam(msg)
             self._mgr._callEvent(self, "onMessage", msg.user, msg)
 
+    def _checkSpam(self, msg: Message):
+        if msg.user == self.user or self.getLevel(msg.user) > 0:
+            return
+        spam = self._mgr.spam
+        for rule, count in spam.check(msg):
+            self._mgr._callEvent(self, "onSpamDetected", msg.user, msg, rule, count)
+            if rule.action and self.getLevel(self.user) > 0 and spam.claim(self.name, rule, msg):
+                self.moderation.push(self._moderationCommand(rule.action, msg), urgent=True)
+
     def _rcmd_i(self, args: list[str]):
+        # Don't bother building the initial history if it won't be used
+        if not self.loadHistory and not self._gettingmorehistory:
+            return
         mtime = float(args[0])
         puid = args[3]
         ip = args[6]
@@ -1302,16 +2100,20 @@ class Room:
         self._i_log.append(msg)
 
     def _rcmd_gotmore(self, _args: list[str]):
+        if self._historyFetcher:
+            msgs = self._i_log[::-1]
+            self._i_log.clear()
+            self._historyFetcher.gotmore(msgs)
+            return
         self._gettingmorehistory = False
-        for msg in reversed(self._i_log):
-            user = msg.user
-            self._mgr._callEvent(self, "onHistoryMessage", user, msg)
-            self._addHistory(msg)
-        self._i_log.clear()
-        self._mgr._callEvent(self, "onHistoryMessageUpdate")
+        self._flushHistoryLog()
 
     def _rcmd_nomore(self, _args: list[str]):
         self._ihistoryIndex = None
+        if self._historyFetcher:
+            msgs = self._i_log[::-1]
+            self._i_log.clear()
+            self._historyFetcher.nomore(msgs)
 
     def getMoreHistory(self):
         """
@@ -1329,7 +2131,70 @@ class Room:
             self._ihistoryIndex += 1
         return bool(self._ihistoryIndex)
 
+    def fetchHistory(self, limit: int,
+                     callback: Optional[Callable[[Room, list[Message]], None]] = None,
+                     done: Optional[Callable[[Room, int], None]] = None,
+                     batchSize: int = 20, window: int = 4, oldestFirst: bool = False
+                     ) -> Generator[Message, None, None] | None:
+        """
+        Fetch up to limit older messages, keeping up to window requests in flight.
+
+        Messages are handed over batch by batch as they arrive, each batch
+        oldest first but every batch older than the one before, since the
+        server goes back in time. With oldestFirst the batches are held back
+        instead and handed over at the end as one batch, oldest first overall.
+        They are neither added to history nor passed to onHistoryMessage.
+
+        Without callback a generator is returned instead, it blocks while
+        waiting for batches so it has to be consumed outside of the main loop,
+        like in a function passed to deferToThread.
+
+        @param limit: maximum amount of messages to fetch
+        @param callback: called as callback(room, messages) for each batch
+        @param done: called as done(room, count) once finished
+        @param batchSize: messages per request
+        @param window: maximum amount of requests in flight
+        @param oldestFirst: hand every message over at the end, oldest first
+
+        @return: None, or a generator of messages without callback
+        """
+        if callback is None:
+            return self._iterHistory(limit, done, batchSize, window, oldestFirst)
+        if self._gettingmorehistory:
+            raise RuntimeError("Already getting more history for " + self.name)
+        HistoryFetcher(self, limit, callback, done, batchSize, window, oldestFirst).start()
+        return None
+
+    def _iterHistory(self, limit: int, done: Optional[Callable[[Room, int], None]],
+                     batchSize: int, window: int,
+                     oldestFirst: bool) -> Generator[Message, None, None]:
+        batches: queue.SimpleQueue[list[Message] | RuntimeError | None] = queue.SimpleQueue()
+
+        def finish(room: Room, count: int):
+            batches.put(None)
+            if done:
+                done(room, count)
+
+        def start():
+            try:
+                self.fetchHistory(limit, lambda _room, msgs: batches.put(msgs), finish,
+                                  batchSize, window, oldestFirst)
+            except RuntimeError as error:
+                # another fetch got there first, fail the consumer, not the main loop
+                batches.put(error)
+
+        if self._gettingmorehistory:
+            raise RuntimeError("Already getting more history for " + self.name)
+        # start from within the main loop, so the room is only touched from there
+        self._mgr.setTimeout(0, start)
+        while (msgs := batches.get()) is not None:
+            if isinstance(msgs, RuntimeError):
+                raise msgs
+            yield from msgs
+
     def _rcmd_g_participants(self, args: list[str]):
+        if not self.trackParticipants:
+            return
         args = ":".join(args).split(";")
         for data in args:
             data = data.split(":")
@@ -1342,13 +2207,23 @@ class Room:
             )
             user.addSessionId(self, data[0])
             self._userlist.append(user)
+            if self._mgr.presence is not None:
+                self._mgr.presence.join(self.name, name, float(data[1]), event=False)
 
     def _rcmd_participant(self, args: list[str]):
+        if not self.trackParticipants:
+            return
         name = args[3].lower()
         if name == "none":
             return
         user = User(name)
         puid = args[2]
+        if self._mgr.presence is not None:
+            when = float(args[6]) if len(args) > 6 and args[6] else time.time()
+            if args[0] == "0":
+                self._mgr.presence.leave(self.name, name, when)
+            else:
+                self._mgr.presence.join(self.name, name, when)
 
         if args[0] == "0":  # leave
             user.removeSessionId(self, args[1])
@@ -1379,6 +2254,8 @@ class Room:
         if msg:
             if msg in self.history:
                 self.history.remove(msg)
+                if self._mgr.search is not None:
+                    self._mgr.search.remove(msg)
                 self._mgr._callEvent(self, "onMessageDelete", msg.user, msg)
                 msg.detach()
 
@@ -1391,37 +2268,23 @@ class Room:
         self._mgr._callEvent(self, "onUserCountChange")
 
     def _rcmd_blocklist(self, args: list[str]):
-        self._banlist = dict()
-        sections = ":".join(args).split(";")
-        for section in sections:
-            p = section.split(":")
-            if len(p) != 5:
-                continue
-            if p[2] == "":
-                continue
-            user = User(p[2])
-            self._banlist[user] = BanRecord(p[0], p[1], user, float(p[3]), User(p[4]))
-        self._mgr._callEvent(self, "onBanlistUpdate")
+        if (cursor := self._banlist.merge(":".join(args))) is not None:
+            self._sendCommand("blocklist", "block", cursor, "next", str(BanList.pageSize))
+        else:
+            self._mgr._callEvent(self, "onBanlistUpdate")
 
     def _rcmd_unblocklist(self, args: list[str]):
-        self._unbanlist = dict()
-        sections = ":".join(args).split(";")
-        for section in sections:
-            p = section.split(":")
-            if len(p) != 5:
-                continue
-            if p[2] == "":
-                continue
-            user = User(p[2])
-            self._unbanlist[user] = BanRecord(p[0], p[1], user, float(p[3]), User(p[4]))
-        self._mgr._callEvent(self, "onUnBanlistUpdate")
+        if (cursor := self._unbanlist.merge(":".join(args))) is not None:
+            self._sendCommand("blocklist", "unblock", cursor, "next", str(BanList.pageSize))
+        else:
+            self._mgr._callEvent(self, "onUnBanlistUpdate")
 
     def _rcmd_blocked(self, args: list[str]):
         if args[2] == "":
             return
         target = User(args[2])
         user = User(args[3])
-        self._banlist[target] = BanRecord(args[0], args[1], target, float(args[4]), user)
+        self._banlist.add(BanRecord(args[0], args[1], target, float(args[4]), user))
 
         self._mgr._callEvent(self, "onBan", user, target)
 
@@ -1430,8 +2293,8 @@ class Room:
             return
         target = User(args[2])
         user = User(args[3])
-        del self._banlist[target]
-        self._unbanlist[user] = BanRecord(args[0], args[1], target, float(args[4]), user)
+        self._banlist.remove(target)
+        self._unbanlist.add(BanRecord(args[0], args[1], target, float(args[4]), user))
         self._mgr._callEvent(self, "onUnban", user, target)
 
     ####
@@ -1462,6 +2325,8 @@ class Room:
         @param msg: message
         """
         if not self.silent:
+            if self._mgr.trackLatency:
+                self._echoes.append(time.monotonic())
             self._sendCommand("bmsg:tl2r", msg)
 
     def message(self, msg: str, html: bool = False):
@@ -1579,6 +2444,17 @@ class Room:
         print("[obsolete] the delete function is obsolete, please use deleteMessage")
         return self.deleteMessage(message)
 
+    def _moderationCommand(self, action: str, msg: Message) -> tuple[str, ...]:
+        if action == "delete":
+            return ("delmsg", msg.msgid or "")
+        if action == "clear":
+            # anons and temporary names are cleared by unid and ip alone
+            return ("delallmsg", msg.unid, msg.ip,
+                    "" if msg.user.name[0] in ["!", "#"] else msg.user.name)
+        if action == "ban":
+            return ("block", msg.unid, msg.ip, msg.user.name)
+        raise ValueError(f"unknown moderation action {action!r}")
+
     def rawClearUser(self, unid: str, ip: str, user: str):
         self._sendCommand("delallmsg", unid, ip, user)
 
@@ -1639,13 +2515,92 @@ class Room:
             return True
         return False
 
+    def bulkModerate(self, actions: Iterable[tuple[str, User | Message]],
+                     progress: Optional[Callable[[Room, int, int], None]] = None,
+                     done: Optional[Callable[[Room, int], None]] = None) -> int:
+        """
+        Delete, clear and ban many targets at once, like after a raid. (Moderator only)
+
+        Targets are deduplicated, deleting messages of a user who also gets
+        cleared is skipped. Users are resolved to their last message through
+        the per user index of RoomManager.search, without indexHistory by a
+        single reverse scan of the history for the whole batch. Users
+        without a message in the history are skipped.
+        The commands go out through Room.moderation,
+        paced so the bot doesn't get flood banned. Commands still waiting
+        when the room disconnects are dropped, done is not called then.
+
+        @param actions: ("delete", message), ("clear", user or message) or
+                        ("ban", user or message)
+        @param progress: called as progress(room, sent, total) after each command
+        @param done: called as done(room, total) once every command is sent
+
+        @return: amount of commands queued, 0 when we can't moderate
+        """
+        actions = list(actions)
+        for action, _ in actions:
+            if action not in ("delete", "clear", "ban"):
+                raise ValueError(f"unknown moderation action {action!r}")
+        if self.getLevel(self.user) == 0:
+            return 0
+
+        wanted = {target for _, target in actions if isinstance(target, User)}
+        last: dict[User, Message] = dict()
+        if (search := self._mgr.search) is not None:
+            for user in wanted:
+                if (msg := search.latest(user.name, self.name)) is not None:
+                    last[user] = msg
+        else:
+            for msg in reversed(self.history):
+                if len(last) == len(wanted):
+                    break
+                if msg.user in wanted and msg.user not in last:
+                    last[msg.user] = msg
+
+        commands: dict[tuple[str, ...], None] = dict()
+        cleared: set[User] = set()
+        deletes: list[Message] = []
+        for action, target in actions:
+            msg = last.get(target) if isinstance(target, User) else target
+            if msg is None:
+                continue
+            if action == "delete":
+                if msg.msgid:
+                    deletes.append(msg)
+                continue
+            if action == "clear":
+                cleared.add(msg.user)
+            commands[self._moderationCommand(action, msg)] = None
+        for msg in deletes:
+            if msg.user not in cleared:
+                commands[self._moderationCommand("delete", msg)] = None
+
+        total = len(commands)
+        sent = 0
+
+        def sentOne():
+            nonlocal sent
+            sent += 1
+            if progress:
+                progress(self, sent, total)
+            if sent == total and done:
+                done(self, total)
+
+        for args in commands:
+            self.moderation.push(args, callback=sentOne)
+        if not total and done:
+            done(self, 0)
+        return total
+
     def requestBanlist(self):
-        """Request an updated banlist."""
-        self._sendCommand("blocklist", "block", "", "next", "500")
+        """Request an updated banlist, following its pages till the end."""
+        self._banlist.begin()
+        self._sendCommand("blocklist", "block", "", "next", str(BanList.pageSize))
 
     def requestUnBanlist(self):
-        """Request an updated banlist."""
-        self._sendCommand("blocklist", "unblock", "", "next", "500")
+        """Request an updated unbanlist, following its pages till the end."""
+        self._unbanlist.begin()
+        self._sendCommand("blocklist", "unblock", "", "next", str(BanList.pageSize))
 
     def rawUnban(self, name: str, ip: str, unid: str):
         """
@@ -1677,9 +2632,22 @@ class Room:
     # Util
     ####
     def _getBanRecord(self, user: User):
-        if user in self._banlist:
-            return self._banlist[user]
-        return None
+        return self._banlist.get(user)
+
+    def isBanned(self, user: Optional[User] = None, ip: Optional[str] = None,
+                 unid: Optional[str] = None) -> bool:
+        """
+        Check the banlist for a user, ip or unid, any of them matching counts.
+
+        @param user: user
+        @param ip: ip address
+        @param unid: unid
+
+        @return: whether a matching ban was found
+        """
+        return ((user is not None and user in self._banlist.records) or
+                (ip is not None and ip in self._banlist.byIp) or
+                (unid is not None and unid in self._banlist.byUnid))
 
     def _write(self, data: bytes):
         if self._wlock:
@@ -1705,16 +2673,38 @@ class Room:
             self._firstCommand = False
         else:
             terminator = b"\r\n\x00"
-        self._write(":".join(args).encode() + terminator)
+        command = ":".join(args)
+        if self._mgr.tracer is not None:
+            self._mgr.tracer.record(self, TRACE_OUT, command)
+        self._write(command.encode() + terminator)
 
     def getLevel(self, user: User):
         """get the level of user in a room"""
         if user == self.owner:
             return 2
-        if user.name in self.modnames:
+        if user in self._modFlags:
             return 1
         return 0
 
+    def getModFlags(self, user: User) -> int:
+        """
+        Get the permission bits the server gave a moderator.
+
+        @param user: the moderator
+
+        @return: the flag bits, 0 for users who aren't moderators
+        """
+        return self._modFlags.get(user, 0)
+
+    def hasModFlag(self, user: User, flag: int) -> bool:
+        """
+        Check a moderator for every bit of flag.
+
+        @param user: the moderator
+        @param flag: bits to check
+        """
+        return self._modFlags.get(user, 0) & flag == flag
+
     def getLastMessage(self, user: Optional[User] = None):
         """get last message said by user in a room"""
         if user:
@@ -1767,11 +2757,52 @@ class Room:
         @param msg: message
         """
         self.history.append(msg)
+        if self._mgr.search is not None:
+            self._mgr.search.add(msg)
         if len(self.history) > self._mgr.maxHistoryLength:
-            rest, self.history = self.history[:-self._mgr.maxHistoryLength], \
-                                 self.history[-self._mgr.maxHistoryLength:]
-            for msg in rest:
-                msg.detach()
+            self._trimHistory()
+
+    def _addHistoryBatch(self, msgs: list[Message]):
+        """
+        Add multiple messages to history, trimming it only once.
+
+        @param msgs: messages, oldest first
+        """
+        self.history.extend(msgs)
+        if self._mgr.search is not None:
+            self._mgr.search.addMany(msgs)
+        if len(self.history) > self._mgr.maxHistoryLength:
+            self._trimHistory()
+
+    def _trimHistory(self):
+        excess = len(self.history) - self._mgr.maxHistoryLength
+        search = self._mgr.search
+        for msg in self.history[:excess]:
+            msg.detach()
+            if search is not None:
+                search.remove(msg)
+        del self.history[:excess]
+
+    def _flushHistoryLog(self):
+        """Deliver the history messages received so far, oldest first."""
+        msgs = self._i_log[::-1]
+        self._i_log.clear()
+        if self._restored is not None:
+            # only what happened since the snapshot is news
+            msgs = [msg for msg in msgs if _historyKey(msg) not in self._restored]
+            self._restored = None
+        if self._mgr.hasHandler("onHistoryBatch"):
+            self._addHistoryBatch(msgs)
+            if msgs:
+                self._mgr._callEvent(self, "onHistoryBatch", msgs)
+        elif self._mgr.hasHandler("onHistoryMessage"):
+            # per message handlers expect each message to be added right after its call
+            for msg in msgs:
+                self._mgr._callEvent(self, "onHistoryMessage", msg.user, msg)
+                self._addHistory(msg)
+        else:
+            self._addHistoryBatch(msgs)
+        self._mgr._callEvent(self, "onHistoryMessageUpdate")
 
 
 ################################################################
@@ -1782,6 +2813,8 @@ class RoomManager:
     ####
     # Config
     ####
+    # on* handlers overridden by the class, filled in by __init_subclass__
+    _overriddenEvents: frozenset[str] = frozenset()
     _Room = Room
     _PM = PM
     # socket select wait/sleep time in seconds before next task tick
@@ -1796,6 +2829,65 @@ class RoomManager:
     tooBigMessage = BigMessage_Mode.Multiple
     maxLength = 1800
     maxHistoryLength = 150
+    # PM messages kept in PM.msgs, None for no limit
+    maxPMMessages: Optional[int] = None
+    # SQLite file archiving every room and PM message, see ch.archive
+    archivePath: Optional[str] = None
+    # keep a full-text index of every room's history in self.search, see ch.search
+    indexHistory = False
+    # keep where every user is and when they were last seen in self.presence,
+    # see ch.presence
+    trackPresence = False
+    # file self.presence is loaded from and saved to on stop, implies trackPresence
+    presencePath: Optional[str] = None
+    # flood and spam rules every room message is checked against, see ch.spam
+    spamRules: Optional[list[SpamRule]] = None
+    # moderation commands sent at once, then per second, see ModerationQueue
+    moderationBurst = 5
+    moderationRate = 2.0
+    # port rooms connect to, see getServer
+    roomPort = 443
+    # reconnect lost connections, see Reconnector
+    autoReconnect = False
+    reconnectDelay = 1
+    reconnectMaxDelay = 300
+    reconnectJitter = 0.5
+    reconnectTimeout = 30
+    maxConcurrentReconnects = 10
+    serverFailThreshold = 5
+    serverCooldown = 60
+    # seconds without receiving anything before a connection is considered dead,
+    # keep it above the time the server may stay quiet, None to disable
+    readTimeout: Optional[float] = None
+    tcpKeepAlive = False
+    tcpKeepIdle = 60
+    tcpKeepInterval = 10
+    tcpKeepCount = 3
+    # milliseconds unacknowledged data may stay unsent, None to disable
+    tcpUserTimeout: Optional[int] = None
+    # record traffic, event and task metrics in self.metrics
+    metricsEnabled = False
+    # warn about event handlers and tasks taking longer than this many seconds,
+    # None to disable
+    slowEventThreshold: Optional[float] = None
+    slowTaskThreshold: Optional[float] = None
+    # dump the main loop stack when a handler or task blocks it for longer than
+    # this many seconds, None to disable
+    blockedLoopThreshold: Optional[float] = None
+    # recorder of every frame in and out, see startTrace
+    tracer: Optional[TraceRecorder] = None
+    # unix socket another process takes our connections over from, see listenHandoff
+    _handoffListener: Optional[HandoffListener] = None
+    # measure the round trip of our own messages, see Room.latency
+    trackLatency = False
+    echoTimeout = 30
+    # seconds the 90th percentile round trip of a server may reach
+    # before onLatencyDegraded, None to disable
+    latencyAlertThreshold: Optional[float] = None
+    # lean room mode, turn these off for bots that only listen for commands
+    trackParticipants = True
+    fetchBanlist = True
+    loadHistory = True
 
     ####
     # Init
@@ -1806,23 +2898,120 @@ class RoomManager:
         self._password = password
         self._running = False
         self._rooms: dict[str, Room] = dict()
+        self._reconnector = Reconnector(self)
+        self._initEvents()
+        self._initMetrics()
+        self._initArchive()
+        self._initSearch()
+        self._initPresence()
+        self._initSpam()
         if self._password and pm:
             self._pm = self._PM(mgr=self)
         else:
             self._pm = None
 
+    def __init_subclass__(cls, **kw: Any):
+        super().__init_subclass__(**kw)
+        cls._overriddenEvents = frozenset(
+            name for name in dir(cls)
+            if name.startswith("on") and callable(handler := getattr(cls, name))
+            and handler is not getattr(RoomManager, name, None)
+        )
+
+    def _initEvents(self):
+        self._handlers: dict[str, Callable[..., Any]] = dict()
+        self._listening: set[str] = set(self._overriddenEvents)
+        self._listenAll = "onEventCalled" in self._listening
+
+    def _initMetrics(self):
+        self.metrics = Metrics(self.metricsEnabled)
+        self.metrics.collectors.append(self._collectMetrics)
+        self.loopLag = 0.0
+        self._serverLatency: dict[str, LatencyTracker] = dict()
+        self._degradedServers: set[str] = set()
+        self._watchdog = LoopWatchdog(self.blockedLoopThreshold) \
+            if self.blockedLoopThreshold else None
+        self._updateTiming()
+
+    def _initArchive(self):
+        self.archive = Archive(self.archivePath) if self.archivePath else None
+
+    def _initSearch(self):
+        self.search = SearchIndex() if self.indexHistory else None
+
+    def _initPresence(self):
+        if self.presencePath and os.path.exists(self.presencePath):
+            self.presence = PresenceIndex.load(self.presencePath)
+        elif self.trackPresence or self.presencePath:
+            self.presence = PresenceIndex()
+        else:
+            self.presence = None
+
+    def _initSpam(self):
+        self.spam = SpamDetector(self.spamRules) if self.spamRules else None
+
+    def _updateTiming(self):
+        watched = self._watchdog is not None
+        self._timeEvents = self.metrics.enabled or watched or \
+            self.slowEventThreshold is not None
+        self._timeTasks = self.metrics.enabled or watched or \
+            self.slowTaskThreshold is not None
+
+    def enableMetrics(self, enabled: bool = True):
+        """
+        Turn metrics recording on or off.
+
+        @param enabled: whether to record metrics
+        """
+        self.metrics.enabled = enabled
+        self._updateTiming()
+        for room in self._rooms.values():
+            room._stats = self.metrics.conn("room", room.name) if enabled else None
+        if self._pm:
+            self._pm._stats = self.metrics.conn("pm", self.name or "") if enabled else None
+
+    def _collectMetrics(self) -> list[Sample]:
+        samples: list[Sample] = [
+            ("ch_write_buffer_bytes", {"kind": "room", "conn": room.name}, len(room._wbuf))
+            for room in list(self._rooms.values())
+        ]
+        if pm := self._pm:
+            samples.append(("ch_write_buffer_bytes", {"kind": "pm", "conn": self.name or ""},
+                            len(pm._wbuf)))
+        samples.append(("ch_loop_lag_seconds", {}, self.loopLag))
+        samples.append(("ch_rooms", {}, len(self._rooms)))
+        samples.append(("ch_tasks", {}, Task.size()))
+        for key, value in self._reconnector.stats().items():
+            samples.append(("ch_reconnect_" + key, {}, value))
+        return samples
+
     ####
     # Join/leave
     ####
-    def joinRoom(self, room: str, uid: Optional[str] = None) -> Room:
+    def joinRoom(self, room: str, uid: Optional[str] = None,
+                 trackParticipants: Optional[bool] = None,
+                 fetchBanlist: Optional[bool] = None,
+                 loadHistory: Optional[bool] = None) -> Room:
         """
-        Join a room or return None if already joined.
+        Join a room or return the existing Room if already joined.
 
         @param room: room to join
+        @param trackParticipants: override the manager's userlist tracking for this room
+        @param fetchBanlist: override the manager's banlist fetching for this room
+        @param loadHistory: override the manager's history loading for this room
         """
         room = room.lower()
         if (con := self._rooms.get(room)) is None:
+            self._reconnector.cancelName(room)
             con = self._Room(room, uid, mgr=self)
+        # the flags are only used once the server is done with the initial data,
+        # so they can safely be set after connecting
+        if trackParticipants is not None:
+            con.trackParticipants = trackParticipants
+        if fetchBanlist is not None:
+            con.fetchBanlist = fetchBanlist
+        if loadHistory is not None:
+            con.loadHistory = loadHistory
         return con
 
     def leaveRoom(self, room: str):
@@ -1832,6 +3021,7 @@ class RoomManager:
         @param room: room to leave
         """
         room = room.lower()
+        self._reconnector.cancelName(room)
         if con := self._rooms.get(room):
             con.disconnect()
 
@@ -1854,6 +3044,7 @@ class RoomManager:
     def _getRooms(self): return set(self._rooms.values())
     def _getRoomNames(self): return set(self._rooms.keys())
     def _getPM(self): return self._pm
+    def _getReconnector(self): return self._reconnector
 
     user = property(_getUser)
     name = property(_getName)
@@ -1861,6 +3052,7 @@ class RoomManager:
     rooms = property(_getRooms)
     roomnames = property(_getRoomNames)
     pm = property(_getPM)
+    reconnector = property(_getReconnector)
 
     ####
     # Virtual methods
@@ -1878,8 +3070,197 @@ class RoomManager:
                 text = (text[0:ex.start]+'(unicode)'+text[ex.end:])
 
     def _callEvent(self, conn: Conn, evt: str, *args: ..., **kw: ...):
-        getattr(self, evt)(conn, *args, **kw)
-        self.onEventCalled(conn, evt, *args, **kw)
+        if not self._listenAll and evt not in self._listening:
+            # only the no-op of RoomManager would run
+            return
+        if (handler := self._handlers.get(evt)) is None:
+            handler = self._handlers[evt] = getattr(self, evt)
+        if self._timeEvents:
+            if self._watchdog:
+                self._watchdog.enter(evt)
+            start = time.perf_counter()
+            try:
+                handler(conn, *args, **kw)
+            finally:
+                self._eventTimed(conn, evt, time.perf_counter() - start)
+        else:
+            handler(conn, *args, **kw)
+        if self._listenAll:
+            self.onEventCalled(conn, evt, *args, **kw)
+
+    def _eventTimed(self, conn: Conn, evt: str, duration: float):
+        if self._watchdog:
+            self._watchdog.leave()
+        if self.metrics.enabled:
+            self.metrics.event(evt, duration)
+        if self.slowEventThreshold is not None and duration > self.slowEventThreshold:
+            print(f"[RoomManager][slow] {evt} in {getattr(conn, 'name', 'PM')} "
+                  f"took {duration:.3f}s")
+
+    def _latencySample(self, room: Room, rtt: float):
+        if (tracker := self._serverLatency.get(room._server)) is None:
+            tracker = self._serverLatency[room._server] = LatencyTracker()
+        tracker.add(rtt)
+        if self.metrics.enabled:
+            self.metrics.timing("echo_rtt", rtt)
+        if self.latencyAlertThreshold is None or len(tracker) < 10:
+            return
+        p90 = tracker.percentile(90) or 0.0
+        if room._server not in self._degradedServers:
+            if p90 > self.latencyAlertThreshold:
+                self._degradedServers.add(room._server)
+                self._callEvent(room, "onLatencyDegraded", room._server, p90)
+        elif p90 < self.latencyAlertThreshold * 0.8:
+            # some headroom so a server hovering around the threshold doesn't flap
+            self._degradedServers.discard(room._server)
+            self._callEvent(room, "onLatencyRecovered", room._server, p90)
+
+    def createTransport(self, conn: Conn) -> Transport:
+        """
+        Create the byte stream a room or the PM connects through,
+        override to use another transport, like a LoopbackTransport.
+
+        @param conn: the Room or PM about to connect
+
+        @return: an unconnected transport
+        """
+        sock = socket.socket()
+        sock.setblocking(False)
+        _setSockOpts(sock, self)
+        return sock
+
+    def getServer(self, room: str) -> str:
+        """
+        Get the server host for a room, override to connect somewhere else,
+        like a ch.fakeserver.FakeServer.
+
+        @param room: room name
+
+        @return: the server's hostname
+        """
+        return getServer(room)
+
+    def startTrace(self, path: str):
+        """
+        Record every frame going in and out to a trace file,
+        it can be replayed offline with ch.trace.replay.
+
+        @param path: trace file, overwritten if it exists
+        """
+        self.stopTrace()
+        self.tracer = TraceRecorder(path, {"name": self.name})
+
+    def stopTrace(self):
+        """Stop recording and close the trace file."""
+        if self.tracer is not None:
+            self.tracer.close()
+            self.tracer = None
+
+    def listenHandoff(self, path: str):
+        """
+        Hand every connection over to the next process calling takeOver
+        on the same path, then stop. See ch.handoff.
+
+        @param path: path of the Unix socket to listen on
+        """
+        from .handoff import HandoffListener
+        if self._handoffListener:
+            self._handoffListener.close()
+        self._handoffListener = HandoffListener(self, path)
+
+    def takeOver(self, path: str) -> list[Room]:
+        """
+        Resume the connections of the process listening on path in place,
+        without reconnecting. The manager should be created with pm=False,
+        the PM connection comes along.
+
+        @param path: path of the Unix socket the other process listens on
+
+        @return: the rooms taken over
+        """
+        from .handoff import takeOver
+        return takeOver(self, path)
+
+    def snapshot(self, path: str):
+        """
+        Save rooms, history, banlists, mods, PM contacts/status and the
+        User registry to a file, see ch.snapshot.
+
+        @param path: snapshot file, replaced if it exists
+        """
+        from .snapshot import snapshot
+        snapshot(self, path)
+
+    def restore(self, path: str) -> list[Room]:
+        """
+        Join the rooms of a snapshot with their state already loaded,
+        so only what changed since is fetched and delivered to the handlers.
+
+        @param path: snapshot file
+
+        @return: the rooms joined
+        """
+        from .snapshot import restore
+        return restore(self, path)
+
+    def getServerLatency(self, server: str) -> LatencyTracker | None:
+        """
+        Get the round trip samples of every room on a tag server.
+
+        @param server: server hostname, see getServer
+
+        @return: LatencyTracker or None without samples
+        """
+        return self._serverLatency.get(server)
+
+    def _runTimedTask(self, task: Task):
+        """Run a task, recording loop lag and run time."""
+        name = getattr(task.func, "__qualname__", repr(task.func))
+        if task.timeout >= 0:
+            # how late the task starts compared to when it was due
+            self.loopLag = max(0.0, time.time() - task.target)
+            if self.metrics.enabled:
+                self.metrics.timing("loop_lag", self.loopLag)
+        if self._watchdog:
+            self._watchdog.enter(name)
+        start = time.perf_counter()
+        try:
+            task.func(*task.args, **task.kw)
+        finally:
+            duration = time.perf_counter() - start
+            if self._watchdog:
+                self._watchdog.leave()
+            if self.metrics.enabled:
+                self.metrics.task(name, duration)
+            if self.slowTaskThreshold is not None and duration > self.slowTaskThreshold:
+                owner = getattr(task.func, "__self__", None)
+                where = f" in {owner.name}" if isinstance(owner, Room) else ""
+                print(f"[RoomManager][slow] task {name}{where} took {duration:.3f}s")
+
+    def hasHandler(self, evt: str) -> bool:
+        """
+        Check if anything listens for an event.
+
+        Events nobody listens for may be skipped entirely,
+        along with the work needed to build their arguments.
+
+        @param evt: the event name, like "onRaw"
+
+        @return: whether the event is overridden or subscribed to
+        """
+        return self._listenAll or evt in self._listening
+
+    def subscribe(self, *evts: str):
+        """
+        Explicitly listen for events that aren't overridden in the class,
+        like handlers assigned to the instance after init.
+
+        @param evts: the event names
+        """
+        for evt in evts:
+            self._listening.add(evt)
+            self._handlers.pop(evt, None)
+        self._listenAll = "onEventCalled" in self._listening
 
     def onConnect(self, room: Room):
         """
@@ -1984,6 +3365,16 @@ class RoomManager:
         @param message: the message that got added
         """
 
+    def onHistoryBatch(self, room: Room, messages: list[Message]):
+        """
+        Called once per set of history received, after it got added to history.
+        Cheaper than onHistoryMessage when lots of rooms (re)connect at once,
+        overriding it replaces the onHistoryMessage calls.
+
+        @param room: room where the event occurred
+        @param messages: the messages that got added, oldest first
+        """
+
     def onHistoryMessageUpdate(self, room: Room):
         """
         Called when a set of history has been received.
@@ -2024,6 +3415,44 @@ class RoomManager:
         @param room: room where the event occurred
         """
 
+    def onStale(self, room: Room):
+        """
+        Called when nothing was received for longer than readTimeout,
+        the room gets reconnected after.
+
+        @param room: room where the event occurred
+        """
+
+    def onLatencyDegraded(self, room: Room, server: str, p90: float):
+        """
+        Called when the round trip of our own messages on a server got too slow.
+
+        @param room: room where the threshold got crossed
+        @param server: the degraded tag server
+        @param p90: 90th percentile round trip in seconds
+        """
+
+    def onLatencyRecovered(self, room: Room, server: str, p90: float):
+        """
+        Called when a degraded server is back below the threshold.
+
+        @param room: room where the threshold got crossed
+        @param server: the recovered tag server
+        @param p90: 90th percentile round trip in seconds
+        """
+
+    def onSpamDetected(self, room: Room, user: User, message: Message, rule: SpamRule,
+                       count: float):
+        """
+        Called when a message goes over the limit of a spam rule, see spamRules.
+
+        @param room: room where it happened
+        @param user: sender of the message
+        @param message: the message
+        @param rule: the tripped rule
+        @param count: messages within the window of the rule
+        """
+
     def onUserCountChange(self, room: Room):
         """
         Called when the user count changes.
@@ -2084,6 +3513,14 @@ class RoomManager:
         @param pm: the pm
         """
 
+    def onPMStale(self, pm: PM):
+        """
+        Called when nothing was received from the pm for longer than readTimeout,
+        the pm gets reconnected after
+
+        @param pm: the pm
+        """
+
     def onPMMessage(self, pm: PM, user: User, message: Message):
         """
         Called when a message is received
@@ -2218,7 +3655,9 @@ class RoomManager:
         # def dumbfunc(self):
         #    self.setTimeout(0, self.dumbfunc)
 
-        if timeout == 0 and Task.running_task is not None and Task.running_task.func == func:
+        taskClass = self._taskClass()
+        running = taskClass.running_task
+        if timeout == 0 and running is not None and running.func == func:
             print('[task][warning] `timeout == 0` will result in high cpu usage with '
                   '"interval usage", use -1 timeout if intended to run once per tick, '
                   'or a reasonable amount of timeout like 0.2 (5 times per second)')
@@ -2229,7 +3668,7 @@ class RoomManager:
             raise RuntimeError('Preemptively exiting to prevent possible log flood causing '
                                'disk space exhaustion')
 
-        task = Task(
+        task = taskClass(
             mgr=self,
             timeout=timeout,
             func=func,
@@ -2255,7 +3694,7 @@ class RoomManager:
                   'with "interval usage", use -1 timeout if intended to run once per tick, '
                   'or a reasonable amount of timeout like 0.2 (5 times per second)')
 
-        task = Task(
+        task = self._taskClass()(
             mgr=self,
             timeout=timeout,
             func=func,
@@ -2265,6 +3704,11 @@ class RoomManager:
         )
         return task
 
+    def _taskClass(self) -> type[Task]:
+        """Return the scheduler new tasks go to."""
+        # looked up every time, the asyncio mixins replace ch.Task
+        return Task
+
     def removeTask(self, task: Task):
         """
         Sugar for task.cancel for backward compatibility
@@ -2289,9 +3733,11 @@ class RoomManager:
         self._pm = None
 
     def getConnections(self):
-        li: dict[socket.socket, Conn] = dict((x.sock, x) for x in self._rooms.values())
+        li: dict[Transport, Conn] = dict((x.sock, x) for x in self._rooms.values())
         if self._pm:
             li[self.pm.sock] = self._pm
+        if listener := self._handoffListener:
+            li[listener.sock] = listener  # type: ignore
         return li
 
     ####
@@ -2302,9 +3748,11 @@ class RoomManager:
         self._running = True
         while self._running:
             time_to_next_task = Task.tick()
+            # a task may have stopped us, don't wait on the PM connection for nothing
+            if not self._running:
+                break
 
             conns = self.getConnections()
-            wsocks = [sock for sock, x in conns.items() if x.pendingWrite]
 
             if not conns:
                 if time_to_next_task is None:
@@ -2322,13 +3770,36 @@ class RoomManager:
 
                 continue
 
-            rd, wr, _ = select.select(conns, wsocks, [], time_to_next_task)
-            for sock in rd:
-                con = conns[sock]
-                con.rfeed()
-            for sock in wr:
-                con = conns[sock]
-                con.wfeed()
+            self._poll(conns, time_to_next_task)
+
+    def _poll(self, conns: dict[Transport, Conn], timeout: Optional[float]):
+        """
+        Wait up to timeout seconds for connections to be readable or writable
+        and feed the ones that are.
+
+        @param conns: {transport: connection}
+        @param timeout: seconds to wait at most, None to wait until one is ready
+        """
+        wsocks = [sock for sock, x in conns.items() if x.pendingWrite]
+        # other transports may hold data they already read, and in memory ones
+        # have no file descriptor to select on, they are always writable
+        if others := [sock for sock in conns if not isinstance(sock, socket.socket)]:
+            ready = [sock for sock in others if sock.pendingRead]  # type: ignore
+            memory = {sock for sock in others if sock.fileno() < 0}
+            wready = [sock for sock in wsocks if sock in memory]
+            rd, wr, _ = select.select([sock for sock in conns if sock not in memory],
+                                      [sock for sock in wsocks if sock not in memory], [],
+                                      0 if ready or wready else timeout)
+            rd += [sock for sock in ready if sock not in rd]
+            wr += wready
+        else:
+            rd, wr, _ = select.select(conns, wsocks, [], timeout)
+        for sock in rd:
+            con = conns[sock]
+            con.rfeed()
+        for sock in wr:
+            con = conns[sock]
+            con.wfeed()
 
     @classmethod
     def easy_start(cls, rooms: Optional[list[str]] = None,
@@ -2364,9 +3835,14 @@ class RoomManager:
         self.main()
 
     def stop(self):
+        self._reconnector.cancelAll()
         for conn in list(self._rooms.values()):
             conn.disconnect()
         self._running = False
+        if self.archive:
+            self.archive.flush()
+        if self.presence is not None and self.presencePath:
+            self.presence.save(self.presencePath)
 
     ####
     # Commands
@@ -0,0 +1,217 @@
+"""
+Persistent append-only archive of room and PM messages in SQLite
+
+Messages are queued by the main loop and written in batches by a
+background thread, so archiving costs the loop a queue put per message.
+Indexes by room/time, user/time and unid keep the usual lookups fast
+however big the archive grows:
+
+    class Bot(ch.RoomManager):
+        archivePath = "messages.db"
+
+    bot.archive.byUser("someone", limit=1000)
+
+Messages queued within the last flushInterval may not be visible to
+queries yet, call flush() first when that matters.
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING, NamedTuple, Optional
+import queue
+import sqlite3
+import threading
+import time
+
+if TYPE_CHECKING:
+    from . import Message
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    room TEXT,
+    time REAL NOT NULL,
+    user TEXT NOT NULL,
+    body TEXT NOT NULL,
+    raw TEXT NOT NULL,
+    ip TEXT NOT NULL,
+    unid TEXT NOT NULL,
+    puid TEXT NOT NULL,
+    msgid TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_room_time ON messages (room, time);
+CREATE INDEX IF NOT EXISTS messages_user_time ON messages (user, time);
+DROP INDEX IF EXISTS messages_unid;
+CREATE INDEX IF NOT EXISTS messages_unid_time ON messages (unid, time) WHERE unid != '';
+"""
+_COLUMNS = "room, time, user, body, raw, ip, unid, puid, msgid"
+
+
+class ArchivedMessage(NamedTuple):
+    """A message read back from the archive, room is None for PM messages"""
+    room: Optional[str]
+    time: float
+    user: str
+    body: str
+    raw: str
+    ip: str
+    unid: str
+    puid: str
+    msgid: Optional[str]
+
+
+class Archive:
+    """
+    SQLite message archive written from a background thread
+
+    @param path: database file, created if missing
+    @param batchSize: rows written per transaction at most
+    @param flushInterval: seconds a queued message waits at most before being written
+    """
+    def __init__(self, path: str, batchSize: int = 1000, flushInterval: float = 1.0):
+        self.path = path
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.written = 0
+        self._queue: queue.SimpleQueue[tuple[Optional[str], float, str, str, str, str, str,
+                                             str, Optional[str]] | threading.Event | None] = \
+            queue.SimpleQueue()
+        # one connection per thread, sqlite3 connections can't be shared
+        self._local = threading.local()
+        db = sqlite3.connect(path)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(_SCHEMA)
+        db.close()
+        self._thread = threading.Thread(target=self._writer, name="ch-archive", daemon=True)
+        self._thread.start()
+
+    def _db(self) -> sqlite3.Connection:
+        if (db := getattr(self._local, "db", None)) is None:
+            db = self._local.db = sqlite3.connect(self.path)
+        return db
+
+    ####
+    # Writing
+    ####
+    def add(self, msg: Message, room: Optional[str]):
+        """
+        Queue a message for writing.
+
+        @param msg: the message
+        @param room: room name, None for a PM message
+        """
+        self._queue.put((room, msg.time, msg.user.name, msg.body, msg.raw, msg.ip,
+                         msg.unid, msg.puid, msg.msgid))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every message queued so far is written.
+
+        @param timeout: seconds to wait at most, None for no limit
+
+        @return: whether everything got written in time
+        """
+        if not self._thread.is_alive():
+            return False
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        """Write what is queued and stop the writer thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _writer(self):
+        db = self._db()
+        running = True
+        while running:
+            rows = []
+            waiting: list[threading.Event] = []
+            deadline = None
+            while len(rows) < self.batchSize:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                if isinstance(item, threading.Event):
+                    waiting.append(item)
+                    break
+                rows.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flushInterval
+            if rows:
+                with db:
+                    db.executemany(f"INSERT INTO messages ({_COLUMNS}) "
+                                   "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                self.written += len(rows)
+            for done in waiting:
+                done.set()
+        db.close()
+
+    ####
+    # Queries
+    ####
+    def _query(self, where: str, args: tuple[object, ...], limit: int,
+               order: str = "DESC") -> list[ArchivedMessage]:
+        cursor = self._db().execute(
+            f"SELECT {_COLUMNS} FROM messages WHERE {where} "
+            f"ORDER BY time {order} LIMIT ?", (*args, limit))
+        return [ArchivedMessage(*row) for row in cursor]
+
+    def byUser(self, user: str, limit: int = 1000,
+               room: Optional[str] = None) -> list[ArchivedMessage]:
+        """
+        Get the latest messages of a user across rooms and PM, newest first.
+
+        @param user: user name
+        @param limit: number of messages at most
+        @param room: only the messages in this room
+
+        @return: list of ArchivedMessage
+        """
+        if room is None:
+            return self._query("user = ?", (user.lower(),), limit)
+        return self._query("user = ? AND room = ?", (user.lower(), room.lower()), limit)
+
+    def byRoom(self, room: str, since: float = 0, until: float = float("inf"),
+               limit: int = 1000) -> list[ArchivedMessage]:
+        """
+        Get the messages of a room within a time range, newest first.
+
+        @param room: room name
+        @param since: unix time of the oldest message
+        @param until: unix time of the newest message
+
+        @return: list of ArchivedMessage
+        """
+        return self._query("room = ? AND time BETWEEN ? AND ?",
+                           (room.lower(), since, until), limit)
+
+    def byUnid(self, unid: str, limit: int = 1000) -> list[ArchivedMessage]:
+        """
+        Get the messages sent with a unid, newest first.
+
+        @param unid: unid
+
+        @return: list of ArchivedMessage
+        """
+        # repeat the condition of the partial index so SQLite can use it
+        return self._query("unid = ? AND unid != ''", (unid,), limit)
+
+    def pm(self, user: str, limit: int = 1000) -> list[ArchivedMessage]:
+        """
+        Get the PM messages received from a user, newest first.
+
+        @param user: user name
+
+        @return: list of ArchivedMessage
+        """
+        return self._query("room IS NULL AND user = ?", (user.lower(),), limit)
+
+    def count(self) -> int:
+        """Return the number of messages written so far."""
+        return self._db().execute("SELECT count(*) FROM messages").fetchone()[0]
@@ -0,0 +1,280 @@
+"""
+Benchmarks of the parser, scheduler, history and userlist hot paths
+
+Every benchmark runs a fixed amount of operations, the best of a few
+repeats is reported. Results can be written to JSON and compared against
+the JSON of an older run:
+
+    $ python -m ch.bench --output 1.4.json
+    $ python -m ch.bench --compare 1.3.json
+"""
+from __future__ import annotations
+from typing import Any, Callable, Optional
+import argparse
+import importlib.metadata
+import json
+import platform
+import random
+import time
+
+import ch
+from .fakeserver import FakeServer
+
+# name -> function doing the work and returning how many operations it did
+BENCHMARKS: dict[str, Callable[[], int]] = dict()
+
+
+def bench(name: str):
+    def decorator(func: Callable[[], int]):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def _offlineRoom(mgr: ch.RoomManager, name: str = "bench") -> ch.Room:
+    """Get a connected looking room that never touches a socket."""
+    room = mgr._Room(name, None, mgr, connect=False)
+    room.connected = True
+    room._bot_name = "bot"
+    room.owner = ch.User("owner")
+    room.pingTask = mgr.setInterval(3600, lambda: None)
+    return room
+
+
+def _resetTasks():
+    ch.Task._tasks_queue.clear()
+    ch.Task._tasks.clear()
+    ch.Task._tasks_once.clear()
+    ch.Task._removed = 0
+
+
+def _corpus(count: int) -> list[str]:
+    """Frames like the ones of a busy room, in the order the server sends them."""
+    frames: list[str] = []
+    now = time.time()
+    for i in range(count // 4):
+        name = f"user{i % 200}"
+        uid = 10 ** 7 + i
+        frames.append(f"b:{now + i:.2f}:{name}::{uid}:{uid}:{i:08x}:127.0.0.1:0::"
+                      f'<n{i % 1000:03}/><f x12{i % 0xffffff:06x}="{i % 4}">'
+                      f"message <b>{i}</b> &amp; co")
+        frames.append(f"u:{i:08x}:{i:016x}")
+        # the first 200 join, the next 200 leave again and so on
+        frames.append(f"participant:{1 - i // 200 % 2}:{uid}:{uid}:{name}:None::{int(now)}")
+        frames.append(f"n:{200 + i % 16:x}")
+    return frames
+
+
+####
+# Micro benchmarks
+####
+@bench("clean_message")
+def _benchCleanMessage() -> int:
+    raw = '<n0f0/><f x12ff0000="1">hello <b>world</b> &amp; <i>everyone</i> in here'
+    for _ in range(20000):
+        ch._clean_message(raw)
+    return 20000
+
+
+@bench("parseFont")
+def _benchParseFont() -> int:
+    for _ in range(50000):
+        ch._parseFont(' x12ff0000="1"')
+    return 50000
+
+
+@bench("process")
+def _benchProcess() -> int:
+    mgr = ch.RoomManager(None, None, pm=False)
+    mgr.userlistEventUnique = True
+    room = _offlineRoom(mgr)
+    frames = _corpus(20000)
+    for frame in frames:
+        room._process(frame)
+    _resetTasks()
+    return len(frames)
+
+
+@bench("task_insert_10k")
+def _benchTaskInsert() -> int:
+    mgr = ch.RoomManager(None, None, pm=False)
+    for i in range(10000):
+        mgr.setTimeout(3600 + i % 97, lambda: None)
+    _resetTasks()
+    return 10000
+
+
+@bench("task_cancel_10k")
+def _benchTaskCancel() -> int:
+    mgr = ch.RoomManager(None, None, pm=False)
+    tasks = [mgr.setTimeout(3600 + i % 97, lambda: None) for i in range(10000)]
+    random.shuffle(tasks)
+    for task in tasks:
+        task.cancel()
+    ch.Task.tick()
+    _resetTasks()
+    return 10000
+
+
+@bench("task_tick_10k")
+def _benchTaskTick() -> int:
+    mgr = ch.RoomManager(None, None, pm=False)
+    calls = 0
+
+    def call():
+        nonlocal calls
+        calls += 1
+
+    for i in range(10000):
+        mgr.setTimeout(0, call)
+    ch.Task.tick()
+    _resetTasks()
+    assert calls == 10000
+    return 10000
+
+
+@bench("addHistory_100k")
+def _benchAddHistory() -> int:
+    class Mgr(ch.RoomManager):
+        maxHistoryLength = 100000
+
+    mgr = Mgr(None, None, pm=False)
+    room = _offlineRoom(mgr)
+    user = ch.User("someone")
+    for i in range(150000):
+        msg = ch.Message(timestamp=i, user=user, body="hi", raw="hi", ip="", nameColor=None,
+                         fontColor=None, fontFace=None, fontSize=None, unid="", puid="",
+                         room=room)
+        msg.attach(room, str(i))
+        room._addHistory(msg)
+    _resetTasks()
+    return 150000
+
+
+@bench("participant_churn_5k")
+def _benchParticipantChurn() -> int:
+    mgr = ch.RoomManager(None, None, pm=False)
+    room = _offlineRoom(mgr)
+    now = int(time.time())
+    room._rcmd_g_participants(";".join(f"{i}:{now}:{i}:user{i}:None:0"
+                                       for i in range(5000)).split(":"))
+    for i in range(10000):
+        n = random.randrange(5000)
+        room._rcmd_participant(["0", str(n), str(n), f"user{n}", "None", "", str(now)])
+        room._rcmd_participant(["1", str(n), str(n), f"user{n}", "None", "", str(now)])
+    _resetTasks()
+    return 20000
+
+
+####
+# Macro benchmark
+####
+@bench("end_to_end")
+def _benchEndToEnd() -> int:
+    """Messages received in 2 seconds from a local server, 100 rooms at 200 msgs/sec."""
+    server = FakeServer(users=20, rate=200, history=0)
+    server.start()
+    received = 0
+
+    class Bot(ch.RoomManager):
+        def onMessage(self, room, user, message):
+            nonlocal received
+            received += 1
+
+    bot = server.manager(Bot)("bot", "password", pm=False)
+    for i in range(100):
+        bot.joinRoom(f"bench{i}")
+    bot.setTimeout(2, bot.stop)
+    bot.main()
+    server.stop()
+    _resetTasks()
+    return received
+
+
+@bench("end_to_end_loopback")
+def _benchEndToEndLoopback() -> int:
+    """Same as end_to_end through in memory transports, the server runs in the same thread."""
+    server = FakeServer(users=20, rate=200, history=0)
+    received = 0
+
+    class Bot(ch.RoomManager):
+        def onMessage(self, room, user, message):
+            nonlocal received
+            received += 1
+
+    bot = server.loopback(Bot)("bot", "password", pm=False)
+    for i in range(100):
+        bot.joinRoom(f"bench{i}")
+    bot.setTimeout(2, bot.stop)
+    bot.main()
+    _resetTasks()
+    return received
+
+
+def run(names: Optional[list[str]] = None, repeat: int = 3) -> dict[str, dict[str, float]]:
+    """
+    Run benchmarks.
+
+    @param names: benchmarks to run, all of them if None
+    @param repeat: runs per benchmark, the fastest one is kept
+
+    @return: {name: {"ops": ..., "seconds": ..., "ops_per_sec": ...}}
+    """
+    results: dict[str, dict[str, float]] = dict()
+    for name in names or BENCHMARKS:
+        best: Optional[tuple[float, int]] = None
+        # wall clock bound by design
+        for _ in range(1 if name.startswith("end_to_end") else repeat):
+            start = time.perf_counter()
+            ops = BENCHMARKS[name]()
+            seconds = time.perf_counter() - start
+            if best is None or ops / seconds > best[1] / best[0]:
+                best = (seconds, ops)
+        assert best is not None
+        results[name] = {"ops": best[1], "seconds": best[0], "ops_per_sec": best[1] / best[0]}
+    return results
+
+
+def _version() -> str:
+    try:
+        return importlib.metadata.version("ch")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ch hot paths")
+    parser.add_argument("names", nargs="*",
+                        help="benchmarks to run, all by default: " + ", ".join(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of an older run to compare against")
+    args = parser.parse_args()
+    if unknown := set(args.names) - set(BENCHMARKS):
+        parser.error("unknown benchmarks: " + ", ".join(sorted(unknown)))
+
+    results = run(args.names or None, args.repeat)
+    old: dict[str, Any] = dict()
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)["results"]
+
+    for name, result in results.items():
+        line = f"{name:24} {result['ops_per_sec']:>14,.0f} ops/s"
+        if name in old:
+            line += f"  {result['ops_per_sec'] / old[name]['ops_per_sec']:6.2f}x"
+        print(line)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "version": _version(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "time": time.time(),
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+"""
+Multi-process cluster mode
+
+A coordinator spawns worker processes, each running its own manager loop,
+and places rooms on them by consistent hashing of the room name, so adding
+or removing a worker only moves the rooms hashed to it. Everything goes
+through local pipes, no network is involved.
+
+Events run in the workers like they always do, except for the on* handlers
+the Cluster subclass overrides, those get forwarded and run in the
+coordinator with stand-ins of the room and the PM:
+
+    class Bot(ch.RoomManager):
+        def onConnect(self, room):
+            print("connected to", room.name)
+
+    class Coordinator(ch.cluster.Cluster):
+        def onMessage(self, room, user, message):
+            if message.body == "!ping":
+                room.message("pong")
+
+    cluster = Coordinator(Bot, workers=4, name="name", password="password")
+    cluster.joinRoom("room")
+    cluster.main()
+"""
+from __future__ import annotations
+from typing import Any, Callable, Optional
+import bisect
+import hashlib
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import traceback
+
+import ch
+
+
+################################################################
+# Placement
+################################################################
+class HashRing:
+    """
+    Consistent hash ring
+
+    @param nodes: initial nodes
+    @param replicas: points per node on the ring, more spread the keys more evenly
+    """
+    def __init__(self, nodes: tuple[int, ...] = (), replicas: int = 128):
+        self.replicas = replicas
+        self._points: list[int] = list()
+        self._nodes: list[int] = list()
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def __len__(self):
+        return len(set(self._nodes))
+
+    def add(self, node: int):
+        for i in range(self.replicas):
+            point = self._hash(f"{node}#{i}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._nodes.insert(index, node)
+
+    def remove(self, node: int):
+        keep = [(p, n) for p, n in zip(self._points, self._nodes) if n != node]
+        self._points = [p for p, _n in keep]
+        self._nodes = [n for _p, n in keep]
+
+    def get(self, key: str) -> int:
+        """Get the node owning a key."""
+        if not self._points:
+            raise LookupError("No node on the ring")
+        index = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._nodes[index]
+
+
+################################################################
+# Serialization
+################################################################
+# Rooms, users and messages can't cross processes as they are, they are
+# replaced by tagged tuples and resolved again on the other side
+def _pack(value: Any) -> Any:
+    if isinstance(value, ch.Room) or isinstance(value, RoomProxy):
+        return ("@room", value.name)
+    if isinstance(value, ch.PM) or isinstance(value, PMProxy):
+        return ("@pm",)
+    if isinstance(value, ch.User):
+        return ("@user", value.name)
+    if isinstance(value, ch.Message):
+        room = value.room
+        return ("@msg", room.name if isinstance(room, (ch.Room, RoomProxy)) else None, {
+            "msgid": value.msgid, "timestamp": value.time, "user": value.user.name,
+            "body": value.body, "raw": value.raw, "ip": value.ip,
+            "nameColor": value.nameColor, "fontColor": value.fontColor,
+            "fontFace": value.fontFace, "fontSize": value.fontSize,
+            "unid": value.unid, "puid": value.puid})
+    if isinstance(value, (list, tuple, set)):
+        return type(value)(_pack(v) for v in value)
+    if isinstance(value, dict):
+        return {k: _pack(v) for k, v in value.items()}
+    return value
+
+
+def _unpack(value: Any, room: Callable[[str], Any], pm: Callable[[], Any],
+            message: Callable[[Any, dict[str, Any]], Any]) -> Any:
+    if isinstance(value, tuple) and value and isinstance(value[0], str) \
+            and value[0].startswith("@"):
+        tag = value[0]
+        if tag == "@room":
+            return room(value[1])
+        if tag == "@pm":
+            return pm()
+        if tag == "@user":
+            return ch.User(value[1])
+        if tag == "@msg":
+            return message(room(value[1]) if value[1] else pm(), value[2])
+    if isinstance(value, (list, tuple, set)):
+        return type(value)(_unpack(v, room, pm, message) for v in value)
+    if isinstance(value, dict):
+        return {k: _unpack(v, room, pm, message) for k, v in value.items()}
+    return value
+
+
+################################################################
+# Worker side
+################################################################
+class _Control:
+    """The pipe to the coordinator, selected on by the worker loop like a connection"""
+    connected = True
+    pendingRead = False
+    pendingWrite = False
+    _server = "coordinator"
+
+    def __init__(self, mgr: ch.RoomManager, pipe: multiprocessing.connection.Connection):
+        self._mgr = mgr
+        self.pipe = pipe
+        self.sock = self
+
+    def fileno(self) -> int:
+        return self.pipe.fileno()
+
+    def rfeed(self):
+        try:
+            while self.pipe.poll():
+                self._mgr._clusterCommand(*self.pipe.recv())  # type: ignore
+        except EOFError:
+            # the coordinator is gone
+            self._mgr._clusterCommand("stop")  # type: ignore
+
+    def wfeed(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+
+def _workerMessage(room: Any, data: dict[str, Any]) -> Any:
+    # messages from the coordinator refer to messages the worker knows
+    if data["msgid"] is not None and room is not None:
+        return room.msgs.get(data["msgid"])
+    return None
+
+
+def _worker(mgrClass: type[ch.RoomManager], name: Optional[str], password: Optional[str],
+            pm: bool, forward: frozenset[str], pipe: multiprocessing.connection.Connection):
+    class Worker(mgrClass):  # type: ignore
+        def _callEvent(self, conn: ch.Conn, evt: str, *args: Any, **kw: Any):
+            if evt in forward:
+                pipe.send(("event", _pack(conn), evt, _pack(args), _pack(kw)))
+            else:
+                super()._callEvent(conn, evt, *args, **kw)
+
+        def hasHandler(self, evt: str) -> bool:
+            return evt in forward or super().hasHandler(evt)
+
+        def getConnections(self):
+            conns = super().getConnections()
+            conns[self._control] = self._control
+            return conns
+
+        def _clusterCommand(self, cmd: str, *args: Any):
+            if cmd == "join":
+                if not self.getRoom(args[0]):
+                    self.joinRoom(args[0])
+            elif cmd == "leave":
+                self.leaveRoom(args[0])
+            elif cmd == "call" or cmd == "pmcall":
+                target = self.getRoom(args[0]) if cmd == "call" else self.pm
+                if target is None:
+                    return
+                unpack: Callable[[Any], Any] = lambda v: _unpack(
+                    v, self.getRoom, lambda: self.pm, _workerMessage)
+                getattr(target, args[1])(*unpack(args[2]), **unpack(args[3]))
+            elif cmd == "stop":
+                self.stop()
+                if self._pm:
+                    self._pm.disconnect()
+
+    mgr = Worker(name, password, pm=pm)
+    mgr._control = _Control(mgr, pipe)
+    mgr.main()
+    pipe.close()
+
+
+################################################################
+# Coordinator side
+################################################################
+class RoomProxy:
+    """
+    Coordinator side stand-in of a room living in a worker
+
+    Any Room method can be called on it, the call is sent to the owning
+    worker without waiting, return values are lost.
+    """
+    def __init__(self, cluster: Cluster, name: str):
+        self._cluster = cluster
+        self.name = name.lower()
+
+    def __getattr__(self, method: str) -> Callable[..., None]:
+        if method.startswith("_"):
+            raise AttributeError(method)
+        return lambda *args, **kw: self._cluster._send(
+            self._cluster.rooms[self.name], ("call", self.name, method, _pack(args), _pack(kw)))
+
+    def __repr__(self):
+        return f"<RoomProxy: {self.name}>"
+
+
+class PMProxy:
+    """Coordinator side stand-in of the PM, living in the first worker"""
+    def __init__(self, cluster: Cluster):
+        self._cluster = cluster
+
+    def __getattr__(self, method: str) -> Callable[..., None]:
+        if method.startswith("_"):
+            raise AttributeError(method)
+        return lambda *args, **kw: self._cluster._send(
+            0, ("pmcall", None, method, _pack(args), _pack(kw)))
+
+
+class Cluster:
+    """
+    Coordinator of worker processes each running a manager
+
+    @param mgrClass: the RoomManager (sub)class the workers run
+    @param workers: amount of worker processes
+    @param name: name to join as
+    @param password: password to join with
+    @param pm: connect to PM, from the first worker
+    @param forward: events to run in the coordinator,
+                    defaults to the on* handlers the Cluster subclass overrides
+    """
+    _overriddenEvents: frozenset[str] = frozenset()
+
+    def __init_subclass__(cls, **kw: Any):
+        super().__init_subclass__(**kw)
+        cls._overriddenEvents = frozenset(
+            attr for attr in dir(cls) if attr.startswith("on") and getattr(cls, attr, None)
+            is not getattr(Cluster, attr, None) and callable(getattr(cls, attr)))
+
+    def __init__(self, mgrClass: type[ch.RoomManager], workers: Optional[int] = None,
+                 name: Optional[str] = None, password: Optional[str] = None, pm: bool = True,
+                 forward: Optional[set[str]] = None):
+        self.mgrClass = mgrClass
+        self.name = name
+        self.password = password
+        self.forward = frozenset(self._overriddenEvents if forward is None else forward)
+        # room name -> worker index
+        self.rooms: dict[str, int] = dict()
+        self.ring = HashRing()
+        self.pm = PMProxy(self)
+        self._pm = pm and bool(password)
+        self._workers: dict[int, tuple[multiprocessing.process.BaseProcess,
+                                       multiprocessing.connection.Connection]] = dict()
+        self._proxies: dict[str, RoomProxy] = dict()
+        self._running = False
+        for _ in range(workers or os.cpu_count() or 1):
+            self.addWorker()
+
+    ####
+    # Workers
+    ####
+    @property
+    def workers(self) -> list[int]:
+        return sorted(self._workers)
+
+    def addWorker(self) -> int:
+        """
+        Start a worker and move the rooms that hash to it over.
+
+        @return: index of the worker
+        """
+        index = max(self._workers, default=-1) + 1
+        parent, child = multiprocessing.Pipe()
+        # the first worker connects to PM
+        process = multiprocessing.Process(
+            target=_worker, name=f"ch-worker-{index}", daemon=True,
+            args=(self.mgrClass, self.name, self.password, self._pm and index == 0,
+                  self.forward, child))
+        process.start()
+        child.close()
+        self._workers[index] = (process, parent)
+        self.ring.add(index)
+        self._rebalance()
+        return index
+
+    def removeWorker(self, index: int):
+        """Stop a worker, its rooms move to the remaining ones."""
+        if index == 0 and self._pm:
+            raise ValueError("The first worker holds the PM connection")
+        self._send(index, ("stop",))
+        self._dropWorker(index)
+
+    def _dropWorker(self, index: int):
+        if (worker := self._workers.pop(index, None)) is None:
+            # already gone, e.g. stop() ran from a handler of the same batch
+            return
+        process, pipe = worker
+        self.ring.remove(index)
+        pipe.close()
+        process.join(5)
+        for room, owner in list(self.rooms.items()):
+            if owner == index:
+                del self.rooms[room]
+                if self._workers:
+                    self.joinRoom(room)
+
+    def _rebalance(self):
+        for room, owner in list(self.rooms.items()):
+            if (target := self.ring.get(room)) != owner:
+                self._send(owner, ("leave", room))
+                self._send(target, ("join", room))
+                self.rooms[room] = target
+
+    def _send(self, index: int, command: tuple[Any, ...]):
+        if (worker := self._workers.get(index)) is not None:
+            try:
+                worker[1].send(command)
+            except (BrokenPipeError, EOFError, OSError):
+                pass
+
+    ####
+    # Rooms
+    ####
+    def joinRoom(self, room: str) -> RoomProxy:
+        """Join a room on the worker it hashes to."""
+        # like RoomManager.joinRoom, so a room hashes to one worker whatever the case
+        room = room.lower()
+        if room not in self.rooms:
+            self.rooms[room] = self.ring.get(room)
+            self._send(self.rooms[room], ("join", room))
+        return self.getRoom(room)
+
+    def leaveRoom(self, room: str):
+        room = room.lower()
+        if (index := self.rooms.pop(room, None)) is not None:
+            self._send(index, ("leave", room))
+            self._proxies.pop(room, None)
+
+    def getRoom(self, room: str) -> RoomProxy:
+        room = room.lower()
+        if (proxy := self._proxies.get(room)) is None:
+            proxy = self._proxies[room] = RoomProxy(self, room)
+        return proxy
+
+    def _message(self, room: Any, data: dict[str, Any]) -> ch.Message:
+        msg = ch.Message(room=room, **dict(data, user=ch.User(data["user"])))
+        msg.msgid = data["msgid"]
+        return msg
+
+    ####
+    # Main
+    ####
+    def main(self):
+        """Dispatch forwarded events until stopped or every worker exited."""
+        self._running = True
+        while self._running and self._workers:
+            pipes = {pipe: index for index, (_process, pipe) in self._workers.items()}
+            for pipe in multiprocessing.connection.wait(list(pipes)):
+                if not self._running:
+                    # a handler called stop(), the other pipes are closed
+                    break
+                try:
+                    data = pipe.recv()  # type: ignore
+                except (EOFError, OSError):
+                    if self._running:
+                        print("[Cluster][main] Worker", pipes[pipe], "exited")
+                    self._dropWorker(pipes[pipe])
+                    continue
+                self._event(*data[1:])
+
+    def _event(self, conn: Any, evt: str, args: Any, kw: Any):
+        unpack: Callable[[Any], Any] = lambda v: _unpack(
+            v, self.getRoom, lambda: self.pm, self._message)
+        try:
+            getattr(self, evt)(unpack(conn), *unpack(args), **unpack(kw))
+        except Exception:
+            # one failing handler shouldn't take every worker's events down with it
+            print(f"[Cluster][event] {evt} raised:", file=sys.stderr)
+            traceback.print_exc()
+
+    def stop(self):
+        """Stop every worker and return from main."""
+        self._running = False
+        for index in list(self._workers):
+            self._send(index, ("stop",))
+        for index in list(self._workers):
+            process, pipe = self._workers.pop(index)
+            process.join(5)
+            pipe.close()
@@ -0,0 +1,453 @@
+"""
+Local stand-in for the Chatango room and PM servers
+
+Speaks enough of both protocols for the library to connect, log in, load
+history, track participants and exchange messages, while simulated users
+chat at a fixed rate. Meant for load and scaling tests without credentials:
+
+    server = FakeServer(users=50, rate=2)
+    server.start()
+    Bot = server.manager(MyBot)
+    bot = Bot("bot", "password")
+    for i in range(1000):
+        bot.joinRoom(f"room{i}")
+    bot.main()
+
+or standalone, to be used from another process:
+
+    $ python -m ch.fakeserver --port 8443 --pm-port 8222 --users 50 --rate 2
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING, Callable, Optional
+import argparse
+import asyncio
+import contextlib
+import itertools
+import random
+import threading
+import time
+
+from .transport import (FrameDecoder, LoopbackTransport, PerMessageDeflate, OP_BINARY,
+                        OP_CLOSE, OP_PING, OP_PONG, OP_TEXT, acceptKey, encodeFrame)
+
+if TYPE_CHECKING:
+    from . import Conn, RoomManager
+
+FONT = '<n000/><f x12000="0">'
+TERMINATOR = b"\r\n\x00"
+
+
+def _frame(*args: str) -> bytes:
+    return ":".join(args).encode() + TERMINATOR
+
+
+class _Client:
+    """A connected library instance, as seen from the server"""
+    def __init__(self, write: Callable[[bytes], None]):
+        self.write = write
+        self.room: Optional[_FakeRoom] = None
+        self.name = ""
+        self.sid = str(random.randrange(10 ** 7, 10 ** 8))
+        self.puid = str(random.randrange(10 ** 7, 10 ** 8))
+        # send times of the current flood window
+        self.sent: list[float] = list()
+
+    def send(self, data: bytes):
+        self.write(data)
+
+
+class _FakeRoom:
+    """State of a single simulated room"""
+    def __init__(self, server: FakeServer, name: str):
+        self.server = server
+        self.name = name
+        self.clients: set[_Client] = set()
+        self.history: list[bytes] = list()
+        self.users: dict[str, tuple[str, str]] = dict()
+        for n in range(server.users):
+            self.users[f"user{n}"] = (str(10 ** 7 + n), str(10 ** 7 + n))
+        self._msgid = itertools.count(1)
+        self._budget = 0.0
+        # seed the history so joining has something to load
+        for n in range(server.history):
+            name = f"user{n % server.users}" if server.users else "owner"
+            self.history.append(self._message("i", name, f"history {n}")[0])
+
+    @property
+    def count(self) -> int:
+        return len(self.users) + len(self.clients)
+
+    def _message(self, kind: str, name: str, body: str,
+                 timestamp: Optional[float] = None) -> tuple[bytes, str]:
+        msgid = format(next(self._msgid), "x").rjust(16, "0")
+        puid, _sid = self.users.get(name, ("0", ""))
+        args = [kind, f"{timestamp or time.time():.2f}", name, "", puid, puid,
+                msgid if kind == "i" else msgid[-8:], "127.0.0.1", "0", "", FONT + body]
+        return _frame(*args), msgid
+
+    def broadcast(self, data: bytes):
+        for client in self.clients:
+            client.send(data)
+
+    def post(self, name: str, body: str):
+        """Post a message as name to every client and the history."""
+        timestamp = time.time()
+        data, msgid = self._message("b", name, body, timestamp)
+        self.broadcast(data + _frame("u", msgid[-8:], msgid))
+        self.history.append(self._message("i", name, body, timestamp)[0])
+        if len(self.history) > self.server.history:
+            del self.history[0]
+
+    def tick(self, interval: float):
+        """Let the simulated users chat and come and go for one tick."""
+        if not self.users:
+            return
+        self._budget += self.server.rate * interval
+        names = list(self.users)
+        while self._budget >= 1:
+            self._budget -= 1
+            self.post(random.choice(names), "hello from the fake server")
+        if self.server.churn and random.random() < self.server.churn * interval:
+            name = random.choice(names)
+            puid, sid = self.users.pop(name)
+            self.broadcast(_frame("participant", "0", sid, puid, name, "None", "",
+                                  str(int(time.time()))))
+            self.users[name] = (puid, sid)
+            self.broadcast(_frame("participant", "1", sid, puid, name, "None", "",
+                                  str(int(time.time()))))
+
+
+class FakeServer:
+    """
+    asyncio server speaking the room and PM protocol
+
+    @param host: address to listen on
+    @param port: room port, 0 to pick a free one
+    @param pmPort: PM port, 0 to pick a free one
+    @param users: simulated users per room
+    @param rate: messages per second per room from the simulated users
+    @param churn: participant leave/join pairs per second per room
+    @param history: messages kept per room and sent on join
+    @param floodLimit: messages per second a client may send before show_fw
+    @param websocket: speak WebSocket, with permessage-deflate if the client offers it
+    """
+    tickInterval = 0.1
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, pmPort: int = 0,
+                 users: int = 10, rate: float = 1.0, churn: float = 0.0,
+                 history: int = 20, floodLimit: int = 10, websocket: bool = False):
+        self.host = host
+        self.port = port
+        self.pmPort = pmPort
+        self.users = users
+        self.rate = rate
+        self.churn = churn
+        self.history = history
+        self.floodLimit = floodLimit
+        self.websocket = websocket
+        self.rooms: dict[str, _FakeRoom] = dict()
+        self.framesIn = 0
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task[None]] = None
+        self._servers: list[asyncio.AbstractServer] = list()
+        self._ready = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    ####
+    # Running
+    ####
+    async def serve(self):
+        """Listen and simulate until cancelled."""
+        self.loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        rooms = await asyncio.start_server(self._roomClient, self.host, self.port)
+        pm = await asyncio.start_server(self._pmClient, self.host, self.pmPort)
+        self._servers = [rooms, pm]
+        self.port = rooms.sockets[0].getsockname()[1]
+        self.pmPort = pm.sockets[0].getsockname()[1]
+        self._ready.set()
+        try:
+            while True:
+                await asyncio.sleep(self.tickInterval)
+                self.tick()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            for server in self._servers:
+                server.close()
+
+    def tick(self):
+        """Run the simulation for one tickInterval."""
+        for room in list(self.rooms.values()):
+            room.tick(self.tickInterval)
+
+    def start(self):
+        """Run the server in a daemon thread, returns once it listens."""
+        self._thread = threading.Thread(target=asyncio.run, args=(self.serve(),),
+                                        name="ch-fakeserver", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self):
+        if self.loop is not None and self._task is not None:
+            self.loop.call_soon_threadsafe(self._task.cancel)
+        if self._thread is not None:
+            self._thread.join()
+
+    def manager(self, mgrClass: type[RoomManager]) -> type[RoomManager]:
+        """
+        Get a subclass of a manager connecting to this server instead of Chatango,
+        with the WebSocket mixin added if the server speaks WebSocket.
+
+        @param mgrClass: the RoomManager (sub)class to point at this server
+        """
+        server = self
+        if self.websocket:
+            from .mixin import WebSocket
+
+            class WebSocketManager(WebSocket, mgrClass):
+                webSocketPMPort = server.pmPort
+
+            mgrClass = WebSocketManager
+
+        class FakePM(mgrClass._PM):
+            PMHost = server.host
+            PMPort = server.pmPort
+
+            def _getAuth(self, name: str, password: str) -> str | None:
+                return "fake" + name
+
+        class FakeManager(mgrClass):
+            _PM = FakePM
+            roomPort = server.port
+
+            def getServer(self, room: str) -> str:
+                return server.host
+
+        FakeManager.__name__ = "Fake" + mgrClass.__name__
+        return FakeManager
+
+    def loopback(self, mgrClass: type[RoomManager]) -> type[RoomManager]:
+        """
+        Get a subclass of a manager talking to this server in memory,
+        through LoopbackTransport, without sockets or the server thread.
+
+        The simulation runs from a task of the manager, don't start the server.
+
+        @param mgrClass: the RoomManager (sub)class to connect to this server
+        """
+        server = self
+
+        class LoopbackPM(mgrClass._PM):
+            def _getAuth(self, name: str, password: str) -> str | None:
+                return "fake" + name
+
+        class LoopbackManager(mgrClass):
+            _PM = LoopbackPM
+
+            def __init__(self, *args: ..., **kw: ...):
+                super().__init__(*args, **kw)
+                self.setInterval(server.tickInterval, server.tick)
+
+            def createTransport(self, conn: Conn) -> LoopbackTransport:
+                return server._loopbackTransport(isinstance(conn, mgrClass._PM))
+
+        LoopbackManager.__name__ = "Loopback" + mgrClass.__name__
+        return LoopbackManager
+
+    ####
+    # Connections
+    ####
+    async def _serveClient(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                           pm: bool):
+        def write(data: bytes):
+            if not writer.is_closing():
+                writer.write(data)
+
+        if self.websocket:
+            await self._serveWebSocket(reader, writer, pm)
+            return
+        client = _Client(write)
+        try:
+            while True:
+                try:
+                    data = await reader.readuntil(b"\x00")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                self._process(client, data[:-1], pm)
+        finally:
+            self._closed(client)
+            writer.close()
+
+    async def _serveWebSocket(self, reader: asyncio.StreamReader,
+                              writer: asyncio.StreamWriter, pm: bool):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        _, *lines = request.decode(errors="ignore").split("\r\n")
+        headers = {k.strip().lower(): v.strip()
+                   for k, _, v in (line.partition(":") for line in lines)}
+        accept = acceptKey(headers.get("sec-websocket-key", "").encode()).decode()
+        response = ["HTTP/1.1 101 Switching Protocols", "Upgrade: websocket",
+                    "Connection: Upgrade", "Sec-WebSocket-Accept: " + accept]
+        deflate = None
+        if PerMessageDeflate.parse(headers.get("sec-websocket-extensions", "")) is not None:
+            deflate = PerMessageDeflate({}, client=False)
+            response.append("Sec-WebSocket-Extensions: permessage-deflate")
+        writer.write(("\r\n".join(response) + "\r\n\r\n").encode())
+
+        def write(data: bytes):
+            if writer.is_closing():
+                return
+            if deflate is not None:
+                writer.write(encodeFrame(OP_TEXT, deflate.compress(data), False, True))
+            else:
+                writer.write(encodeFrame(OP_TEXT, data, False))
+
+        client = _Client(write)
+        decoder = FrameDecoder()
+        try:
+            while data := await reader.read(65536):
+                for opcode, compressed, payload in decoder.feed(data):
+                    if opcode == OP_TEXT or opcode == OP_BINARY:
+                        if compressed and deflate is not None:
+                            payload = deflate.decompress(payload)
+                        for frame in payload.split(b"\x00")[:-1]:
+                            self._process(client, frame, pm)
+                    elif opcode == OP_PING:
+                        writer.write(encodeFrame(OP_PONG, payload, False))
+                    elif opcode == OP_CLOSE:
+                        writer.write(encodeFrame(OP_CLOSE, payload[:2], False))
+                        return
+        except ConnectionError:
+            pass
+        finally:
+            self._closed(client)
+            writer.close()
+
+    async def _roomClient(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # cancelled when the server stops
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._serveClient(reader, writer, False)
+
+    async def _pmClient(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._serveClient(reader, writer, True)
+
+    def _loopbackTransport(self, pm: bool) -> LoopbackTransport:
+        rbuf = bytearray()
+
+        def peer(data: bytes):
+            rbuf.extend(data)
+            if rbuf and rbuf[-1] == 0:
+                for frame in rbuf[:-1].split(b"\x00"):
+                    self._process(client, frame, pm)
+                rbuf.clear()
+
+        transport = LoopbackTransport(peer, lambda: self._closed(client))
+        client = _Client(transport.deliver)
+        return transport
+
+    ####
+    # Protocol
+    ####
+    def _process(self, client: _Client, frame: bytes, pm: bool):
+        self.framesIn += 1
+        cmd, *args = frame.decode(errors="ignore").rstrip("\r\n").split(":")
+        if pm:
+            self._pmCommand(client, cmd, args)
+        else:
+            self._roomCommand(client, cmd, args)
+
+    def _closed(self, client: _Client):
+        if (room := client.room) is not None:
+            client.room = None
+            room.clients.discard(client)
+            room.broadcast(_frame("n", format(room.count, "x")))
+
+    def _flooding(self, client: _Client) -> bool:
+        now = time.monotonic()
+        client.sent = [t for t in client.sent if now - t < 1]
+        client.sent.append(now)
+        return len(client.sent) > self.floodLimit
+
+    def _roomCommand(self, client: _Client, cmd: str, args: list[str]):
+        room = client.room
+        if cmd == "bauth" and room is None and len(args) >= 4:
+            if (room := self.rooms.get(args[0])) is None:
+                room = self.rooms[args[0]] = _FakeRoom(self, args[0])
+            client.room = room
+            client.name = args[2]
+            login = "M" if args[2] and args[3] else "N"
+            client.send(_frame("ok", "owner", args[1] or client.sid, login,
+                               args[2], f"{time.time():.2f}", "127.0.0.1", ""))
+            for data in room.history:
+                client.send(data)
+            client.send(_frame("inited"))
+            room.clients.add(client)
+            room.broadcast(_frame("n", format(room.count, "x")))
+        elif room is None:
+            return
+        elif cmd == "bmsg":
+            if self._flooding(client):
+                client.send(_frame("show_fw"))
+            else:
+                room.post(client.name or "anon", ":".join(args[1:]))
+        elif cmd == "g_participants":
+            now = str(int(time.time()))
+            client.send(_frame("g_participants", ";".join(
+                ":".join((sid, now, puid, name, "None", "0"))
+                for name, (puid, sid) in room.users.items())))
+        elif cmd == "getpremium":
+            client.send(_frame("premium", "0", "0"))
+        elif cmd == "blocklist":
+            client.send(_frame("blocklist" if args[0] == "block" else "unblocklist", ""))
+        elif cmd == "get_more":
+            client.send(_frame("nomore"))
+        elif cmd == "blogin":
+            client.name = args[0]
+            client.send(_frame("pwdok" if len(args) > 1 else "aliasok"))
+        elif cmd == "delmsg":
+            room.broadcast(_frame("delete", args[0]))
+
+    def _pmCommand(self, client: _Client, cmd: str, args: list[str]):
+        if cmd == "tlogin":
+            client.send(_frame("OK"))
+        elif cmd == "wl":
+            now = str(int(time.time()))
+            client.send(_frame("wl", *itertools.chain.from_iterable(
+                (f"user{n}", now, "on", "0") for n in range(min(self.users, 50)))))
+        elif cmd == "getblock":
+            client.send(_frame("block_list", ""))
+        elif cmd == "track":
+            client.send(_frame("track", args[0], "0", "online"))
+        elif cmd == "msg":
+            # every simulated user answers with what it was sent
+            if self._flooding(client):
+                client.send(_frame("toofast"))
+            else:
+                client.send(_frame("msg", args[0], args[0], "unknown",
+                                   f"{time.time():.2f}", "0", *args[1:]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in Chatango server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--pm-port", type=int, default=8222)
+    parser.add_argument("--users", type=int, default=10, help="simulated users per room")
+    parser.add_argument("--rate", type=float, default=1.0, help="messages per second per room")
+    parser.add_argument("--churn", type=float, default=0.0,
+                        help="participant leave/join pairs per second per room")
+    args = parser.parse_args()
+    server = FakeServer(args.host, args.port, args.pm_port, args.users, args.rate, args.churn)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
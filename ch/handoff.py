@@ -0,0 +1,233 @@
+"""
+Zero-downtime restart by handing live connections over to another process
+
+The running process listens on a Unix socket. The new process connects to
+it and receives the file descriptors of every room and PM socket through
+SCM_RIGHTS, together with the state of the connections (ch.state) and
+their unsent/unprocessed buffers. The old process then lets go of its
+copies without a word to the server, so the connections carry on in the
+new process as if nothing happened.
+
+    # old process, e.g. on SIGHUP
+    bot.listenHandoff("/run/bot.sock")
+
+    # new process, pm=False, the PM comes with the handoff
+    bot = Bot(name, password, pm=False)
+    bot.takeOver("/run/bot.sock")
+    bot.main()
+
+Only raw socket connections can be handed over, not the ones of
+ch.mixin.WebSocket or in memory transports.
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any
+import base64
+import json
+import os
+import socket
+import struct
+import time
+
+from . import _setSockOpts
+from .state import loadPM, loadRoom, pmState, roomState
+
+if TYPE_CHECKING:
+    from . import PM, Room, RoomManager, Task
+
+VERSION = 2
+# stay below the kernel limit of descriptors in one message (SCM_MAX_FD)
+_FDS_PER_MESSAGE = 200
+_ACK = b"K"
+
+
+def _bytes(data: bytes | bytearray) -> str:
+    return base64.b64encode(data).decode()
+
+
+def _connState(conn: Room | PM, ping: Task) -> dict[str, Any]:
+    """Buffers and timers every connection has."""
+    return {
+        "firstCommand": conn._firstCommand,
+        "wlock": conn._wlock,
+        "wbuf": _bytes(conn._wbuf),
+        "wlockbuf": _bytes(conn._wlockbuf),
+        "rbuf": _bytes(conn._rbuf),
+        "pingIn": max(0.0, ping.target - time.time()),
+    }
+
+
+def _loadConnState(conn: Room | PM, state: dict[str, Any], sock: socket.socket) -> Task:
+    conn.sock = sock
+    conn._firstCommand = state["firstCommand"]
+    conn._wlock = state["wlock"]
+    conn._wbuf = bytearray(base64.b64decode(state["wbuf"]))
+    conn._wlockbuf = bytearray(base64.b64decode(state["wlockbuf"]))
+    conn._rbuf = bytearray(base64.b64decode(state["rbuf"]))
+    mgr = conn._mgr
+    conn._lastRecv = time.monotonic()
+    ping = mgr.setInterval(state["pingIn"], conn.ping)
+    # keep the ping schedule of the old process, then the usual delay
+    ping.timeout = mgr.pingDelay
+    if mgr.readTimeout:
+        conn._watchdogTask = mgr.setInterval(mgr.readTimeout / 4, conn._checkStale)
+    conn.connected = True
+    return ping
+
+
+class HandoffListener:
+    """
+    Unix socket in the main loop, handing every connection over to
+    the first process connecting to it
+    """
+    pendingWrite = False
+
+    def __init__(self, mgr: RoomManager, path: str, timeout: float = 10):
+        self.mgr = mgr
+        self.path = path
+        self.timeout = timeout
+        if os.path.exists(path):
+            os.unlink(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen(1)
+        self.sock.setblocking(False)
+
+    def rfeed(self):
+        try:
+            client, _ = self.sock.accept()
+        except BlockingIOError:
+            return
+        # hand off between two loop iterations, not while the select
+        # results of this one still point at our connections
+        self.mgr.setTimeout(0, self._handOff, client)
+
+    def _handOff(self, client: socket.socket):
+        with client:
+            client.settimeout(self.timeout)
+            try:
+                handOff(self.mgr, client)
+            except OSError as error:
+                # the connections stay with us, the listener too
+                print("[HandoffListener] Handoff failed, keeping the connections:", error)
+                return
+        self.close()
+        self.mgr.stop()
+
+    def wfeed(self):
+        pass
+
+    def close(self):
+        self.sock.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        if self.mgr._handoffListener is self:
+            self.mgr._handoffListener = None
+
+
+def handOff(mgr: RoomManager, sock: socket.socket):
+    """
+    Send every connection of a manager to another process and let go of them
+    once it acknowledged.
+
+    @param mgr: the manager giving its connections away
+    @param sock: connected Unix socket
+    """
+    rooms = [room for room in mgr._rooms.values() if room.connected]
+    pm = mgr._pm if mgr._pm and mgr._pm.connected else None
+    conns: list[Room | PM] = [*rooms, pm] if pm else list(rooms)
+    if any(not isinstance(conn.sock, socket.socket) for conn in conns):
+        raise OSError("only raw socket connections can be handed off")
+
+    state: dict[str, Any] = {
+        "version": VERSION,
+        "rooms": [{**roomState(room), **_connState(room, room.pingTask)} for room in rooms],
+        "pm": {**pmState(pm), **_connState(pm, pm._pingTask)} if pm else None,
+        # rooms waiting for a reconnect, joined from scratch on the other side
+        "rejoin": [name for name, room in mgr._rooms.items() if not room.connected],
+    }
+    payload = json.dumps(state).encode()
+    sock.sendall(struct.pack("!I", len(payload)) + payload)
+    fds = [conn.sock.fileno() for conn in conns]  # type: ignore
+    for i in range(0, len(fds), _FDS_PER_MESSAGE):
+        socket.send_fds(sock, [b"F"], fds[i:i + _FDS_PER_MESSAGE])
+    if sock.recv(1) != _ACK:
+        raise OSError("the other process did not take the connections over")
+
+    mgr._reconnector.cancelAll()
+    for conn in conns:
+        # closing our copy of the descriptor leaves the connection open for the
+        # other process, _disconnect only closes it locally
+        conn._wbuf.clear()
+        conn._disconnect()
+
+
+def _recvExactly(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        if not (chunk := sock.recv(size - len(data))):
+            raise OSError("handoff connection closed early")
+        data += chunk
+    return bytes(data)
+
+
+def takeOver(mgr: RoomManager, path: str, timeout: float = 10) -> list[Room]:
+    """
+    Take the connections of the process listening on path over, see
+    RoomManager.listenHandoff.
+
+    @param mgr: the manager taking them, created with pm=False
+    @param path: Unix socket of the other process
+    @param timeout: seconds to wait for the other process at most
+
+    @return: the rooms taken over
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        size, = struct.unpack("!I", _recvExactly(sock, 4))
+        state = json.loads(_recvExactly(sock, size))
+        if state["version"] != VERSION:
+            raise ValueError(f"unsupported handoff version {state['version']}")
+        count = len(state["rooms"]) + (state["pm"] is not None)
+        fds: list[int] = []
+        while len(fds) < count:
+            _, received, _, _ = socket.recv_fds(sock, 1, _FDS_PER_MESSAGE)
+            if not received:
+                raise OSError("handoff connection closed early")
+            fds += received
+
+        rooms: list[Room] = []
+        for roomState_, fd in zip(state["rooms"], fds):
+            rooms.append(_resumeRoom(mgr, roomState_, fd))
+        if state["pm"] is not None:
+            _resumePM(mgr, state["pm"], fds[-1])
+        sock.sendall(_ACK)
+
+    for name in state["rejoin"]:
+        mgr.joinRoom(name)
+    return rooms
+
+
+def _socket(mgr: RoomManager, fd: int) -> socket.socket:
+    sock = socket.socket(fileno=fd)
+    sock.setblocking(False)
+    _setSockOpts(sock, mgr)
+    return sock
+
+
+def _resumeRoom(mgr: RoomManager, state: dict[str, Any], fd: int) -> Room:
+    room = mgr._Room(state["name"], state["providedUid"], mgr, connect=False)
+    loadRoom(room, state)
+    room.pingTask = _loadConnState(room, state, _socket(mgr, fd))
+    room._stats = mgr.metrics.conn("room", room.name) if mgr.metrics.enabled else None
+    mgr.addConnection(room)
+    return room
+
+
+def _resumePM(mgr: RoomManager, state: dict[str, Any], fd: int) -> PM:
+    pm = mgr._PM(mgr=mgr, connect=False)
+    loadPM(pm, state)
+    pm._pingTask = _loadConnState(pm, state, _socket(mgr, fd))
+    pm._stats = mgr.metrics.conn("pm", mgr.name or "") if mgr.metrics.enabled else None
+    mgr.addPMConnection(pm)
+    return pm
@@ -0,0 +1,256 @@
+"""
+Metrics registry, see RoomManager.metrics
+
+Counters are plain attribute and dict updates done from the main loop,
+snapshots copy them so they can be taken from any thread,
+like the exporter thread started by Metrics.serve.
+"""
+from __future__ import annotations
+from typing import Callable, Iterable, Optional
+import bisect
+import collections
+import math
+import os
+import socket
+import threading
+
+# (metric name, labels, value)
+Sample = tuple[str, dict[str, str], float]
+
+
+class Histogram:
+    """Histogram with fixed upper bounds in seconds"""
+    __slots__ = ("counts", "count", "sum")
+    buckets = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self) -> dict[str, float | list[int]]:
+        """Return count, sum and the per bucket counts (the last one being +Inf)"""
+        return {"count": self.count, "sum": self.sum, "buckets": list(self.counts)}
+
+
+class ConnStats:
+    """Traffic counters of a single connection, kept across reconnects"""
+    __slots__ = ("bytesIn", "bytesOut", "frames")
+
+    def __init__(self):
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.frames: dict[str, int] = dict()
+
+    def frame(self, cmd: str):
+        self.frames[cmd] = self.frames.get(cmd, 0) + 1
+
+
+class Metrics:
+    """
+    Registry of per connection, per event and per task metrics
+
+    Nothing gets recorded while disabled.
+    """
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.conns: dict[tuple[str, str], ConnStats] = dict()
+        self.events: dict[str, Histogram] = dict()
+        self.tasks: dict[str, Histogram] = dict()
+        self.timings: dict[str, Histogram] = dict()
+        # called on snapshot for gauges, like the current write buffer depth
+        self.collectors: list[Callable[[], Iterable[Sample]]] = list()
+        self._server: Optional[socket.socket] = None
+
+    ####
+    # Recording
+    ####
+    def conn(self, kind: str, name: str) -> ConnStats:
+        """
+        Get the counters of a connection.
+
+        @param kind: "room" or "pm"
+        @param name: connection name
+        """
+        if (stats := self.conns.get((kind, name))) is None:
+            stats = self.conns[(kind, name)] = ConnStats()
+        return stats
+
+    def event(self, evt: str, duration: float):
+        """Record a dispatched event and how long its handler took."""
+        if (hist := self.events.get(evt)) is None:
+            hist = self.events[evt] = Histogram()
+        hist.observe(duration)
+
+    def task(self, name: str, duration: float):
+        """Record a task run and how long it took."""
+        if (hist := self.tasks.get(name)) is None:
+            hist = self.tasks[name] = Histogram()
+        hist.observe(duration)
+
+    def timing(self, name: str, duration: float):
+        """Record any other duration under a name."""
+        if (hist := self.timings.get(name)) is None:
+            hist = self.timings[name] = Histogram()
+        hist.observe(duration)
+
+    ####
+    # Pull API
+    ####
+    def snapshot(self) -> dict[str, dict[str, object]]:
+        """
+        Get a copy of every metric.
+
+        @return: dict with connections, events, tasks, timings and gauges
+        """
+        conns: dict[str, object] = dict()
+        for (kind, name), stats in dict(self.conns).items():
+            conns[kind + ":" + name] = {
+                "bytes_in": stats.bytesIn,
+                "bytes_out": stats.bytesOut,
+                "frames": dict(stats.frames),
+            }
+        gauges: dict[str, object] = dict()
+        for name, labels, value in self._collect():
+            key = name + "".join(f";{k}={v}" for k, v in sorted(labels.items()))
+            gauges[key] = value
+        return {
+            "connections": conns,
+            "events": {evt: hist.snapshot() for evt, hist in dict(self.events).items()},
+            "tasks": {name: hist.snapshot() for name, hist in dict(self.tasks).items()},
+            "timings": {name: hist.snapshot() for name, hist in dict(self.timings).items()},
+            "gauges": gauges,
+        }
+
+    def _collect(self) -> list[Sample]:
+        samples: list[Sample] = list()
+        for collector in list(self.collectors):
+            samples.extend(collector())
+        return samples
+
+    ####
+    # Prometheus
+    ####
+    def prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        out: list[str] = list()
+        conns = dict(self.conns)
+        for metric, attr in (("ch_received_bytes_total", "bytesIn"),
+                             ("ch_sent_bytes_total", "bytesOut")):
+            out.append(f"# TYPE {metric} counter")
+            for (kind, name), stats in conns.items():
+                out.append(f"{metric}{_labels(kind=kind, conn=name)} {getattr(stats, attr)}")
+        out.append("# TYPE ch_frames_total counter")
+        for (kind, name), stats in conns.items():
+            for cmd, count in dict(stats.frames).items():
+                out.append(f"ch_frames_total{_labels(kind=kind, conn=name, cmd=cmd)} {count}")
+
+        for metric, label, hists in (("ch_event_seconds", "event", self.events),
+                                     ("ch_task_seconds", "task", self.tasks),
+                                     ("ch_timing_seconds", "name", self.timings)):
+            out.append(f"# TYPE {metric} histogram")
+            for key, hist in dict(hists).items():
+                _histogram(out, metric, {label: key}, hist)
+
+        seen: set[str] = set()
+        for name, labels, value in self._collect():
+            if name not in seen:
+                seen.add(name)
+                out.append(f"# TYPE {name} gauge")
+            out.append(f"{name}{_labels(**labels)} {value}")
+        return "\n".join(out) + "\n"
+
+    def serve(self, address: str | tuple[str, int]):
+        """
+        Serve the Prometheus text over HTTP from a daemon thread.
+
+        @param address: unix socket path or (host, port) to listen on
+        """
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.unlink(address)
+            sock = socket.socket(socket.AF_UNIX)
+        else:
+            sock = socket.socket()
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(address)
+        sock.listen()
+        self._server = sock
+        threading.Thread(target=self._serve, args=(sock,), name="ch-metrics",
+                         daemon=True).start()
+
+    def stopServing(self):
+        if self._server:
+            self._server.close()
+            self._server = None
+
+    def _serve(self, sock: socket.socket):
+        while True:
+            try:
+                client, _addr = sock.accept()
+            except OSError:
+                # closed by stopServing
+                return
+            with client:
+                try:
+                    client.settimeout(5)
+                    client.recv(4096)
+                    body = self.prometheus().encode()
+                    client.sendall(b"HTTP/1.0 200 OK\r\n"
+                                   b"Content-Type: text/plain; version=0.0.4\r\n"
+                                   b"Content-Length: " + str(len(body)).encode() +
+                                   b"\r\n\r\n" + body)
+                except OSError as error:
+                    print("[Metrics][serve] Socket error", error)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: str) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def _histogram(out: list[str], metric: str, labels: dict[str, str], hist: Histogram):
+    cumulative = 0
+    counts = list(hist.counts)
+    for bound, count in zip(hist.buckets, counts):
+        cumulative += count
+        out.append(f"{metric}_bucket{_labels(**labels, le=str(bound))} {cumulative}")
+    cumulative += counts[-1]
+    out.append(f"{metric}_bucket{_labels(**labels, le='+Inf')} {cumulative}")
+    out.append(f"{metric}_sum{_labels(**labels)} {hist.sum}")
+    out.append(f"{metric}_count{_labels(**labels)} {cumulative}")
+
+
+class LatencyTracker:
+    """Rolling window of the most recent latency samples in seconds"""
+    def __init__(self, size: int = 256):
+        self.samples: collections.deque[float] = collections.deque(maxlen=size)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, value: float):
+        self.samples.append(value)
+
+    def percentile(self, p: float) -> float | None:
+        """
+        Get a percentile of the window using the nearest rank.
+
+        @param p: percentile from 0 to 100
+
+        @return: the value, or None without samples
+        """
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
@@ -2,5 +2,7 @@
 
 from .secure import Secure
 from .windows_mainloop import WindowsMainLoopFix
+from .websocket import WebSocket
+from .sharded import Sharded
 
-__all__ = ['Secure', "WindowsMainLoopFix"]
+__all__ = ['Secure', "WindowsMainLoopFix", "WebSocket", "Sharded"]
@@ -91,7 +91,7 @@ class Secure(Base):
                     self._bot_name: str = self._mgr.name
                 self.owner = ch.User(args[0])
                 self.uid = args[1]
-                self._mods = set(map(lambda x: ch.User(x.split(",")[0]), args[6].split(";")))
+                self._modFlags = ch._parseMods(args[6].split(";"))
                 self._i_log.clear()
 
         class RoomSecure(_RoomSecure, cls._Room):
@@ -119,6 +119,13 @@ class Secure(Base):
                 self._password = "" # blank dummy so stuff doesn't break
                 self._running = False
                 self._rooms = dict()
+                self._reconnector = ch.Reconnector(self)
+                self._initEvents()
+                self._initMetrics()
+                self._initArchive()
+                self._initSearch()
+                self._initPresence()
+                self._initSpam()
                 if password and pm:
                     self._pm = self._PM(mgr=self)
                 else:
@@ -0,0 +1,345 @@
+"Some black magic lies here"
+
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+import queue
+import socket
+import threading
+import traceback
+import zlib
+
+# Importing ch for type hinting
+import ch
+from ._base import Base
+
+# the shard whose loop runs in the current thread
+_local = threading.local()
+
+
+def currentShard() -> Optional["Shard"]:
+    """Return the shard running in the calling thread, None outside of loop threads."""
+    return getattr(_local, "shard", None)
+
+
+class _Waker:
+    """Socket pair a loop selects on so other threads can interrupt its wait"""
+    pendingWrite = False
+
+    def __init__(self):
+        self.sock, self._w = socket.socketpair()
+        self.sock.setblocking(False)
+        self._w.setblocking(False)
+
+    def wake(self):
+        try:
+            self._w.send(b"\x00")
+        except BlockingIOError:
+            # already plenty of wake ups pending
+            pass
+
+    def rfeed(self):
+        try:
+            while self.sock.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def wfeed(self):
+        pass
+
+    def close(self):
+        self.sock.close()
+        self._w.close()
+
+
+class Shard:
+    """
+    One loop thread owning a disjoint set of rooms, with its own selector,
+    scheduler and write buffers
+
+    Anything touching a room has to run in the thread of its shard,
+    other threads hand it over with `call`.
+    """
+    def __init__(self, mgr: ch.RoomManager, index: int, taskClass: type[ch.Task]):
+        self.mgr = mgr
+        self.index = index
+        self.Task = taskClass
+        self.rooms: dict[str, ch.Room] = dict()
+        self.running = False
+        # None until the loop runs, anyone may touch the shard before that
+        self.thread: Optional[threading.Thread] = None
+        self._calls: queue.SimpleQueue[tuple[Future[Any], Callable[..., Any], Any, Any]] = \
+            queue.SimpleQueue()
+        self._waker = _Waker()
+
+    def owned(self) -> bool:
+        """Return whether the calling thread may touch the shard directly."""
+        return self.thread is None or self.thread is threading.current_thread()
+
+    def call(self, func: Callable[..., Any], *args: Any, **kw: Any) -> Future[Any]:
+        """
+        Run a function in the thread of the shard.
+
+        Runs it right away when already in that thread, otherwise queues it
+        and wakes the loop up.
+
+        @param func: function to call
+
+        @return: future of the return value
+        """
+        future: Future[Any] = Future()
+        if self.owned():
+            future.set_result(func(*args, **kw))
+        else:
+            self._calls.put((future, func, args, kw))
+            self._waker.wake()
+        return future
+
+    def _runCalls(self):
+        while True:
+            try:
+                future, func, args, kw = self._calls.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                future.set_result(func(*args, **kw))
+            except Exception as ex:
+                print(f"[Shard][call] {func} failed in shard {self.index}")
+                traceback.print_exc()
+                future.set_exception(ex)
+
+    def getConnections(self) -> dict[ch.Transport, Any]:
+        conns: dict[ch.Transport, Any] = dict((x.sock, x) for x in self.rooms.values())
+        if self.index == 0 and (pm := self.mgr._pm):
+            conns[pm.sock] = pm
+        conns[self._waker.sock] = self._waker
+        return conns
+
+    def step(self):
+        """Run queued calls and due tasks, then wait for io once."""
+        self._runCalls()
+        time_to_next_task = self.Task.tick()
+        if self.running:
+            self.mgr._poll(self.getConnections(), time_to_next_task)
+
+    def run(self):
+        """Run the loop in the calling thread until stopped."""
+        _local.shard = self
+        self.thread = threading.current_thread()
+        try:
+            while self.running:
+                self.step()
+            # whatever got queued while stopping
+            self._runCalls()
+        finally:
+            self.thread = None
+            _local.shard = None
+
+    def start(self):
+        """Run the loop in a thread of its own, unless already running."""
+        if self.running:
+            return
+        # flag it right away so calls made meanwhile get queued for the thread
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=f"ch-shard-{self.index}",
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Disconnect the rooms of the shard and let its loop return."""
+        for room in list(self.rooms.values()):
+            room.disconnect()
+        self.running = False
+
+
+class ShardedConn:
+    """Hand commands and (dis)connects over to the thread of the owning shard"""
+    _shard: Optional[Shard] = None
+
+    def _sendCommand(self, *args: str):
+        if (shard := self._shard) is not None and not shard.owned():
+            shard.call(self._sendCommand, *args)
+        else:
+            super()._sendCommand(*args)  # type: ignore
+
+    def disconnect(self):
+        if (shard := self._shard) is not None and not shard.owned():
+            shard.call(self.disconnect)
+        else:
+            super().disconnect()  # type: ignore
+
+    def reconnect(self):
+        if (shard := self._shard) is not None and not shard.owned():
+            shard.call(self.reconnect)
+        else:
+            super().reconnect()  # type: ignore
+
+
+class _LockedReconnector(ch.Reconnector):
+    """Reconnector shared by every shard, used by one of them at a time"""
+    def __init__(self, mgr: ch.RoomManager):
+        super().__init__(mgr)
+        self._lock = threading.RLock()
+
+
+def _locked(name: str):
+    method = getattr(ch.Reconnector, name)
+
+    def locked(self: _LockedReconnector, *args: Any, **kw: Any):
+        with self._lock:
+            return method(self, *args, **kw)
+    locked.__name__ = name
+    locked.__doc__ = method.__doc__
+    return locked
+
+
+for _name in ("connectionLost", "connected", "cancel", "cancelName", "cancelAll",
+              "attempting", "scheduled", "stats", "_ready", "_timedOut"):
+    setattr(_LockedReconnector, _name, _locked(_name))
+
+
+class Sharded(Base):
+    """
+    Spread rooms over several loop threads, each owning a disjoint shard
+    of rooms with its own selector, scheduler and buffers
+
+    On free-threaded builds the shards run in parallel, on GIL builds they
+    still overlap io waits. Rooms are placed by a hash of their name.
+    The thread calling main() runs shard 0, which holds the PM connection,
+    the tasks scheduled from outside of loop threads and no rooms.
+
+    Thread safety:
+      - event handlers run in the thread of the shard the room belongs to,
+        concurrently with handlers of other shards, anything they share
+        beyond what is listed here needs a lock of their own
+      - commands (room.message, room.delete, pm.message, ...) and
+        disconnect/reconnect may be called from any thread, they are
+        queued to the owning shard
+      - joinRoom, leaveRoom, getRoom, rooms and stop may be called from any
+        thread, joinRoom waits until the owning shard created the room
+      - setTimeout/setInterval schedule into the shard of the calling thread,
+        from other threads into shard 0
+      - the User registry hands out one object per name from every thread,
+        the reconnector is serialized with a lock
+      - manager config (class attributes) is read-only once main() runs
+    """
+    # number of loop threads rooms are spread over, shard 0 comes on top
+    shardCount = 4
+
+    class _Room(ShardedConn, ch.Room):
+        ...
+
+    class _PM(ShardedConn, ch.PM):
+        ...
+
+    def __init__(self, name: Optional[str] = None, password: Optional[str] = None,
+                 pm: bool = True):
+        self._shards = [Shard(self, i, ch.Task if i == 0 else ch.Task.scheduler())
+                        for i in range(self.shardCount + 1)]
+        self._roomsLock = threading.Lock()
+        super().__init__(name, password, pm)  # type: ignore
+        self._reconnector = _LockedReconnector(self)  # type: ignore
+        if self._pm:  # type: ignore
+            self._pm._shard = self._shards[0]  # type: ignore
+        # queue calls from other threads until main() runs shard 0
+        self._shards[0].thread = threading.current_thread()
+
+    ####
+    # Shards
+    ####
+    @property
+    def shards(self) -> list[Shard]:
+        return self._shards
+
+    def shardOf(self, room: str) -> Shard:
+        """
+        Get the shard a room belongs to.
+
+        @param room: room name
+
+        @return: the shard
+        """
+        return self._shards[1 + zlib.crc32(room.lower().encode()) % self.shardCount]
+
+    def _taskClass(self) -> type[ch.Task]:
+        return shard.Task if (shard := currentShard()) else ch.Task
+
+    def setTimeout(self, timeout: int, func: Callable[..., None],
+                   *args: Any, **kw: Any) -> ch.Task:
+        if currentShard() is None and not self._shards[0].owned():
+            return self._shards[0].call(super().setTimeout, timeout, func,  # type: ignore
+                                        *args, **kw).result()
+        return super().setTimeout(timeout, func, *args, **kw)  # type: ignore
+
+    def setInterval(self, timeout: int, func: Callable[..., None],
+                    *args: Any, **kw: Any) -> ch.Task:
+        if currentShard() is None and not self._shards[0].owned():
+            return self._shards[0].call(super().setInterval, timeout, func,  # type: ignore
+                                        *args, **kw).result()
+        return super().setInterval(timeout, func, *args, **kw)  # type: ignore
+
+    ####
+    # Join/leave
+    ####
+    def joinRoom(self, room: str, *args: Any, **kw: Any) -> ch.Room:
+        shard = self.shardOf(room)
+        shard.start()
+        return shard.call(super().joinRoom, room, *args, **kw).result()  # type: ignore
+
+    def leaveRoom(self, room: str):
+        self.shardOf(room).call(super().leaveRoom, room)  # type: ignore
+
+    ####
+    # Util
+    ####
+    def addConnection(self, room: ch.Room):
+        # copy on write, other threads iterate self._rooms without locking
+        with self._roomsLock:
+            self._rooms = {**self._rooms, room.name: room}  # type: ignore
+        room._shard = shard = currentShard() or self.shardOf(room.name)  # type: ignore
+        shard.rooms[room.name] = room
+
+    def removeConnection(self, room: ch.Room):
+        with self._roomsLock:
+            rooms = dict(self._rooms)  # type: ignore
+            del rooms[room.name]
+            self._rooms = rooms  # type: ignore
+        if shard := getattr(room, "_shard", None):
+            shard.rooms.pop(room.name, None)
+
+    def addPMConnection(self, pm: ch.PM):
+        pm._shard = self._shards[0]  # type: ignore
+        super().addPMConnection(pm)  # type: ignore
+
+    ####
+    # Main
+    ####
+    def _idle(self) -> bool:
+        return (self.disconnectOnEmptyConnAndTask and not self._deferredThreads  # type: ignore
+                and not self._rooms and not self._pm  # type: ignore
+                and not any(shard.Task.size() for shard in self._shards))
+
+    def main(self):
+        self.onInit()  # type: ignore
+        self._running = True
+        shard = self._shards[0]
+        _local.shard = shard
+        shard.thread = threading.current_thread()
+        shard.running = True
+        try:
+            while shard.running:
+                if self._idle():
+                    self.stop()
+                shard.step()
+            shard._runCalls()
+        finally:
+            shard.thread = None
+            _local.shard = None
+        for shard in self._shards[1:]:
+            if shard.thread is not None:
+                shard.thread.join()
+
+    def stop(self):
+        super().stop()  # type: ignore
+        for shard in self._shards:
+            shard.call(shard.stop)
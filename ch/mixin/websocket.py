@@ -0,0 +1,32 @@
+"Some black magic lies here"
+
+import socket
+
+# Importing ch for type hinting
+import ch
+from ch.transport import WebSocketTransport
+from ._base import Base
+
+
+class WebSocket(Base):
+    """
+    Connect rooms and PM over WebSocket instead of the raw socket protocol,
+    compressed with permessage-deflate when the server agrees to it
+
+    Busy rooms send a lot of repetitive html, compression cuts the traffic
+    they cost substantially. Commands are processed and batched exactly like
+    over the raw socket, see ch.transport.WebSocketTransport.
+
+    Needs the default main loop, the other ones don't know about data
+    the transport already read and decompressed.
+    """
+    roomPort = 8080
+    webSocketPMPort = 8080
+    webSocketCompression = True
+
+    def createTransport(self, conn: ch.Conn) -> WebSocketTransport:
+        sock = socket.socket()
+        sock.setblocking(False)
+        ch._setSockOpts(sock, self)  # type: ignore
+        return WebSocketTransport(sock, self.webSocketCompression,
+                                  self.webSocketPMPort if isinstance(conn, ch.PM) else None)
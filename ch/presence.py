@@ -0,0 +1,307 @@
+"""
+Cross-room presence and last-seen index
+
+Answers "where is X right now" and "when did we last see X" without
+scanning rooms or histories, see RoomManager.trackPresence. Users get
+a number on first sight, their last message/join/leave and PM status
+live in flat arrays indexed by that number, so each user we only ever
+saw once costs a few dozen bytes besides their name. Only users present
+right now and the rooms each user spoke in have dict entries.
+
+The index can be saved to a file and loaded back, see
+RoomManager.presencePath:
+
+    header: b"CHSEEN" version:u8 length:u32 zlib(json)
+"""
+from __future__ import annotations
+from typing import Any, NamedTuple, Optional
+import array
+import base64
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+
+MAGIC = b"CHSEEN"
+VERSION = 1
+_HEADER = struct.Struct("!6sBI")
+# room ids are packed with user ids into the keys of _said
+_ROOM_BITS = 20
+_NEVER = 0.0
+_NONE = -1
+
+
+class Seen(NamedTuple):
+    """What the index knows about a user, times are unix times"""
+    name: str
+    # rooms the user is in right now
+    rooms: set[str]
+    # (time, room) of the last message, join and leave, None if never seen
+    lastMessage: Optional[tuple[float, str]]
+    lastJoin: Optional[tuple[float, str]]
+    lastLeave: Optional[tuple[float, str]]
+    # (time, online) of the last PM status, time is the logout time when offline
+    pm: Optional[tuple[float, bool]]
+
+
+class PresenceIndex:
+    """Manager level index of where users are and when they were last seen"""
+    _FIELDS = {
+        "msgTime": "d", "msgRoom": "i", "joinTime": "d", "joinRoom": "i",
+        "leaveTime": "d", "leaveRoom": "i", "pmTime": "d", "pmOnline": "b",
+    }
+
+    def __init__(self):
+        self._ids: dict[str, int] = dict()
+        self._names: list[str] = list()
+        self._roomIds: dict[str, int] = dict()
+        self._roomNames: list[str] = list()
+        self._columns = {field: array.array(code) for field, code in self._FIELDS.items()}
+        self.msgTime = self._columns["msgTime"]
+        self.msgRoom = self._columns["msgRoom"]
+        self.joinTime = self._columns["joinTime"]
+        self.joinRoom = self._columns["joinRoom"]
+        self.leaveTime = self._columns["leaveTime"]
+        self.leaveRoom = self._columns["leaveRoom"]
+        self.pmTime = self._columns["pmTime"]
+        self.pmOnline = self._columns["pmOnline"]
+        # (user id << _ROOM_BITS | room id) -> time of the last message
+        self._said: dict[int, float] = dict()
+        # user id -> {room id: sessions}, only for users present right now
+        self._here: dict[int, dict[int, int]] = dict()
+        # room id -> user ids present
+        self._present: dict[int, set[int]] = dict()
+
+    def __len__(self):
+        return len(self._names)
+
+    def _user(self, name: str) -> int:
+        # names are looked up lowercased, like User does
+        name = name.lower()
+        if (uid := self._ids.get(name)) is None:
+            uid = self._ids[name] = len(self._names)
+            self._names.append(name)
+            for field, column in self._columns.items():
+                column.append(_NEVER if self._FIELDS[field] == "d" else _NONE)
+        return uid
+
+    def _room(self, room: str) -> int:
+        room = room.lower()
+        if (rid := self._roomIds.get(room)) is None:
+            rid = self._roomIds[room] = len(self._roomNames)
+            self._roomNames.append(room)
+        return rid
+
+    ####
+    # Updates
+    ####
+    def join(self, room: str, name: str, when: float, event: bool = True):
+        """
+        Record a session of a user in a room.
+
+        @param room: room name
+        @param name: user name
+        @param when: join time
+        @param event: whether the user joined just now, False for the
+                      initial userlist, which doesn't count as a join
+        """
+        uid = self._user(name)
+        rid = self._room(room)
+        rooms = self._here.setdefault(uid, dict())
+        rooms[rid] = rooms.get(rid, 0) + 1
+        self._present.setdefault(rid, set()).add(uid)
+        if event or when > self.joinTime[uid]:
+            self.joinTime[uid] = when
+            self.joinRoom[uid] = rid
+
+    def leave(self, room: str, name: str, when: float):
+        """
+        Record the end of a session of a user in a room.
+
+        @param room: room name
+        @param name: user name
+        @param when: leave time
+        """
+        uid = self._user(name)
+        rid = self._room(room)
+        self.leaveTime[uid] = when
+        self.leaveRoom[uid] = rid
+        if (rooms := self._here.get(uid)) is None or rid not in rooms:
+            return
+        if rooms[rid] > 1:
+            rooms[rid] -= 1
+            return
+        del rooms[rid]
+        if not rooms:
+            del self._here[uid]
+        self._present[rid].discard(uid)
+
+    def message(self, room: str, name: str, when: float):
+        """
+        Record a message of a user.
+
+        @param room: room name
+        @param name: user name
+        @param when: message time
+        """
+        uid = self._user(name)
+        rid = self._room(room)
+        self._said[uid << _ROOM_BITS | rid] = when
+        if when >= self.msgTime[uid]:
+            self.msgTime[uid] = when
+            self.msgRoom[uid] = rid
+
+    def pmStatus(self, name: str, when: float, online: bool):
+        """
+        Record the PM status of a contact.
+
+        @param name: user name
+        @param when: time of the status, the logout time when offline
+        @param online: whether the user is online
+        """
+        uid = self._user(name)
+        self.pmTime[uid] = when
+        self.pmOnline[uid] = online
+
+    def roomGone(self, room: str):
+        """
+        Forget who is in a room we are no longer in, without counting it
+        as them leaving.
+
+        @param room: room name
+        """
+        if (rid := self._roomIds.get(room.lower())) is None:
+            return
+        for uid in self._present.pop(rid, ()):
+            rooms = self._here[uid]
+            del rooms[rid]
+            if not rooms:
+                del self._here[uid]
+
+    ####
+    # Queries
+    ####
+    def _at(self, times: array.array[float], rooms: array.array[int],
+            uid: int) -> Optional[tuple[float, str]]:
+        if (rid := rooms[uid]) == _NONE:
+            return None
+        return (times[uid], self._roomNames[rid])
+
+    def get(self, name: str) -> Optional[Seen]:
+        """
+        Get what is known about a user.
+
+        @param name: user name
+
+        @return: Seen or None if never seen
+        """
+        name = name.lower()
+        if (uid := self._ids.get(name)) is None:
+            return None
+        return Seen(
+            name=name,
+            rooms=self.where(name),
+            lastMessage=self._at(self.msgTime, self.msgRoom, uid),
+            lastJoin=self._at(self.joinTime, self.joinRoom, uid),
+            lastLeave=self._at(self.leaveTime, self.leaveRoom, uid),
+            pm=None if self.pmOnline[uid] == _NONE
+            else (self.pmTime[uid], bool(self.pmOnline[uid])),
+        )
+
+    def where(self, name: str) -> set[str]:
+        """Return the rooms a user is in right now."""
+        if (uid := self._ids.get(name.lower())) is None:
+            return set()
+        return {self._roomNames[rid] for rid in self._here.get(uid, ())}
+
+    def lastMessage(self, name: str, room: Optional[str] = None) -> Optional[float]:
+        """
+        Get the time of the last message of a user.
+
+        @param name: user name
+        @param room: only in this room
+
+        @return: unix time or None
+        """
+        if (uid := self._ids.get(name.lower())) is None:
+            return None
+        if room is None:
+            return self.msgTime[uid] if self.msgRoom[uid] != _NONE else None
+        if (rid := self._roomIds.get(room.lower())) is None:
+            return None
+        return self._said.get(uid << _ROOM_BITS | rid)
+
+    def lastSeen(self, name: str) -> Optional[tuple[float, str]]:
+        """
+        Get when and where a user was last seen.
+
+        @param name: user name
+
+        @return: (unix time, room name or "pm"), the time is now if the user
+                 is in one of our rooms or online in PM, None if never seen
+        """
+        if (seen := self.get(name)) is None:
+            return None
+        now = time.time()
+        if seen.rooms:
+            return (now, min(seen.rooms))
+        if seen.pm and seen.pm[1]:
+            return (now, "pm")
+        candidates = [x for x in (seen.lastMessage, seen.lastJoin, seen.lastLeave) if x]
+        if seen.pm:
+            candidates.append((seen.pm[0], "pm"))
+        return max(candidates, default=None)
+
+    ####
+    # Persistence
+    ####
+    def save(self, path: str):
+        """
+        Save the index to a file, atomically. Who is present right now is not saved.
+
+        @param path: file, replaced if it exists
+        """
+        state: dict[str, Any] = {
+            "byteorder": sys.byteorder,
+            "names": self._names,
+            "rooms": self._roomNames,
+            "columns": {field: base64.b64encode(column.tobytes()).decode()
+                        for field, column in self._columns.items()},
+            "said": list(self._said.items()),
+        }
+        data = zlib.compress(json.dumps(state, separators=(",", ":")).encode())
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, len(data)))
+            f.write(data)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> PresenceIndex:
+        """
+        Load an index saved with save.
+
+        @param path: file
+
+        @return: the index
+        """
+        with open(path, "rb") as f:
+            magic, version, length = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a presence index")
+            if version != VERSION:
+                raise ValueError(f"unsupported presence index version {version}")
+            state = json.loads(zlib.decompress(f.read(length)))
+        self = cls()
+        self._names = state["names"]
+        self._ids = {name: uid for uid, name in enumerate(self._names)}
+        self._roomNames = state["rooms"]
+        self._roomIds = {room: rid for rid, room in enumerate(self._roomNames)}
+        for field, column in self._columns.items():
+            column.frombytes(base64.b64decode(state["columns"][field]))
+            if state["byteorder"] != sys.byteorder:
+                column.byteswap()
+        self._said = {key: when for key, when in state["said"]}
+        return self
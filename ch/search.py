@@ -0,0 +1,196 @@
+"""
+Full-text inverted index over the history of every room
+
+Kept up to date as messages enter and leave Room.history, see
+RoomManager.indexHistory. Terms are case-folded words, queries AND
+their parts together:
+
+    hello world          both words, anywhere
+    "hello world"        the words next to each other
+    hel*                 any word starting with hel
+    from:someone         only messages of a user
+
+    bot.search.query('"good morning" from:someone', room="myroom")
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING, Iterable, Optional
+import bisect
+import heapq
+import re
+
+if TYPE_CHECKING:
+    from . import Message
+
+_word_re = re.compile(r"\w+")
+_query_re = re.compile(r'"([^"]*)"?|(\S+)')
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into case-folded terms."""
+    return _word_re.findall(text.casefold())
+
+
+def _hasPhrase(tokens: tuple[str, ...], phrase: list[str]) -> bool:
+    size = len(phrase)
+    first = phrase[0]
+    for i, token in enumerate(tokens[:len(tokens) - size + 1]):
+        if token == first and list(tokens[i:i + size]) == phrase:
+            return True
+    return False
+
+
+class SearchIndex:
+    """Inverted index of messages by term, user and room"""
+    def __init__(self):
+        self._postings: dict[str, set[Message]] = dict()
+        # every term, sorted, for prefix lookups
+        self._terms: list[str] = list()
+        self._tokens: dict[Message, tuple[str, ...]] = dict()
+        self._byUser: dict[str, set[Message]] = dict()
+        self._byRoom: dict[str, set[Message]] = dict()
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def __contains__(self, msg: Message):
+        return msg in self._tokens
+
+    ####
+    # Maintenance
+    ####
+    def add(self, msg: Message):
+        """
+        Index a message.
+
+        @param msg: the message
+        """
+        if msg in self._tokens:
+            return
+        tokens = self._tokens[msg] = tuple(tokenize(msg.body))
+        for term in set(tokens):
+            if (posting := self._postings.get(term)) is None:
+                posting = self._postings[term] = set()
+                bisect.insort(self._terms, term)
+            posting.add(msg)
+        self._byUser.setdefault(msg.user.name, set()).add(msg)
+        self._byRoom.setdefault(getattr(msg.room, "name", ""), set()).add(msg)
+
+    def addMany(self, msgs: Iterable[Message]):
+        for msg in msgs:
+            self.add(msg)
+
+    def remove(self, msg: Message):
+        """
+        Drop a message from the index.
+
+        @param msg: the message
+        """
+        if (tokens := self._tokens.pop(msg, None)) is None:
+            return
+        for term in set(tokens):
+            posting = self._postings[term]
+            posting.discard(msg)
+            if not posting:
+                del self._postings[term]
+                del self._terms[bisect.bisect_left(self._terms, term)]
+        for index, key in ((self._byUser, msg.user.name),
+                           (self._byRoom, getattr(msg.room, "name", ""))):
+            msgs = index[key]
+            msgs.discard(msg)
+            if not msgs:
+                del index[key]
+
+    def removeRoom(self, room: str):
+        """
+        Drop every message of a room from the index, like once we left it.
+
+        @param room: room name
+        """
+        for msg in list(self._byRoom.get(room, ())):
+            self.remove(msg)
+
+    def clear(self):
+        self._postings.clear()
+        self._terms.clear()
+        self._tokens.clear()
+        self._byUser.clear()
+        self._byRoom.clear()
+
+    ####
+    # Queries
+    ####
+    def _prefix(self, prefix: str) -> set[Message]:
+        found: set[Message] = set()
+        start = bisect.bisect_left(self._terms, prefix)
+        for term in self._terms[start:]:
+            if not term.startswith(prefix):
+                break
+            found |= self._postings[term]
+        return found
+
+    def latest(self, user: str, room: Optional[str] = None) -> Optional[Message]:
+        """
+        Get the newest message of a user, without a query.
+
+        @param user: user name
+        @param room: only messages in this room
+
+        @return: the message or None if none is indexed
+        """
+        msgs = self._byUser.get(user.lower(), set())
+        if room is not None:
+            msgs = msgs & self._byRoom.get(room.lower(), set())
+        return max(msgs, key=lambda msg: msg.time, default=None)
+
+    def query(self, text: str, user: Optional[str] = None, room: Optional[str] = None,
+              limit: int = 50) -> list[Message]:
+        """
+        Find the messages matching every part of a query.
+
+        @param text: query, see the module documentation
+        @param user: only messages of this user
+        @param room: only messages in this room
+        @param limit: number of messages at most
+
+        @return: matching messages, newest first
+        """
+        sets: list[set[Message]] = []
+        phrases: list[list[str]] = []
+        prefixes: list[str] = []
+        if user is not None:
+            sets.append(self._byUser.get(user.lower(), set()))
+        if room is not None:
+            sets.append(self._byRoom.get(room.lower(), set()))
+        for quoted, word in _query_re.findall(text):
+            if word.startswith("from:") and len(word) > 5:
+                sets.append(self._byUser.get(word[5:].lower(), set()))
+                continue
+            terms = tokenize(quoted or word)
+            if not terms:
+                continue
+            prefix = not quoted and word.endswith("*")
+            for term in terms[:-1] if prefix else terms:
+                sets.append(self._postings.get(term, set()))
+            if prefix:
+                prefixes.append(terms[-1])
+            if quoted and len(terms) > 1:
+                phrases.append(terms)
+        if not sets:
+            if not prefixes:
+                return []
+            sets.append(self._prefix(prefixes.pop()))
+
+        sets.sort(key=len)
+        found = set(sets[0])
+        for other in sets[1:]:
+            if not found:
+                break
+            found &= other
+        # checking the few candidates left is cheaper than the union of
+        # every term starting with the prefix
+        for prefix in prefixes:
+            found = {msg for msg in found
+                     if any(token.startswith(prefix) for token in self._tokens[msg])}
+        for phrase in phrases:
+            found = {msg for msg in found if _hasPhrase(self._tokens[msg], phrase)}
+        return heapq.nlargest(limit, found, key=lambda msg: msg.time)
@@ -0,0 +1,103 @@
+"""
+On-disk snapshots of a manager's rooms, PM and User registry, for warm restarts
+
+A snapshot is a header followed by the zlib compressed JSON of the state,
+see ch.state:
+
+    b"CHSNAP" version:u8 length:u32 zlib(json)
+
+Restoring joins the rooms with their history, banlists and mods already in
+place. When the server sends the recent history again only the messages
+missing from the snapshot go through onHistoryMessage, banlists and
+userlists are updated by the usual requests.
+
+    bot.snapshot("bot.snap")
+    ...
+    bot = Bot(name, password)
+    bot.restore("bot.snap")
+    bot.main()
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any
+import json
+import os
+import struct
+import time
+import zlib
+
+from . import _genUid, _historyKey
+from .state import loadPM, loadRoom, loadUsers, pmState, roomState, usersState
+
+if TYPE_CHECKING:
+    from . import Room, RoomManager
+
+MAGIC = b"CHSNAP"
+VERSION = 2
+_HEADER = struct.Struct("!6sBI")
+
+
+def snapshot(mgr: RoomManager, path: str):
+    """
+    Write the state of a manager to a snapshot file, atomically.
+
+    @param mgr: the manager
+    @param path: snapshot file, replaced if it exists
+    """
+    state: dict[str, Any] = {
+        "time": time.time(),
+        "name": mgr.name,
+        "rooms": [roomState(room) for room in list(mgr._rooms.values())],
+        "pm": pmState(mgr._pm) if mgr._pm else None,
+        "users": usersState(),
+    }
+    data = zlib.compress(json.dumps(state, separators=(",", ":")).encode())
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(data)))
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def read(path: str) -> dict[str, Any]:
+    """
+    Read a snapshot file.
+
+    @param path: snapshot file
+
+    @return: the state
+    """
+    with open(path, "rb") as f:
+        magic, version, length = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a snapshot")
+        if version != VERSION:
+            raise ValueError(f"unsupported snapshot version {version}")
+        return json.loads(zlib.decompress(f.read(length)))
+
+
+def restore(mgr: RoomManager, path: str) -> list[Room]:
+    """
+    Join the rooms of a snapshot with their state restored, see RoomManager.restore.
+
+    @param mgr: the manager
+    @param path: snapshot file
+
+    @return: the rooms joined
+    """
+    state = read(path)
+    rooms: list[Room] = []
+    for roomState_ in state["rooms"]:
+        if (room := mgr.getRoom(roomState_["name"])) is not None:
+            rooms.append(room)
+            continue
+        room = mgr._Room(roomState_["name"], roomState_["providedUid"], mgr, connect=False)
+        loadRoom(room, roomState_, live=False)
+        room.uid = room._provided_uid or _genUid()
+        # what the history sent on joining may repeat
+        room._restored = set(map(_historyKey, room.history))
+        room._connect()
+        rooms.append(room)
+    if state["pm"] is not None and mgr._pm:
+        loadPM(mgr._pm, state["pm"])
+    loadUsers(state["users"])
+    return rooms
@@ -0,0 +1,164 @@
+"""
+Sliding-window flood and spam detection
+
+Every message entering a room's history is counted per user, unid, ip
+and content, see RoomManager.spamRules. A rule trips once its key went
+over the limit within the window, which calls onSpamDetected and, when
+the bot can moderate, takes the rule's action through the room's
+moderation lane ahead of other moderation commands:
+
+    class Bot(ch.RoomManager):
+        spamRules = [
+            SpamRule("user", limit=5, window=3, action="delete"),
+            SpamRule("duplicate", limit=4, window=30, action="clear"),
+        ]
+
+Windows are approximated from the counts of the current and previous
+window, which keeps three numbers per key and makes each update O(1).
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING, NamedTuple, Optional
+import re
+import zlib
+
+if TYPE_CHECKING:
+    from . import Message
+
+# what a rule counts messages by
+KEYS = ("user", "unid", "ip", "duplicate")
+ACTIONS = (None, "delete", "clear", "ban")
+
+_noise_re = re.compile(r"[\W_]+")
+_repeat_re = re.compile(r"(.)\1{2,}")
+
+
+class SpamRule(NamedTuple):
+    """
+    @param key: "user", "unid", "ip" or "duplicate" (same content, any room)
+    @param limit: messages allowed within the window
+    @param window: seconds
+    @param action: None to only call onSpamDetected, "delete" the message,
+                   "clear" every message of the sender or "ban" the sender
+    """
+    key: str
+    limit: int
+    window: float
+    action: Optional[str] = None
+
+
+def fingerprint(body: str) -> Optional[int]:
+    """
+    Hash the content of a message, ignoring case, punctuation, spacing and
+    stretched letters, so light variations of a message collide.
+
+    @return: the hash, None for content too short to tell apart
+    """
+    text = _repeat_re.sub(r"\1\1", _noise_re.sub("", body.casefold()))
+    if len(text) < SpamDetector.minDuplicateLength:
+        return None
+    return zlib.crc32(text.encode())
+
+
+class SlidingCounter:
+    """Approximate count of events per key within a sliding window"""
+    def __init__(self, window: float):
+        self.window = window
+        # key -> [window number, count in it, count in the one before]
+        self._counts: dict[object, list[float]] = dict()
+        self._swept = 0
+
+    def __len__(self):
+        return len(self._counts)
+
+    def hit(self, key: object, now: float) -> float:
+        """
+        Count an event.
+
+        @param key: what the event is counted under
+        @param now: unix time of the event
+
+        @return: events of key within the window ending now, this one included
+        """
+        position = now / self.window
+        current = int(position)
+        if current > self._swept + 1:
+            self._sweep(current)
+        if (count := self._counts.get(key)) is None:
+            count = self._counts[key] = [current, 0, 0]
+        elif count[0] != current:
+            count[2] = count[1] if count[0] == current - 1 else 0
+            count[1] = 0
+            count[0] = current
+        count[1] += 1
+        return count[1] + count[2] * (1 - (position - current))
+
+    def _sweep(self, current: int):
+        # keys that went quiet for a whole window count nothing anymore
+        self._counts = {key: count for key, count in self._counts.items()
+                        if count[0] >= current - 1}
+        self._swept = current
+
+
+class SpamDetector:
+    """Counts messages against every rule, see RoomManager.spamRules"""
+    # normalized length below which messages are not checked for duplicates
+    minDuplicateLength = 8
+    # actions remembered by claim before the expired ones get dropped
+    maxClaimed = 10000
+
+    def __init__(self, rules: list[SpamRule]):
+        for rule in rules:
+            if rule.key not in KEYS:
+                raise ValueError(f"unknown spam rule key {rule.key!r}")
+            if rule.action not in ACTIONS:
+                raise ValueError(f"unknown spam rule action {rule.action!r}")
+        self.rules = list(rules)
+        self._counters = [SlidingCounter(rule.window) for rule in self.rules]
+        self._claimed: dict[tuple[str, ...], float] = dict()
+
+    def _key(self, rule: SpamRule, msg: Message) -> object:
+        if rule.key == "user":
+            return msg.user.name
+        if rule.key == "unid":
+            return msg.unid or None
+        if rule.key == "ip":
+            return msg.ip or None
+        return fingerprint(msg.body)
+
+    def check(self, msg: Message) -> list[tuple[SpamRule, float]]:
+        """
+        Count a message.
+
+        @param msg: the message
+
+        @return: (rule, count) of every rule the message went over the limit of
+        """
+        tripped: list[tuple[SpamRule, float]] = []
+        for rule, counter in zip(self.rules, self._counters):
+            if (key := self._key(rule, msg)) is None:
+                continue
+            if (count := counter.hit(key, msg.time)) > rule.limit:
+                tripped.append((rule, count))
+        return tripped
+
+    def claim(self, room: str, rule: SpamRule, msg: Message) -> bool:
+        """
+        Tell whether the action of a tripped rule still has to be taken, so a
+        burst of spam deletes each message but clears or bans its sender once.
+
+        @param room: room name
+        @param rule: the tripped rule
+        @param msg: the message that tripped it
+
+        @return: False if the same action was already taken on it
+        """
+        if rule.action == "delete":
+            key: tuple[str, ...] = (room, "delete", msg.msgid or "")
+        else:
+            key = (room, rule.action or "", msg.user.name)
+        if self._claimed.get(key, 0) > msg.time:
+            return False
+        if len(self._claimed) >= self.maxClaimed:
+            self._claimed = {k: until for k, until in self._claimed.items() if until > msg.time}
+        self._claimed[key] = msg.time + rule.window
+        return True
@@ -0,0 +1,181 @@
+"""
+Room and PM state as plain python values
+
+Used to carry rooms over to another process, see ch.handoff, and to
+snapshot them to disk, see ch.snapshot.
+Users are referenced by name, messages are lists in MESSAGE_FIELDS order.
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any
+
+from . import BanList, BanRecord, Message, User
+
+if TYPE_CHECKING:
+    from . import PM, Room
+
+
+def _user(name: str) -> User:
+    # User(name) runs __init__ again, resetting the sessions of a known user
+    return User._users.get(name.lower()) or User(name)
+
+
+MESSAGE_FIELDS = ("time", "user", "body", "raw", "ip", "nameColor", "fontColor",
+                  "fontFace", "fontSize", "unid", "puid", "msgid")
+
+
+def messageState(msg: Message) -> list[Any]:
+    return [msg.time, msg.user.name, msg.body, msg.raw, msg.ip, msg.nameColor,
+            msg.fontColor, msg.fontFace, msg.fontSize, msg.unid, msg.puid, msg.msgid]
+
+
+def loadMessage(state: list[Any], room: Room) -> Message:
+    (timestamp, user, body, raw, ip, nameColor, fontColor, fontFace, fontSize,
+     unid, puid, msgid) = state
+    msg = Message(timestamp=timestamp, user=_user(user), body=body, raw=raw, ip=ip,
+                  nameColor=nameColor, fontColor=fontColor, fontFace=fontFace,
+                  fontSize=fontSize, unid=unid, puid=puid, room=room)
+    if msgid is not None:
+        msg.attach(room, msgid)
+    return msg
+
+
+def _banListState(banlist: BanList) -> list[list[Any]]:
+    return [[rec.unid, rec.ip, rec.target.name, rec.time, rec.src.name]
+            for rec in banlist.records.values()]
+
+
+def _loadBanList(banlist: BanList, state: list[list[Any]]):
+    for unid, ip, target, t, src in state:
+        banlist.add(BanRecord(unid, ip, _user(target), t, _user(src)))
+
+
+def roomState(room: Room) -> dict[str, Any]:
+    """
+    Get the state of a room, everything but its connection.
+
+    @param room: the room
+
+    @return: dict of plain values
+    """
+    userlist = list(dict.fromkeys(room._userlist))
+    return {
+        "name": room.name,
+        "server": room._server,
+        "port": room._port,
+        "uid": room.uid,
+        "providedUid": room._provided_uid,
+        "botName": room._bot_name,
+        "loginName": room._login_name,
+        "anonName": room._anon_name,
+        "anonN": room._anon_n,
+        "owner": room.owner.name if hasattr(room, "owner") else None,
+        "mods": {user.name: flags for user, flags in room._modFlags.items()},
+        "premium": room.premium,
+        "usercount": room.usercount,
+        "connectAmount": room._connectAmount,
+        "silent": room.silent,
+        "trackParticipants": room.trackParticipants,
+        "fetchBanlist": room.fetchBanlist,
+        "loadHistory": room.loadHistory,
+        "historyIndex": room._ihistoryIndex,
+        "history": [messageState(msg) for msg in room.history],
+        "pending": {i: messageState(msg) for i, msg in room._mqueue.items()},
+        # one entry per session, like room._userlist
+        "userlist": [user.name for user in room._userlist],
+        "sessions": {user.name: sorted(user.sids.get(room, ())) for user in userlist},
+        "banlist": _banListState(room._banlist),
+        "unbanlist": _banListState(room._unbanlist),
+    }
+
+
+def loadRoom(room: Room, state: dict[str, Any], live: bool = True):
+    """
+    Load the state of roomState into a room.
+
+    @param room: the room, not connected yet
+    @param state: dict returned by roomState
+    @param live: whether the room resumes the same session, if not the state
+                 bound to the session (uid, userlist, ...) is left out
+    """
+    room._server = state["server"]
+    room._port = state["port"]
+    room._provided_uid = state["providedUid"]
+    room._bot_name = state["botName"]
+    room._login_name = state["loginName"]
+    room._anon_name = state["anonName"]
+    room._anon_n = state["anonN"]
+    if state["owner"] is not None:
+        room.owner = _user(state["owner"])
+    room._modFlags = {_user(name): flags for name, flags in state["mods"].items()}
+    room.premium = state["premium"]
+    room.usercount = state["usercount"]
+    room.silent = state["silent"]
+    room.trackParticipants = state["trackParticipants"]
+    room.fetchBanlist = state["fetchBanlist"]
+    room.loadHistory = state["loadHistory"]
+    # through _addHistoryBatch so the search index learns about them
+    room._addHistoryBatch([loadMessage(msg, room) for msg in state["history"]])
+    _loadBanList(room._banlist, state["banlist"])
+    _loadBanList(room._unbanlist, state["unbanlist"])
+    if not live:
+        return
+    room.uid = state["uid"]
+    room._connectAmount = state["connectAmount"]
+    room._ihistoryIndex = state["historyIndex"]
+    room._mqueue = {i: loadMessage(msg, room) for i, msg in state["pending"].items()}
+    room._userlist = list(map(_user, state["userlist"]))
+    for name, sids in state["sessions"].items():
+        for sid in sids:
+            _user(name).addSessionId(room, sid)
+
+
+def pmState(pm: PM) -> dict[str, Any]:
+    """
+    Get the state of a PM connection, everything but the connection itself.
+
+    @param pm: the PM connection
+
+    @return: dict of plain values
+    """
+    return {
+        "server": pm._server,
+        "port": pm._port,
+        "contacts": [user.name for user in pm.contacts],
+        "blocklist": [user.name for user in pm.blocklist],
+        "status": {user.name: list(status) for user, status in pm.status.items()},
+    }
+
+
+def loadPM(pm: PM, state: dict[str, Any]):
+    """
+    Load the state of pmState into a PM connection.
+
+    @param pm: the PM connection, not connected yet
+    @param state: dict returned by pmState
+    """
+    pm._server = state["server"]
+    pm._port = state["port"]
+    pm.contacts = set(map(_user, state["contacts"]))
+    pm.blocklist = set(map(_user, state["blocklist"]))
+    pm.status = {_user(name): (status[0], status[1]) for name, status in state["status"].items()}
+
+
+USER_FIELDS = ("nameColor", "fontColor", "fontFace", "fontSize", "mbg", "mrec")
+
+
+def usersState() -> dict[str, list[Any]]:
+    """Get the attributes of every User in the registry, in USER_FIELDS order."""
+    return {name: [getattr(user, field) for field in USER_FIELDS]
+            for name, user in list(User._users.items())}
+
+
+def loadUsers(state: dict[str, list[Any]]):
+    """
+    Load the attributes of usersState into the User registry.
+
+    @param state: dict returned by usersState
+    """
+    for name, values in state.items():
+        user = _user(name)
+        for field, value in zip(USER_FIELDS, values):
+            setattr(user, field, value)
@@ -0,0 +1,11 @@
+from typing import Callable
+import pytest
+import ch
+
+
+@pytest.fixture
+def room() -> Callable[[ch.RoomManager, str], ch.Room]:
+    """Build rooms of a manager that never connect, to feed commands to by hand."""
+    def offlineRoom(mgr: ch.RoomManager, name: str) -> ch.Room:
+        return mgr._Room(name, None, mgr, connect=False)
+    return offlineRoom
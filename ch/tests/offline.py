@@ -0,0 +1,41 @@
+"""
+Helpers driving rooms by hand, without a server or the main loop
+
+Rooms connect over a LoopbackTransport going nowhere and the manager gets
+a task queue of its own, run with tick(), so tests don't see each other's
+tasks.
+"""
+import ch
+from ch.transport import LoopbackTransport
+
+
+def connect(mgr: ch.RoomManager, name: str) -> ch.Room:
+    """Join a room as if the server let us in, our commands pile up in _wbuf."""
+    if not hasattr(mgr, "tasks"):
+        mgr.tasks = ch.Task.scheduler()  # type: ignore
+        mgr._taskClass = lambda: mgr.tasks  # type: ignore
+    mgr.createTransport = lambda conn: LoopbackTransport(lambda data: None)  # type: ignore
+    room = mgr.joinRoom(name)
+    room._setWriteLock(False)
+    room._wbuf.clear()
+    room._firstCommand = False
+    return room
+
+
+def sent(room: ch.Room) -> list[str]:
+    """Take the commands the room sent so far."""
+    frames = [frame for frame in room._wbuf.decode().split("\r\n\x00") if frame]
+    room._wbuf.clear()
+    return frames
+
+
+def tick(mgr: ch.RoomManager, at: float = 0):
+    """Run the tasks of a manager due by now + at seconds."""
+    tasks = mgr.tasks  # type: ignore
+    # as if at seconds passed, the queue entries carry the target too
+    for task in [entry[2] for entry in tasks._tasks_queue]:
+        task.target -= at
+    tasks._tasks_queue[:] = [(task.target, counter, task)
+                             for _target, counter, task in tasks._tasks_queue]
+    tasks._tasks_queue.sort()
+    tasks.tick()
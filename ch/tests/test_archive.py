@@ -0,0 +1,78 @@
+#!/usr/bin/python
+import os
+import tempfile
+import time
+import ch
+from ch.archive import Archive
+from ch.fakeserver import FakeServer
+
+
+def message(i: int, user: str) -> ch.Message:
+    return ch.Message(timestamp=1000 + i, user=ch.User(user), body=f"message {i}",
+                      raw=f"message {i}", ip="127.0.0.1", nameColor=None, fontColor=None,
+                      fontFace=None, fontSize=None, unid=f"unid{i % 7}", puid="1",
+                      room=None)  # type: ignore
+
+
+def test_archive_queries():
+    archive = Archive(os.path.join(tempfile.mkdtemp(), "archive.db"), batchSize=500)
+    for i in range(20000):
+        archive.add(message(i, f"user{i % 10}"), f"room{i % 4}" if i % 5 else None)
+    assert archive.flush(10)
+    assert archive.count() == 20000
+
+    start = time.perf_counter()
+    latest = archive.byUser("user3", limit=1000)
+    assert time.perf_counter() - start < 0.1
+    assert len(latest) == 1000
+    assert latest[0].body == "message 19993"
+    assert all(a.time > b.time for a, b in zip(latest, latest[1:]))
+
+    window = archive.byRoom("room1", since=1000, until=1100)
+    assert {m.room for m in window} == {"room1"}
+    assert len(window) == 20
+    assert all(m.unid == "unid2" for m in archive.byUnid("unid2", limit=50))
+    assert all(m.room is None for m in archive.pm("user0"))
+    archive.close()
+
+
+def test_manager_archives_messages():
+    server = FakeServer(users=3, rate=20, history=5)
+    server.start()
+    received: list[ch.Message] = []
+
+    class Bot(ch.RoomManager):
+        archivePath = os.path.join(tempfile.mkdtemp(), "bot.db")
+
+        def onMessage(self, room, user, message):
+            received.append(message)
+
+    bot = server.manager(Bot)("bot", "password", pm=False)
+    bot.joinRoom("archiveroom")
+    bot.setTimeout(1, bot.stop)
+    bot.main()
+    server.stop()
+
+    archived = bot.archive.byRoom("archiveroom", limit=10000)
+    assert received and len(archived) == len(received)
+    # history messages aren't archived, they were archived when they were posted
+    assert not any(m.body.startswith("history") for m in archived)
+    assert archived[0].msgid == received[-1].msgid
+
+
+def test_unid_lookup_uses_the_index():
+    archive = Archive(os.path.join(tempfile.mkdtemp(), "archive.db"))
+    for i in range(100):
+        archive.add(message(i, "user"), "room")
+    assert archive.flush(10)
+    db = archive._db()
+    statements: list[str] = []
+    db.set_trace_callback(statements.append)
+    latest = archive.byUnid("unid3", limit=5)
+    db.set_trace_callback(None)
+    assert [m.time for m in latest] == [1094, 1087, 1080, 1073, 1066]
+    plan = [row[-1] for row in db.execute("EXPLAIN QUERY PLAN " + statements[-1])]
+    assert any("USING INDEX messages_unid_time" in step for step in plan), plan
+    assert not any(step.startswith("SCAN") or "TEMP B-TREE" in step for step in plan), plan
+    assert archive.byUnid("") == []
+    archive.close()
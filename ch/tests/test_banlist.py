@@ -0,0 +1,78 @@
+#!/usr/bin/python
+import ch
+from .offline import connect, sent
+
+
+class Bot(ch.RoomManager):
+    fetchBanlist = False
+
+
+def ban(i: int, when: float) -> tuple[str, str, str, str, str]:
+    return (f"unid{i}", f"10.0.0.{i}", f"user{i}", f"{when:.2f}", "mod")
+
+
+def serve(room: ch.Room, bans: list[tuple[str, str, str, str, str]]) -> int:
+    """
+    Answer the blocklist requests of a room till the fetch ends.
+
+    Like the server, pages hold the newest bans first and start at the
+    cursor itself, so bans sharing its timestamp come again.
+
+    @return: number of pages served
+    """
+    bans = sorted(bans, key=lambda rec: float(rec[3]), reverse=True)
+    pages = 0
+    while frames := sent(room):
+        _, kind, cursor, _, size = frames[-1].split(":")
+        page = [rec for rec in bans if cursor == "" or float(rec[3]) <= float(cursor)]
+        room._rcmd_blocklist(";".join(":".join(rec) for rec in page[:int(size)]).split(":"))
+        pages += 1
+    return pages
+
+
+def test_pages_and_repeated_timestamps(monkeypatch):
+    monkeypatch.setattr(ch.BanList, "pageSize", 3)
+    mgr = Bot("bot", None, pm=False)
+    room = connect(mgr, "banned")
+    # the first page ends in the middle of the bans at 7
+    bans = [ban(1, 10), ban(2, 9), ban(3, 7), ban(4, 7), ban(5, 7), ban(6, 5), ban(7, 4)]
+    room.requestBanlist()
+    assert serve(room, bans) == 3
+    assert sorted(user.name for user in room._banlist.records) == [
+        f"user{i}" for i in range(1, 8)]
+    assert room._banlist._seen is None
+
+    # bans gone from the list get dropped once the next fetch ends
+    room.requestBanlist()
+    serve(room, bans[2:])
+    assert sorted(user.name for user in room._banlist.records) == [
+        f"user{i}" for i in range(3, 8)]
+    assert "10.0.0.1" not in room._banlist.byIp and "unid2" not in room._banlist.byUnid
+
+
+def test_page_of_one_timestamp(monkeypatch):
+    monkeypatch.setattr(ch.BanList, "pageSize", 2)
+    mgr = Bot("bot", None, pm=False)
+    room = connect(mgr, "flood")
+    # more bans of one timestamp than a page holds, the fetch goes on past it
+    room.requestBanlist()
+    assert serve(room, [ban(i, 3) for i in range(5)] + [ban(5, 2)]) == 3
+    assert sent(room) == []
+    assert {user.name for user in room._banlist.records} == {"user0", "user1", "user5"}
+
+
+def test_is_banned():
+    mgr = Bot("bot", None, pm=False)
+    room = connect(mgr, "lookup")
+    room.requestBanlist()
+    serve(room, [ban(1, 2), ban(2, 1)])
+    assert room.isBanned(ch.User("user1"))
+    assert room.isBanned(ip="10.0.0.2") and room.isBanned(unid="unid2")
+    assert not room.isBanned(ch.User("user3"), ip="10.0.0.3", unid="unid3")
+
+    # the same ip banned under two names stays banned till both are gone
+    room._rcmd_blocked(["unid3", "10.0.0.2", "user3", "mod", "3"])
+    room._rcmd_unblocked(["unid2", "10.0.0.2", "user2", "mod", "3"])
+    assert room.isBanned(ip="10.0.0.2") and not room.isBanned(unid="unid2")
+    room._rcmd_unblocked(["unid3", "10.0.0.2", "user3", "mod", "4"])
+    assert not room.isBanned(ip="10.0.0.2")
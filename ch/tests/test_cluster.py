@@ -0,0 +1,102 @@
+#!/usr/bin/python
+import pytest
+import ch
+from ch.cluster import Cluster, HashRing
+from ch.fakeserver import FakeServer
+
+
+def test_ring_moves_few_keys():
+    keys = [f"room{i}" for i in range(2000)]
+    ring = HashRing((0, 1, 2, 3))
+    before = {key: ring.get(key) for key in keys}
+    ring.add(4)
+    moved = [key for key in keys if ring.get(key) != before[key]]
+    # only keys now owned by the new node move, roughly 1/5 of them
+    assert all(ring.get(key) == 4 for key in moved)
+    assert 200 < len(moved) < 700
+    ring.remove(4)
+    assert {key: ring.get(key) for key in keys} == before
+
+
+@pytest.mark.timeout(30)
+def test_cluster_forwards_events():
+    server = FakeServer(users=3, rate=0, history=0)
+    server.start()
+    connected: list[str] = []
+    echoed: set[str] = set()
+    rooms = [f"clusterroom{i}" for i in range(6)]
+
+    class Coordinator(Cluster):
+        def onConnect(self, room):
+            connected.append(room.name)
+            room.message("hello " + room.name)
+
+        def onMessage(self, room, user, message):
+            assert message.body == "hello " + room.name
+            echoed.add(room.name)
+            if len(echoed) == len(rooms):
+                self.stop()
+
+    cluster = Coordinator(server.manager(ch.RoomManager), workers=2, name="bot",
+                          password="password", pm=False)
+    for room in rooms:
+        cluster.joinRoom(room)
+    assert set(cluster.rooms.values()) <= {0, 1}
+    cluster.main()
+    server.stop()
+    assert sorted(connected) == rooms
+    assert echoed == set(rooms)
+
+
+@pytest.mark.timeout(30)
+def test_cluster_survives_handler_errors_and_stop_in_batch(capsys):
+    server = FakeServer(users=3, rate=0, history=0)
+    server.start()
+    connected: list[str] = []
+    rooms = [f"stoproom{i}" for i in range(8)]
+
+    class Coordinator(Cluster):
+        def onConnect(self, room):
+            connected.append(room.name)
+            if len(connected) == 1:
+                raise RuntimeError("broken handler")
+            if len(connected) == len(rooms) - 2:
+                # the rooms still connecting leave ready pipes in the batch
+                self.stop()
+
+    cluster = Coordinator(server.manager(ch.RoomManager), workers=4, name="bot",
+                          password="password", pm=False)
+    for room in rooms:
+        cluster.joinRoom(room)
+    cluster.main()
+    server.stop()
+    assert len(connected) >= len(rooms) - 2
+    assert cluster.workers == []
+    assert "broken handler" in capsys.readouterr().err
+    # dropping a worker stop() already removed is a no-op
+    cluster._dropWorker(0)
+
+
+@pytest.mark.timeout(30)
+def test_cluster_room_names_any_case():
+    server = FakeServer(users=3, rate=0, history=0)
+    server.start()
+    echoed: list[str] = []
+
+    class Coordinator(Cluster):
+        def onConnect(self, room):
+            # proxied through the name as it was typed
+            self.getRoom("MixedRoom").message("hello")
+
+        def onMessage(self, room, user, message):
+            echoed.append(f"{room.name}:{message.body}")
+            self.stop()
+
+    cluster = Coordinator(server.manager(ch.RoomManager), workers=2, name="bot",
+                          password="password", pm=False)
+    proxy = cluster.joinRoom("MixedRoom")
+    assert cluster.joinRoom("MIXEDROOM") is proxy and proxy.name == "mixedroom"
+    assert list(cluster.rooms) == ["mixedroom"]
+    cluster.main()
+    server.stop()
+    assert echoed == ["mixedroom:hello"]
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+import ch
+from .offline import connect
+
+
+class Bot(ch.RoomManager):
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self.seen: list[str] = []
+
+    def onMessage(self, room, user, message):
+        self.seen.append("onMessage:" + message.body)
+
+
+def post(room: ch.Room, i: int, body: str):
+    room._rcmd_b([str(i), "alice", "", "puid", "unid", str(i), "ip", "", "", body])
+    room._rcmd_u([str(i), f"m{i}"])
+
+
+def test_overridden_events():
+    mgr = Bot("bot", None, pm=False)
+    assert mgr.hasHandler("onMessage")
+    assert not any(mgr.hasHandler(evt) for evt in ("onRaw", "onJoin", "onHistoryBatch"))
+    assert "onMessage" in Bot._overriddenEvents
+    assert not ch.RoomManager._overriddenEvents
+    # subclasses inherit what their bases override
+    assert type("Sub", (Bot,), {})("bot", None, pm=False).hasHandler("onMessage")
+
+
+def test_unhandled_events_skipped(monkeypatch):
+    called: list[str] = []
+    monkeypatch.setattr(ch.RoomManager, "onUserCountChange",
+                        lambda self, room: called.append("base"))
+    mgr = Bot("bot", None, pm=False)
+    room = connect(mgr, "skipped")
+    room._rcmd_n(["a"])
+    assert room.usercount == 10 and called == []
+    post(room, 1, "hello")
+    assert mgr.seen == ["onMessage:hello"]
+
+
+def test_subscribe():
+    mgr = Bot("bot", None, pm=False)
+    room = connect(mgr, "subscribed")
+    counts: list[int] = []
+    mgr.onUserCountChange = lambda room: counts.append(room.usercount)
+    room._rcmd_n(["1"])
+    assert counts == []
+    mgr.subscribe("onUserCountChange")
+    assert mgr.hasHandler("onUserCountChange")
+    room._rcmd_n(["2"])
+    assert counts == [2]
+
+
+def test_raw_and_every_event():
+    class Listening(Bot):
+        def onRaw(self, room, raw):
+            self.seen.append("onRaw:" + raw.split(":")[0])
+
+        def onEventCalled(self, room, evt, *args, **kw):
+            self.seen.append(evt)
+
+    mgr = Listening("bot", None, pm=False)
+    room = connect(mgr, "listening")
+    # onEventCalled makes every event count as handled
+    assert mgr.hasHandler("onJoin")
+    room._process("n:5")
+    assert mgr.seen == ["onRaw:n", "onRaw", "onUserCountChange"]
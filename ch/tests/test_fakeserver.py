@@ -0,0 +1,85 @@
+#!/usr/bin/python
+from typing import Callable
+import pytest
+import ch
+from ch.fakeserver import FakeServer
+
+
+@pytest.fixture(scope="module", params=["tcp", "websocket", "loopback"])
+def server(request):
+    """Turn a manager class into one connected to a fake server, over TCP or in memory."""
+    server = FakeServer(users=5, rate=20, history=10, websocket=request.param == "websocket")
+    if request.param != "loopback":
+        server.start()
+        yield server.manager
+        server.stop()
+    else:
+        yield server.loopback
+
+
+def run(server: Callable[[type[ch.RoomManager]], type[ch.RoomManager]],
+        mgrClass: type[ch.RoomManager], rooms: list[str],
+        seconds: float = 1, **kw: ...) -> ch.RoomManager:
+    bot = server(mgrClass)("bot", "password", **kw)
+    for room in rooms:
+        bot.joinRoom(room)
+    bot.setTimeout(seconds, bot.stop)
+    bot.main()
+    return bot
+
+
+def test_join_rooms(server):
+    connected: list[str] = []
+
+    class Bot(ch.RoomManager):
+        def onConnect(self, room):
+            connected.append(room.name)
+
+    rooms = [f"room{i}" for i in range(20)]
+    run(server, Bot, rooms, pm=False)
+    assert sorted(connected) == sorted(rooms)
+
+
+def test_history_and_participants(server):
+    seen: dict[str, int] = {"history": 0, "users": 0}
+
+    class Bot(ch.RoomManager):
+        def onConnect(self, room):
+            self.setTimeout(0.5, self.check, room)
+
+        def check(self, room):
+            seen["history"] = sum(m.body.startswith("history") for m in room.history)
+            seen["users"] = len(room.usernames)
+
+    run(server, Bot, ["historyroom"], pm=False)
+    assert seen["history"] == 10
+    assert seen["users"] == 5
+
+
+def test_message_echo(server):
+    received: list[ch.Message] = []
+
+    class Bot(ch.RoomManager):
+        def onConnect(self, room):
+            room.message("hello fake server")
+
+        def onMessage(self, room, user, message):
+            if user == self.user:
+                received.append(message)
+
+    run(server, Bot, ["echoroom"], pm=False)
+    assert [m.body for m in received] == ["hello fake server"]
+
+
+def test_pm(server):
+    received: list[str] = []
+
+    class Bot(ch.RoomManager):
+        def onPMConnect(self, pm):
+            pm.message(ch.User("user1"), "hi")
+
+        def onPMMessage(self, pm, user, message):
+            received.append(message.body)
+
+    run(server, Bot, [])
+    assert received == ["hi"]
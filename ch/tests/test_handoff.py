@@ -0,0 +1,62 @@
+#!/usr/bin/python
+import os
+import tempfile
+import threading
+import ch
+from ch.fakeserver import FakeServer
+
+
+def test_handoff_keeps_connections():
+    server = FakeServer(users=5, rate=20, history=10)
+    server.start()
+    path = os.path.join(tempfile.mkdtemp(), "handoff.sock")
+    rooms = [f"handoff{i}" for i in range(3)]
+    ready = threading.Event()
+    connected: list[str] = []
+    events: list[str] = []
+
+    class Old(ch.RoomManager):
+        def onConnect(self, room):
+            connected.append(room.name)
+            if len(connected) == len(rooms):
+                # give the userlists a moment to arrive
+                self.setTimeout(0.3, ready.set)
+
+        def onInit(self):
+            self.listenHandoff(path)
+
+    class New(ch.RoomManager):
+        def onConnect(self, room):
+            events.append("connect " + room.name)
+
+        def onMessage(self, room, user, message):
+            if user == self.user:
+                events.append(f"{room.name}: {message.body}")
+
+        def onPMMessage(self, pm, user, message):
+            events.append("pm: " + message.body)
+
+    old = server.manager(Old)("bot", "password")
+    for room in rooms:
+        old.joinRoom(room)
+    thread = threading.Thread(target=old.main, daemon=True)
+    thread.start()
+    assert ready.wait(5)
+
+    new = server.manager(New)("bot", "password", pm=False)
+    taken = new.takeOver(path)
+    thread.join(5)
+    assert not thread.is_alive()
+    assert not old.rooms and old.pm is None
+
+    assert sorted(room.name for room in taken) == rooms
+    room = new.getRoom(rooms[0])
+    assert sum(m.body.startswith("history") for m in room.history) == 10
+    assert len(room.usernames) == 5
+    room.message("still here")
+    new.pm.message(ch.User("user1"), "hi")
+    new.setTimeout(1, new.stop)
+    new.main()
+    server.stop()
+    # no reconnect on our side, the server kept the sessions
+    assert sorted(events) == [f"{rooms[0]}: still here", "pm: hi"]
@@ -0,0 +1,201 @@
+#!/usr/bin/python
+import threading
+import time
+import pytest
+import ch
+from .offline import connect, sent, tick
+
+
+class Bot(ch.RoomManager):
+    loadHistory = False
+
+
+def reply(room: ch.Room, start: int, count: int, nomore: bool = False):
+    """Answer a get_more with messages start .. start + count - 1, higher is older."""
+    for i in range(start, start + count):
+        room._rcmd_i([str(1000 - i), "user", "", "puid", "unid", str(i), "ip", "", "",
+                      f"old {i}"])
+    if nomore:
+        room._rcmd_nomore([])
+    else:
+        room._rcmd_gotmore([])
+
+
+def test_window_and_limit():
+    mgr = Bot("bot", None, pm=False)
+    room = connect(mgr, "history")
+    batches: list[list[str]] = []
+    done: list[int] = []
+    room.fetchHistory(25, lambda r, msgs: batches.append([m.body for m in msgs]),
+                      lambda r, count: done.append(count), batchSize=10, window=2)
+    assert sent(room) == ["get_more:10:0", "get_more:10:1"]
+
+    reply(room, 0, 10)
+    # one answered, the third and last needed request goes out
+    assert sent(room) == ["get_more:10:2"]
+    assert batches[0] == [f"old {i}" for i in reversed(range(10))]
+    reply(room, 10, 10)
+    assert sent(room) == []
+    reply(room, 20, 10)
+    # only the newest part of the last batch fits the limit
+    assert batches[2] == [f"old {i}" for i in reversed(range(20, 25))]
+    assert done == [25]
+    assert room._historyFetcher is None and not room._gettingmorehistory
+    assert room.history == []
+
+
+def test_overall_order():
+    mgr = Bot("bot", None, pm=False)
+    streamed, held = connect(mgr, "streamed"), connect(mgr, "held")
+    batches: dict[str, list[list[float]]] = {"streamed": [], "held": []}
+    for room, oldestFirst in ((streamed, False), (held, True)):
+        room.fetchHistory(25, lambda r, msgs: batches[r.name].append([m.time for m in msgs]),
+                          batchSize=10, window=3, oldestFirst=oldestFirst)
+        for start in (0, 10, 20):
+            reply(room, start, 10)
+    # each batch oldest first, but the server goes back in time batch by batch
+    assert [batch[0] for batch in batches["streamed"]] == [991, 981, 976]
+    assert all(batch == sorted(batch) for batch in batches["streamed"])
+    assert [t for batch in batches["streamed"] for t in batch] != sorted(
+        t for batch in batches["streamed"] for t in batch)
+    # held back, everything comes at the end in one batch, oldest first overall
+    assert len(batches["held"]) == 1
+    assert batches["held"][0] == [float(1000 - i) for i in reversed(range(25))]
+
+
+def test_generator_oldest_first():
+    mgr = Bot("bot", None, pm=False)
+    room = connect(mgr, "genorder")
+    got: list[float] = []
+    queued = mgr.tasks._tasks_queue  # type: ignore
+    consumer = threading.Thread(
+        target=lambda: got.extend(m.time for m in room.fetchHistory(15, batchSize=10,
+                                                                    oldestFirst=True)),
+        daemon=True)
+    consumer.start()
+    deadline = time.monotonic() + 5
+    while not queued and time.monotonic() < deadline:
+        time.sleep(0.01)
+    tick(mgr)
+    reply(room, 0, 10)
+    reply(room, 10, 10)
+    consumer.join(5)
+    assert got == [float(1000 - i) for i in reversed(range(15))]
+
+
+def test_nomore_swallows_late_answers():
+    mgr = Bot("bot", None, pm=False)
+    room = connect(mgr, "nomore")
+    done: list[int] = []
+    room.fetchHistory(100, lambda r, msgs: None, lambda r, count: done.append(count),
+                      batchSize=10, window=2)
+    assert len(sent(room)) == 2
+    reply(room, 0, 4, nomore=True)
+    assert done == [4]
+    # the second request is still answered, then the room is free again
+    assert room._gettingmorehistory
+    reply(room, 4, 0)
+    assert done == [4]
+    assert room._historyFetcher is None and not room._gettingmorehistory
+    assert sent(room) == []
+
+
+def test_abort_on_disconnect():
+    mgr = Bot("bot", None, pm=False)
+    room = connect(mgr, "aborted")
+    done: list[int] = []
+    room.fetchHistory(100, lambda r, msgs: None, lambda r, count: done.append(count),
+                      batchSize=10, window=3)
+    reply(room, 0, 10)
+    room.disconnect()
+    assert done == [10]
+    assert room._historyFetcher is None
+
+
+def test_generator_while_busy():
+    mgr = Bot("bot", None, pm=False)
+    room = connect(mgr, "busy")
+    room.getMoreHistory()
+    with pytest.raises(RuntimeError):
+        next(room.fetchHistory(10))
+
+
+def test_generator_losing_the_race():
+    mgr = Bot("bot", None, pm=False)
+    room = connect(mgr, "race")
+    errors: list[Exception] = []
+
+    def consume():
+        try:
+            list(room.fetchHistory(10))
+        except RuntimeError as error:
+            errors.append(error)
+
+    queued = mgr.tasks._tasks_queue  # type: ignore
+    before = len(queued)
+    consumer = threading.Thread(target=consume, daemon=True)
+    consumer.start()
+    deadline = time.monotonic() + 5
+    while len(queued) == before and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # another fetch starts before the scheduled one runs
+    room.getMoreHistory()
+    tick(mgr)
+    consumer.join(5)
+    assert not consumer.is_alive()
+    assert len(errors) == 1
+
+
+def initial(room: ch.Room, count: int):
+    """The initial history of a room, sent newest first, then inited."""
+    room.owner = ch.User("owner")
+    for i in reversed(range(count)):
+        room._rcmd_i([str(1000 + i), "alice", "", "puid", "unid", str(i), "ip", "", "",
+                      f"old {i}"])
+    room._rcmd_inited([])
+
+
+def test_one_batch_per_inited(monkeypatch):
+    batches: list[list[str]] = []
+    singles: list[str] = []
+
+    class Batched(ch.RoomManager):
+        maxHistoryLength = 10
+        fetchBanlist = False
+
+        def onHistoryBatch(self, room, messages):
+            batches.append([m.body for m in messages])
+
+        def onHistoryMessage(self, room, user, message):
+            singles.append(message.body)
+
+    trims: list[int] = []
+    trim = ch.Room._trimHistory
+    monkeypatch.setattr(ch.Room, "_trimHistory",
+                        lambda self: (trims.append(len(self.history)), trim(self)))
+    mgr = Batched("bot", None, pm=False)
+    room = connect(mgr, "batched")
+    initial(room, 25)
+    assert batches == [[f"old {i}" for i in range(25)]]
+    # the batch replaces the per message calls
+    assert singles == []
+    assert trims == [25]
+    assert [m.body for m in room.history] == [f"old {i}" for i in range(15, 25)]
+
+
+def test_per_message_fallback():
+    singles: list[tuple[str, int]] = []
+
+    class Single(ch.RoomManager):
+        fetchBanlist = False
+
+        def onHistoryMessage(self, room, user, message):
+            # each message is added right after its own call
+            singles.append((message.body, len(room.history)))
+
+    mgr = Single("bot", None, pm=False)
+    room = connect(mgr, "single")
+    assert not mgr.hasHandler("onHistoryBatch")
+    initial(room, 3)
+    assert singles == [("old 0", 0), ("old 1", 1), ("old 2", 2)]
+    assert len(room.history) == 3
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+import time
+import ch
+from ch.fakeserver import FakeServer
+from .offline import connect
+
+
+class Bot(ch.RoomManager):
+    trackLatency = True
+    metricsEnabled = True
+
+
+def test_echoes_matched():
+    class Talking(Bot):
+        def onConnect(self, room):
+            for i in range(3):
+                room.message(f"ping {i}")
+
+    bot = FakeServer(users=2, rate=0, history=0).loopback(Talking)("bot", "password", pm=False)
+    room = bot.joinRoom("echoes")
+    bot.setTimeout(0.5, bot.stop)
+    bot.main()
+    assert len(room.latency) == 3
+    assert all(0 <= rtt < 0.5 for rtt in room.latency.samples)
+    assert bot.getServerLatency(room._server).samples == room.latency.samples
+    assert bot.metrics.timings["echo_rtt"].count == 3
+
+
+def test_unmatched_messages_expire():
+    class Flooding(Bot):
+        echoTimeout = 0.5
+
+        def onConnect(self, room):
+            # flood control drops all but the first two, never echoed
+            for i in range(5):
+                room.message(f"flood {i}")
+            self.setTimeout(1.2, room.message, "later")
+
+        def onMessage(self, room, user, message):
+            if message.body == "later":
+                self.stop()
+
+    server = FakeServer(users=2, rate=0, history=0, floodLimit=2)
+    bot = server.loopback(Flooding)("bot", "password", pm=False)
+    room = bot.joinRoom("flood")
+    bot.setTimeout(3, bot.stop)
+    bot.main()
+    assert len(room.latency) == 3
+    # matched against its own send, not one of the dropped ones 1.2s older
+    assert room.latency.samples[-1] < 0.5
+
+
+def test_echo_without_a_send():
+    mgr = Bot("bot", None, pm=False)
+    room = connect(mgr, "stray")
+    room._echoSeen()
+    assert len(room.latency) == 0
+    now = time.monotonic()
+    room._echoes.extend([now - 60, now - 45, now - 0.1])
+    room._echoSeen()
+    assert len(room.latency) == 1 and 0.1 <= room.latency.samples[0] < 30
+    assert not room._echoes
+
+
+def test_degraded_and_recovered():
+    events: list[tuple[str, float]] = []
+
+    class Alerting(Bot):
+        latencyAlertThreshold = 1.0
+
+        def onLatencyDegraded(self, room, server, p90):
+            events.append(("degraded", p90))
+
+        def onLatencyRecovered(self, room, server, p90):
+            events.append(("recovered", p90))
+
+    mgr = Alerting("bot", None, pm=False)
+    room = connect(mgr, "alerting")
+    for rtt in [0.1] * 9 + [2.0] * 2:
+        mgr._latencySample(room, rtt)
+    assert events == [("degraded", 2.0)]
+    # hovering just under the threshold isn't enough to recover
+    for rtt in [0.9] * 20:
+        mgr._latencySample(room, rtt)
+    assert len(events) == 1
+    for rtt in [0.1] * 256:
+        mgr._latencySample(room, rtt)
+    assert [event for event, _ in events] == ["degraded", "recovered"]
+    assert events[1][1] < 0.8
+    assert room.latency.percentile(50) is None
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+import ch
+from .offline import connect, sent
+
+
+class Lean(ch.RoomManager):
+    trackParticipants = False
+    loadHistory = False
+
+    def onHistoryMessage(self, room, user, message):
+        pass
+
+
+def inited(room: ch.Room, owner: str = "owner") -> list[str]:
+    room.owner = ch.User(owner)
+    room._rcmd_inited([])
+    return sent(room)
+
+
+def test_participants_not_fetched():
+    mgr = Lean("bot", None, pm=False)
+    room = connect(mgr, "lean")
+    assert "g_participants:start" not in inited(room)
+    room._rcmd_g_participants(["s1", "100", "p1", "alice", "None", "0"])
+    room._rcmd_participant(["1", "s2", "p2", "bob", "None", "", "100"])
+    assert room.userlist == []
+
+
+def test_banlist_only_for_mods():
+    mgr = ch.RoomManager("bot", None, pm=False)
+    room = connect(mgr, "banlist")
+    assert not any(frame.startswith("blocklist") for frame in inited(room))
+    # made a mod later, the skipped lists get requested then
+    room._rcmd_mods(["bot,0"])
+    assert sent(room) == ["blocklist:block::next:500", "blocklist:unblock::next:500"]
+    room._rcmd_mods(["bot,0;alice,0"])
+    assert sent(room) == []
+
+    owned = connect(mgr, "owned")
+    assert "blocklist:block::next:500" in inited(owned, owner="bot")
+
+
+def test_history_not_built():
+    mgr = Lean("bot", None, pm=False)
+    room = connect(mgr, "nohistory")
+    room._rcmd_i(["1000", "alice", "", "puid", "unid", "1", "ip", "", "", "old"])
+    assert room._i_log == [] and room.history == []
+    # unless we asked for more history ourselves
+    room._gettingmorehistory = True
+    room._rcmd_i(["1000", "alice", "", "puid", "unid", "1", "ip", "", "", "old"])
+    assert len(room._i_log) == 1
+
+
+def test_join_overrides_the_manager():
+    mgr = Lean("bot", None, pm=False)
+    room = connect(mgr, "override")
+    assert mgr.joinRoom("Override", trackParticipants=True, fetchBanlist=False,
+                        loadHistory=True) is room
+    assert (room.trackParticipants, room.fetchBanlist, room.loadHistory) == (True, False, True)
+    frames = inited(room, owner="bot")
+    assert "g_participants:start" in frames
+    assert not any(frame.startswith("blocklist") for frame in frames)
+    room._rcmd_i(["1000", "alice", "", "puid", "unid", "1", "ip", "", "", "old"])
+    assert len(room._i_log) == 1
+    # the other rooms keep the manager's flags
+    other = connect(mgr, "other")
+    assert (other.trackParticipants, other.loadHistory) == (False, False)
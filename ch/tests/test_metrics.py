@@ -0,0 +1,100 @@
+#!/usr/bin/python
+import re
+import socket
+import ch
+from ch.fakeserver import FakeServer
+from ch.metrics import Histogram, Metrics
+
+SAMPLE = re.compile(r'^([a-z_]+)(\{(?:[a-z]+="(?:[^"\\]|\\.)*",?)*\})? (\S+)$')
+
+
+class Bot(ch.RoomManager):
+    metricsEnabled = True
+
+    def onMessage(self, room, user, message):
+        pass
+
+
+def parse(text: str) -> tuple[dict[str, str], list[tuple[str, str, float]]]:
+    """Split the Prometheus text into the declared types and the samples."""
+    types: dict[str, str] = dict()
+    samples: list[tuple[str, str, float]] = list()
+    assert text.endswith("\n")
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            assert name not in types
+            types[name] = kind
+            continue
+        match = SAMPLE.match(line)
+        assert match, line
+        samples.append((match[1], match[2] or "", float(match[3])))
+    return types, samples
+
+
+def test_snapshot_after_a_session():
+    server = FakeServer(users=3, rate=20, history=5)
+    bot = server.loopback(Bot)("bot", None, pm=False)
+    bot.joinRoom("measured")
+    snapshots = []
+    bot.setTimeout(0.5, lambda: (snapshots.append(bot.metrics.snapshot()), bot.stop()))
+    bot.main()
+    snapshot = snapshots[0]
+
+    conn = snapshot["connections"]["room:measured"]
+    assert conn["bytes_in"] > 0 and conn["bytes_out"] > 0
+    assert conn["frames"]["inited"] == 1 and conn["frames"]["i"] == 5
+    assert snapshot["events"]["onMessage"]["count"] == conn["frames"]["b"]
+    events = snapshot["events"]["onMessage"]
+    assert sum(events["buckets"]) == events["count"] and events["sum"] >= 0
+    assert snapshot["gauges"]["ch_rooms"] == 1
+    assert snapshot["gauges"]["ch_write_buffer_bytes;conn=measured;kind=room"] == 0
+    # a copy, later traffic doesn't show up in it
+    bot.metrics.conn("room", "measured").frame("inited")
+    assert conn["frames"]["inited"] == 1
+
+
+def test_prometheus_text():
+    metrics = Metrics(enabled=True)
+    stats = metrics.conn("room", 'odd "name"\n')
+    stats.bytesIn = 10
+    stats.frame("b")
+    for duration in (0.00005, 0.003, 0.003, 2, 60):
+        metrics.event("onMessage", duration)
+    metrics.collectors.append(lambda: [("ch_rooms", {}, 1), ("ch_queue", {"conn": "a"}, 2),
+                                       ("ch_queue", {"conn": "b"}, 3)])
+    types, samples = parse(metrics.prometheus())
+
+    assert types["ch_received_bytes_total"] == "counter"
+    assert types["ch_event_seconds"] == "histogram"
+    assert types["ch_rooms"] == types["ch_queue"] == "gauge"
+    assert ("ch_received_bytes_total", r'{kind="room",conn="odd \"name\"\n"}', 10) in samples
+    assert [value for name, _, value in samples if name == "ch_queue"] == [2, 3]
+
+    buckets = [(labels, value) for name, labels, value in samples
+               if name == "ch_event_seconds_bucket"]
+    assert len(buckets) == len(Histogram.buckets) + 1
+    counts = [value for _, value in buckets]
+    # cumulative, the last one being +Inf and equal to the count
+    assert counts == sorted(counts) and counts[-1] == 5
+    assert buckets[-1][0] == '{event="onMessage",le="+Inf"}'
+    assert dict((name, value) for name, _, value in samples
+                if name.startswith("ch_event_seconds_"))["ch_event_seconds_count"] == 5
+
+
+def test_serve():
+    metrics = Metrics(enabled=True)
+    metrics.conn("pm", "bot").bytesOut = 42
+    metrics.serve(("127.0.0.1", 0))
+    try:
+        with socket.create_connection(metrics._server.getsockname(), timeout=5) as sock:
+            sock.sendall(b"GET /metrics HTTP/1.0\r\n\r\n")
+            response = b""
+            while data := sock.recv(4096):
+                response += data
+    finally:
+        metrics.stopServing()
+    head, _, body = response.partition(b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.0 200 OK")
+    assert body.decode() == metrics.prometheus()
+    assert 'ch_sent_bytes_total{kind="pm",conn="bot"} 42' in body.decode()
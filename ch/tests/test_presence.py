@@ -0,0 +1,91 @@
+#!/usr/bin/python
+import time
+import ch
+from ch.presence import PresenceIndex
+
+
+class Bot(ch.RoomManager):
+    trackPresence = True
+
+
+def test_room_events(room):
+    mgr = Bot(None, None, pm=False)
+    a, b = room(mgr, "a"), room(mgr, "b")
+    a._rcmd_g_participants(["s1", "100", "p1", "alice", "None", "0;s2", "100", "p2", "bob",
+                            "None", "0"])
+    b._rcmd_participant(["1", "s3", "p1", "alice", "None", "", "200"])
+    b._rcmd_participant(["1", "s4", "p1", "alice", "None", "", "201"])
+    a._rcmd_b(["300", "alice", "", "p1", "", "i1", "", "", "", "hi"])
+    b._rcmd_b(["310", "alice", "", "p1", "", "i2", "", "", "", "hi"])
+    b._rcmd_b(["320", "", "", "p9", "", "i3", "", "", "", "<n1234/>anon"])
+
+    presence = mgr.presence
+    assert presence.where("Alice") == {"a", "b"}
+    assert presence.lastMessage("alice") == 310
+    assert presence.lastMessage("alice", "a") == 300
+    assert presence.get("alice").lastJoin == (201, "b")
+    assert len(presence) == 2
+
+    # one of two sessions leaving keeps alice in the room
+    b._rcmd_participant(["0", "s3", "p1", "alice", "None", "", "400"])
+    assert presence.where("alice") == {"a", "b"}
+    b._rcmd_participant(["0", "s4", "p1", "alice", "None", "", "401"])
+    assert presence.where("alice") == {"a"}
+    assert presence.get("alice").lastLeave == (401, "b")
+
+    # the bot leaving a room is not the users leaving it
+    presence.roomGone("a")
+    assert presence.where("alice") == set()
+    assert presence.get("bob").lastLeave is None
+    assert presence.lastSeen("alice") == (401, "b")
+    assert presence.lastSeen("bob") == (100, "a")
+    assert presence.lastSeen("nobody") is None
+
+
+def test_pm_status_and_persistence(tmp_path, room):
+    path = str(tmp_path / "seen.bin")
+
+    class Saved(Bot):
+        presencePath = path
+
+    mgr = Saved(None, None, pm=False)
+    pm = mgr._PM(mgr=mgr, connect=False)
+    pm._rcmd_wloffline(["carol", "500"])
+    pm._rcmd_wlonline(["dave"])
+    r = room(mgr, "c")
+    r._rcmd_participant(["1", "s1", "p1", "erin", "None", "", "600"])
+    r._rcmd_b(["650", "erin", "", "p1", "", "i1", "", "", "", "hi"])
+    assert mgr.presence.lastSeen("carol") == (500, "pm")
+    assert mgr.presence.lastSeen("dave")[1] == "pm"
+    mgr.stop()
+
+    loaded = Saved(None, None, pm=False).presence
+    assert len(loaded) == 3
+    assert loaded.get("carol").pm == (500, False)
+    assert loaded.lastMessage("erin", "c") == 650
+    # who is here right now is not carried over
+    assert loaded.where("erin") == set()
+    assert loaded.lastSeen("erin") == (650, "c")
+
+
+def test_many_users():
+    presence = PresenceIndex()
+    for i in range(200_000):
+        presence.message(f"room{i % 50}", f"user{i}", i)
+    start = time.perf_counter()
+    for i in range(0, 200_000, 20):
+        assert presence.lastSeen(f"user{i}") == (i, f"room{i % 50}")
+    assert time.perf_counter() - start < 1
+
+
+def test_names_any_case():
+    presence = PresenceIndex()
+    presence.join("Lobby", "Alice", 10)
+    presence.message("lobby", "ALICE", 20)
+    presence.pmStatus("alice", 30, True)
+    assert len(presence) == 1
+    seen = presence.get("aLiCe")
+    assert seen is not None and seen.name == "alice" and seen.rooms == {"lobby"}
+    assert presence.lastMessage("Alice", "LOBBY") == 20
+    presence.roomGone("LOBBY")
+    assert presence.where("alice") == set()
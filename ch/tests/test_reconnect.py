@@ -0,0 +1,103 @@
+#!/usr/bin/python
+import pytest
+import ch
+from .offline import connect, tick
+
+
+class Bot(ch.RoomManager):
+    autoReconnect = True
+    reconnectDelay = 1
+    reconnectMaxDelay = 8
+    reconnectJitter = 0
+    maxConcurrentReconnects = 2
+    serverFailThreshold = 2
+    serverCooldown = 60
+    fetchBanlist = False
+
+    def getServer(self, room):
+        return "s1.chatango.com"
+
+
+def delay(mgr: ch.RoomManager, room: ch.Room) -> float:
+    return mgr._reconnector._pending[room].timeout
+
+
+def test_backoff_growth_and_jitter():
+    mgr = Bot("bot", None, pm=False)
+    reconnector = mgr._reconnector
+    assert [reconnector.backoff(i) for i in range(6)] == [1, 2, 4, 8, 8, 8]
+    mgr.reconnectJitter = 0.5
+    assert all(2 <= reconnector.backoff(2) <= 4 for _ in range(100))
+
+
+def test_backoff_resets_once_connected():
+    mgr = Bot("bot", None, pm=False)
+    room = connect(mgr, "backoff")
+    room._connectionLost()
+    assert delay(mgr, room) == 1
+    tick(mgr, 1.01)
+    assert mgr._reconnector.attempting(room)
+    # the attempt fails, the next one waits twice as long
+    room._connectionLost()
+    assert delay(mgr, room) == 2
+    tick(mgr, 2.01)
+    room._rcmd_inited([])
+    stats = mgr._reconnector.stats()
+    assert stats["recovered"] == 1 and stats["pending"] == stats["inflight"] == 0
+    assert stats["last"] == stats["max"] == stats["mean"] > 0
+
+    room._connectionLost()
+    assert delay(mgr, room) == 1
+    # a stale read reconnects right away
+    mgr._reconnector.cancel(room)
+    room._connect()
+    room._connectionLost(fast=True)
+    assert delay(mgr, room) == 0
+
+
+def test_attempts_above_the_cap_wait():
+    mgr = Bot("bot", None, pm=False)
+    rooms = [connect(mgr, f"capped{i}") for i in range(4)]
+    for room in rooms:
+        room._connectionLost()
+    tick(mgr, 1.01)
+    reconnector = mgr._reconnector
+    assert reconnector.stats()["inflight"] == 2
+    assert reconnector.stats()["waiting"] == 2
+    assert [room.connected for room in rooms] == [True, True, False, False]
+
+    # a finished attempt frees a slot for the first one waiting
+    rooms[0]._rcmd_inited([])
+    assert reconnector.stats()["waiting"] == 1
+    tick(mgr)
+    assert rooms[2].connected and not rooms[3].connected
+    assert reconnector.stats()["inflight"] == 2
+
+
+def test_breaker_opens_then_half_opens():
+    mgr = Bot("bot", None, pm=False)
+    room = connect(mgr, "breaker")
+    reconnector = mgr._reconnector
+    room._connectionLost()
+    for wait in (1, 2):
+        tick(mgr, wait + 0.01)
+        room._connectionLost()
+    # two failed attempts in a row, the server is held off for the cooldown
+    assert not reconnector.serverAvailable("s1.chatango.com")
+    tick(mgr, 4.01)
+    assert not reconnector.attempting(room)
+    assert delay(mgr, room) == pytest.approx(60 + 1, abs=0.5)
+
+    # cooldown over, one attempt gets through, failing it opens the breaker again
+    reconnector._openUntil["s1.chatango.com"] -= 61
+    tick(mgr, 61.01)
+    assert reconnector.attempting(room)
+    room._connectionLost()
+    assert not reconnector.serverAvailable("s1.chatango.com")
+
+    # a successful attempt closes it
+    reconnector._openUntil["s1.chatango.com"] -= 61
+    tick(mgr, 70)
+    room._rcmd_inited([])
+    assert reconnector.serverAvailable("s1.chatango.com")
+    assert "s1.chatango.com" not in reconnector._failures
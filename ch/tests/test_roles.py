@@ -0,0 +1,31 @@
+#!/usr/bin/python
+import ch
+
+
+def test_role_index(room):
+    changes = []
+
+    class Bot(ch.RoomManager):
+        def onModAdd(self, room, user):
+            changes.append(("add", user.name))
+
+        def onModRemove(self, room, user):
+            changes.append(("remove", user.name))
+
+    mgr = Bot("bot", None, pm=False)
+    r = room(mgr, "roles")
+    r.owner = ch.User("owner")
+    r.fetchBanlist = False
+    r._rcmd_ok(["owner", "uid", "N", "", "1.2.3.4.5678", "", "bot,82368"])
+    assert r.getModFlags(ch.User("bot")) == 82368
+    r._rcmd_mods(["bot,82368", "mod1,0", "mod2,2", "mod3,1"])
+    assert changes == [("add", "mod1"), ("add", "mod2"), ("add", "mod3")]
+    assert r.getLevel(ch.User("owner")) == 2
+    assert r.getLevel(ch.User("mod2")) == 1
+    assert r.getLevel(ch.User("nobody")) == 0
+    assert r.hasModFlag(ch.User("mod2"), 2) and not r.hasModFlag(ch.User("mod1"), 2)
+
+    r._rcmd_mods(["mod2,6"])
+    assert changes[3:] == [("remove", "bot"), ("remove", "mod1"), ("remove", "mod3")]
+    assert r.getModFlags(ch.User("mod2")) == 6
+    assert r.modnames == ["mod2"]
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+import random
+import time
+import ch
+from .offline import connect
+
+
+class Bot(ch.RoomManager):
+    indexHistory = True
+    maxHistoryLength = 20000
+
+
+def post(room: ch.Room, i: int, user: str, body: str) -> ch.Message:
+    msg = ch.Message(timestamp=i, user=ch.User(user), body=body, raw=body, ip="",
+                     nameColor=None, fontColor=None, fontFace=None, fontSize=None,
+                     unid="", puid="", room=room)
+    msg.attach(room, str(i))
+    room._addHistory(msg)
+    return msg
+
+
+def bodies(msgs: list[ch.Message]) -> list[str]:
+    return [msg.body for msg in msgs]
+
+
+def test_queries(room):
+    mgr = Bot(None, None, pm=False)
+    a, b = room(mgr, "a"), room(mgr, "b")
+    post(a, 1, "alice", "Good morning everyone")
+    post(a, 2, "bob", "morning, good people")
+    post(b, 3, "alice", "good MORNING from room b")
+    post(b, 4, "carol", "Goodbye and good night")
+
+    search = mgr.search
+    assert bodies(search.query("good morning")) == [
+        "good MORNING from room b", "morning, good people", "Good morning everyone"]
+    assert bodies(search.query('"good morning"')) == [
+        "good MORNING from room b", "Good morning everyone"]
+    assert bodies(search.query("goodb*")) == ["Goodbye and good night"]
+    assert bodies(search.query("morning from:alice", room="a")) == ["Good morning everyone"]
+    assert bodies(search.query("good", user="carol")) == ["Goodbye and good night"]
+    assert search.query("nothing here") == []
+
+
+def test_eviction_and_delete(room):
+    class Small(Bot):
+        maxHistoryLength = 3
+
+    mgr = Small(None, None, pm=False)
+    r = room(mgr, "small")
+    msgs = [post(r, i, "dave", f"message number {i}") for i in range(5)]
+    assert len(mgr.search) == 3
+    assert bodies(mgr.search.query("number", limit=10)) == [
+        "message number 4", "message number 3", "message number 2"]
+    r._rcmd_deleteall([msgs[3].msgid, msgs[4].msgid])
+    assert bodies(mgr.search.query("number")) == ["message number 2"]
+    assert "3" not in mgr.search._postings
+
+
+def test_leaving_drops_the_room():
+    mgr = Bot("bot", None, pm=False)
+    left, kept = connect(mgr, "left"), connect(mgr, "kept")
+    post(left, 1, "erin", "goodbye room")
+    post(kept, 2, "erin", "goodbye other room")
+    mgr.leaveRoom("left")
+    assert bodies(mgr.search.query("goodbye")) == ["goodbye other room"]
+    assert "left" not in mgr.search._byRoom
+    # nothing indexed keeps the Room of the left room alive
+    assert all(msg.room is not left for msg in mgr.search._tokens)
+
+
+def test_dropped_for_good():
+    mgr = Bot("bot", None, pm=False)
+    mgr.autoReconnect = True
+    dropped, coming = connect(mgr, "dropped"), connect(mgr, "coming")
+    post(dropped, 1, "erin", "lost room")
+    post(coming, 2, "erin", "lost for a moment")
+    # a reconnect is scheduled, the history comes back with the room
+    coming._connectionLost()
+    assert mgr._reconnector.scheduled(coming)
+    mgr.autoReconnect = False
+    dropped._connectionLost()
+    assert bodies(mgr.search.query("lost")) == ["lost for a moment"]
+    mgr._reconnector.cancelAll()
+
+
+def test_query_speed(room):
+    mgr = Bot(None, None, pm=False)
+    rooms = [room(mgr, f"speed{i}") for i in range(10)]
+    words = [f"word{i}" for i in range(2000)]
+    rng = random.Random(1)
+    for i in range(30000):
+        post(rooms[i % 10], i, f"user{i % 50}", " ".join(rng.choices(words, k=8)))
+    assert len(mgr.search) == 30000
+
+    start = time.perf_counter()
+    for _ in range(100):
+        mgr.search.query("word1 word2", user="user3")
+        mgr.search.query('"word5 word6"')
+    assert (time.perf_counter() - start) / 200 < 0.001
@@ -0,0 +1,50 @@
+#!/usr/bin/python
+import threading
+import ch
+from ch.fakeserver import FakeServer
+from ch.mixin import Sharded
+
+
+def test_rooms_spread_over_shards():
+    server = FakeServer(users=5, rate=20, history=0)
+    server.start()
+    threads: dict[str, str] = {}
+    echoed: list[str] = []
+    sent: list[str] = ["pm:hi"]
+
+    class Bot(Sharded, ch.RoomManager):
+        shardCount = 3
+
+        def onConnect(self, room):
+            threads[room.name] = threading.current_thread().name
+            if len(threads) == 12:
+                # sent from the shard of the last room to connect to another one
+                other = next(r for r in self.rooms
+                             if self.shardOf(r.name) is not self.shardOf(room.name))
+                other.message("from " + room.name)
+                sent.append(f"{other.name}:from {room.name}")
+                # the PM belongs to shard 0, the thread running main
+                self.pm.message(ch.User("user1"), "hi")
+
+        def onMessage(self, room, user, message):
+            if user == self.user:
+                assert threading.current_thread().name == threads[room.name]
+                echoed.append(f"{room.name}:{message.body}")
+
+        def onPMMessage(self, pm, user, message):
+            assert threading.current_thread() is threading.main_thread()
+            echoed.append(f"pm:{message.body}")
+
+    bot = server.manager(Bot)("bot", "password")
+    rooms = [f"room{i}" for i in range(12)]
+    for room in rooms:
+        assert bot.joinRoom(room).name == room
+    bot.setTimeout(1, bot.stop)
+    bot.main()
+    server.stop()
+
+    assert sorted(threads) == sorted(rooms)
+    assert len(set(threads.values())) == 3
+    assert all(threads[room] == f"ch-shard-{bot.shardOf(room).index}" for room in rooms)
+    assert sorted(echoed) == sorted(sent)
+    assert not bot.rooms
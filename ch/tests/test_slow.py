@@ -0,0 +1,97 @@
+#!/usr/bin/python
+import time
+import ch
+from ch.fakeserver import FakeServer
+from ch.mixin import Sharded
+
+
+def run(mgrClass: type[ch.RoomManager], rooms: list[str],
+        seconds: float = 0.6) -> ch.RoomManager:
+    bot = FakeServer(users=2, rate=0, history=0).loopback(mgrClass)("bot", None, pm=False)
+    for room in rooms:
+        bot.joinRoom(room)
+    bot.setTimeout(seconds, bot.stop)
+    bot.main()
+    return bot
+
+
+def test_slow_handlers_and_tasks(capsys):
+    class Bot(ch.RoomManager):
+        slowEventThreshold = 0.05
+        slowTaskThreshold = 0.05
+
+        def onConnect(self, room):
+            time.sleep(0.1)
+            self.setTimeout(0, self.busy)
+
+        def onUserCountChange(self, room):
+            pass
+
+        def busy(self):
+            time.sleep(0.1)
+
+    run(Bot, ["slowroom"])
+    out = capsys.readouterr().out
+    assert "[RoomManager][slow] onConnect in slowroom took" in out
+    assert "[RoomManager][slow] task test_slow_handlers_and_tasks.<locals>.Bot.busy took" in out
+    # quick handlers aren't reported
+    assert "onUserCountChange" not in out
+
+
+def test_loop_lag():
+    lags: list[float] = []
+
+    class Bot(ch.RoomManager):
+        metricsEnabled = True
+
+        def onConnect(self, room):
+            self.setTimeout(0.05, self.late)
+            # keep the loop from running it on time
+            time.sleep(0.3)
+
+        def late(self):
+            lags.append(self.loopLag)
+
+    bot = run(Bot, ["laggy"])
+    assert len(lags) == 1 and 0.2 < lags[0] < 1
+    assert bot.metrics.timings["loop_lag"].count > 0
+
+
+def test_blocked_loop_dumps_the_stack(capsys):
+    class Bot(ch.RoomManager):
+        blockedLoopThreshold = 0.1
+
+        def onConnect(self, room):
+            time.sleep(0.4)
+
+    run(Bot, ["blocked"])
+    err = capsys.readouterr().err
+    assert err.count("[LoopWatchdog] Loop blocked") == 1
+    assert "by onConnect, stack:" in err and "time.sleep(0.4)" in err
+
+
+def test_watchdog_per_shard(capsys):
+    server = FakeServer(users=2, rate=0, history=0)
+    server.start()
+
+    class Bot(Sharded, ch.RoomManager):
+        shardCount = 2
+        blockedLoopThreshold = 0.1
+
+        def onConnect(self, room):
+            time.sleep(0.4)
+
+    bot = server.manager(Bot)("bot", None, pm=False)
+    # one room on each shard, blocking both loops at once
+    names = iter(f"room{i}" for i in range(100))
+    rooms = [next(name for name in names if bot.shardOf(name) is shard)
+             for shard in bot.shards[1:]]
+    for room in rooms:
+        bot.joinRoom(room)
+    bot.setTimeout(1, bot.stop)
+    bot.main()
+    server.stop()
+    err = capsys.readouterr().err
+    assert err.count("[LoopWatchdog] Loop blocked") == 2
+    assert not bot._watchdog.loops or all(state.depth == 0
+                                          for state in bot._watchdog.loops.values())
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+import os
+import tempfile
+import ch
+from ch.fakeserver import FakeServer
+from ch.snapshot import read
+
+
+def test_restore_delivers_only_new_history():
+    server = FakeServer(users=3, rate=0, history=10)
+    server.start()
+    path = os.path.join(tempfile.mkdtemp(), "bot.snap")
+
+    class Old(ch.RoomManager):
+        def onConnect(self, room):
+            room.message("before")
+
+        def onMessage(self, room, user, message):
+            if message.body == "before":
+                self.snapshot(path)
+                room.message("after")
+            elif message.body == "after":
+                self.stop()
+
+    old = server.manager(Old)("bot", "password", pm=False)
+    old.joinRoom("snaproom")
+    old.main()
+    assert read(path)["rooms"][0]["name"] == "snaproom"
+
+    history: list[str] = []
+    connected: list[str] = []
+
+    class New(ch.RoomManager):
+        def onConnect(self, room):
+            connected.append(room.name)
+
+        def onHistoryMessage(self, room, user, message):
+            history.append(message.body)
+
+    new = server.manager(New)("bot", "password", pm=False)
+    rooms = new.restore(path)
+    assert [room.name for room in rooms] == ["snaproom"]
+    # the snapshot is loaded before anything comes from the server
+    assert [m.body for m in rooms[0].history][-1] == "before"
+    new.setTimeout(0.5, new.stop)
+    new.main()
+    server.stop()
+
+    assert connected == ["snaproom"]
+    assert history == ["after"]
+    bodies = [m.body for m in rooms[0].history]
+    assert len(bodies) == 12 and bodies[-2:] == ["before", "after"]
+
+
+def test_known_user_keeps_its_state():
+    from ch.state import _user
+    user = ch.User("MixedCase")
+    user.addSessionId(ch.Room("keeproom", None, None), "1234")
+    assert _user("MixedCase") is user
+    assert user.getSessionIds() == {"1234"}
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+import pytest
+import ch
+from ch.spam import SlidingCounter, SpamRule, fingerprint
+from .offline import sent
+
+
+class Bot(ch.RoomManager):
+    spamRules = [
+        SpamRule("user", limit=3, window=10, action="delete"),
+        SpamRule("duplicate", limit=2, window=60, action="ban"),
+    ]
+    moderationBurst = 3
+
+
+def moderated(room: ch.Room) -> ch.Room:
+    """Make the bot a moderator of an offline room."""
+    room.owner = ch.User("owner")
+    room._modFlags = {ch.User("bot"): 0}
+    room._firstCommand = False
+    return room
+
+
+def post(room: ch.Room, i: int, user: str, body: str):
+    room._rcmd_b([str(i), user, "", "p" + user, "unid" + user, str(i), "1.2.3.4", "", "", body])
+    room._rcmd_u([str(i), f"m{i}"])
+
+
+def test_sliding_counter():
+    counter = SlidingCounter(10)
+    assert [counter.hit("a", t) for t in (100, 101, 102)] == [1, 2, 3]
+    # halfway through the next window, half of the previous one still counts
+    assert counter.hit("a", 115) == 2.5
+    assert counter.hit("a", 140) == 1
+    assert fingerprint("BUY   cheap stuff!!!") == fingerprint("buy cheap stufffff")
+    assert fingerprint("lol") is None
+
+
+def test_rules_and_actions(room):
+    detected = []
+
+    class Watching(Bot):
+        def onSpamDetected(self, room, user, message, rule, count):
+            detected.append((user.name, message.body, rule.key))
+
+    mgr = Watching("bot", None, pm=False)
+    r = moderated(room(mgr, "r"))
+    for i in range(5):
+        post(r, 100 + i, "flooder", f"message {i}")
+    assert [d[1] for d in detected] == ["message 3", "message 4"]
+    # mods are never checked
+    for i in range(5):
+        post(r, 200 + i, "bot", f"own message {i}")
+    assert len(detected) == 2
+    assert sent(r) == ["delmsg:m103", "delmsg:m104"]
+
+    # the same ad from several users, the ban goes out once per sender
+    for i, user in enumerate(["a", "b", "c", "c"]):
+        post(r, 300 + i, user, "Visit my SHOP now")
+    assert [d[0] for d in detected[2:]] == ["c", "c"]
+    # burst spent, the rest waits in the lane
+    assert sent(r) == ["block:unidc:1.2.3.4:c"]
+    assert len(r.moderation) == 0
+
+
+def test_lane_priority(room):
+    mgr = Bot("bot", None, pm=False)
+    r = moderated(room(mgr, "lane"))
+    for i in range(5):
+        r.moderation.push(("delmsg", f"n{i}"))
+    r.moderation.push(("block", "u", "ip", "spammer"), urgent=True)
+    assert sent(r) == ["delmsg:n0", "delmsg:n1", "delmsg:n2"]
+    r.moderation._tokens = 2
+    r.moderation._pump()
+    assert sent(r) == ["block:u:ip:spammer", "delmsg:n3"]
+    assert len(r.moderation) == 1
+    r.moderation.clear()
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_bulk_moderate(room, indexed):
+    mgr = type("Indexed", (Bot,), {"indexHistory": indexed})("bot", None, pm=False)
+    mgr.spam = None
+    r = moderated(room(mgr, "bulk"))
+    for i, user in enumerate(["x", "y", "x", "z", "#temp"]):
+        post(r, 100 + i, user, f"raid {i}")
+    if indexed:
+        # users are found through the search index, not the history
+        r.history = []
+    x, y, z, temp = (ch.User(name) for name in ("x", "y", "z", "#temp"))
+    progress = []
+    finished = []
+    queued = r.bulkModerate(
+        [("delete", r.msgs["m100"]), ("clear", x), ("clear", x), ("delete", r.msgs["m101"]),
+         ("ban", z), ("ban", r.msgs["m103"]), ("clear", temp), ("ban", ch.User("nobody"))],
+        progress=lambda room, sent, total: progress.append((sent, total)),
+        done=lambda room, total: finished.append(total))
+    assert queued == 4
+    assert sent(r) == ["delallmsg:unidx:1.2.3.4:x", "block:unidz:1.2.3.4:z",
+                       "delallmsg:unid#temp:1.2.3.4:"]
+    assert progress == [(1, 4), (2, 4), (3, 4)] and not finished
+    r.moderation._tokens = 1
+    r.moderation._pump()
+    assert sent(r) == ["delmsg:m101"]
+    assert finished == [4]
+
+    r._modFlags = {}
+    assert r.bulkModerate([("clear", y)]) == 0
@@ -0,0 +1,57 @@
+#!/usr/bin/python
+import pytest
+import ch
+from ch.fakeserver import FakeServer
+
+
+@pytest.fixture(params=["tcp", "loopback"])
+def silent(request):
+    """A fake server whose users never talk, over TCP or in memory."""
+    server = FakeServer(users=2, rate=0, history=0)
+    if request.param == "tcp":
+        server.start()
+        yield server.manager
+        server.stop()
+    else:
+        yield server.loopback
+
+
+class Watched(ch.RoomManager):
+    readTimeout = 0.2
+    reconnectDelay = 0.05
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self.events: list[str] = []
+
+    def onConnect(self, room):
+        self.events.append("connect")
+
+    def onStale(self, room):
+        self.events.append("stale")
+
+    def onReconnect(self, room):
+        self.events.append("reconnect")
+
+
+def test_silent_connection_reconnects(silent):
+    bot = silent(Watched)("bot", None, pm=False)
+    bot.joinRoom("quiet")
+    bot.setTimeout(0.8, bot.stop)
+    bot.main()
+    # stale after readTimeout, reconnected right away, then stale again
+    assert bot.events[:4] == ["connect", "stale", "reconnect", "stale"]
+
+
+def test_talking_connection_stays(silent):
+    class Talking(Watched):
+        def onConnect(self, room):
+            super().onConnect(room)
+            self.setInterval(0.15, room.message, "still here")
+
+    bot = silent(Talking)("bot", None, pm=False)
+    bot.joinRoom("chatty")
+    bot.setTimeout(0.8, bot.stop)
+    bot.main()
+    # our own messages come back, the connection is never silent for long
+    assert bot.events == ["connect"]
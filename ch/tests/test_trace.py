@@ -0,0 +1,58 @@
+#!/usr/bin/python
+import pytest
+import ch
+from ch.fakeserver import FakeServer
+from ch.trace import TRACE_IN, TRACE_OUT, readTrace, replay
+
+
+def counting(seen: list[str]) -> type[ch.RoomManager]:
+    class Counting(ch.RoomManager):
+        def onMessage(self, room, user, message):
+            seen.append(f"{room.name}:{user.name}:{message.body}")
+
+    return Counting
+
+
+def test_record_then_replay(tmp_path):
+    path = str(tmp_path / "bot.trace")
+    live: list[str] = []
+
+    class Recording(counting(live)):
+        def onConnect(self, room):
+            room.message("recorded " + room.name)
+
+    server = FakeServer(users=3, rate=20, history=5)
+    bot = server.loopback(Recording)("bot", "password", pm=False)
+    bot.startTrace(path)
+    for room in ("tracea", "traceb"):
+        bot.joinRoom(room)
+    bot.setTimeout(0.5, bot.stop)
+    bot.main()
+    bot.stopTrace()
+
+    meta, records = readTrace(path)
+    assert meta["name"] == "bot" and meta["started"] > 0
+    frames = list(records)
+    assert {key for _, key, _, _ in frames} == {"room:tracea", "room:traceb"}
+    times = [when for _, _, when, _ in frames]
+    assert times == sorted(times)
+    sent = [(key, frame) for kind, key, _, frame in frames if kind == TRACE_OUT]
+    assert [key for key, frame in sent if frame.startswith("bauth:")] == [
+        "room:tracea", "room:traceb"]
+    assert sum(frame.startswith("bmsg:") for _, frame in sent) == 2
+    inbound = [frame for kind, _, _, frame in frames if kind == TRACE_IN]
+    assert inbound[0].startswith("ok:")
+
+    replayed: list[str] = []
+    stats = replay(path, mgrClass=counting(replayed))
+    assert stats["frames"] == len(inbound)
+    assert stats["events"] >= len(live) and stats["frames_per_sec"] > 0
+    # the handlers see the same messages as they did live
+    assert len(live) > 5 and replayed == live
+
+
+def test_not_a_trace(tmp_path):
+    path = tmp_path / "junk"
+    path.write_bytes(b"nothing to see")
+    with pytest.raises(ValueError):
+        readTrace(str(path))
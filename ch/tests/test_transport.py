@@ -0,0 +1,63 @@
+#!/usr/bin/python
+import os
+import pytest
+from ch.transport import (FrameDecoder, LoopbackTransport, PerMessageDeflate, OP_PING, OP_TEXT,
+                          encodeFrame)
+
+
+@pytest.mark.parametrize("size", [0, 5, 125, 126, 65535, 65536])
+def test_frame_roundtrip(size):
+    payload = os.urandom(size)
+    decoder = FrameDecoder()
+    assert decoder.feed(encodeFrame(OP_TEXT, payload)) == [(OP_TEXT, False, payload)]
+    assert decoder.feed(encodeFrame(OP_TEXT, payload, mask=False)) == [(OP_TEXT, False, payload)]
+
+
+def test_frame_incremental():
+    data = encodeFrame(OP_TEXT, b"first\x00") + encodeFrame(OP_PING, b"") \
+        + encodeFrame(OP_TEXT, b"second\x00" * 100)
+    decoder = FrameDecoder()
+    out = []
+    for i in range(len(data)):
+        out += decoder.feed(data[i:i + 1])
+    assert out == [(OP_TEXT, False, b"first\x00"), (OP_PING, False, b""),
+                   (OP_TEXT, False, b"second\x00" * 100)]
+
+
+def test_fragmented_message():
+    # first fragment without FIN, then a continuation with FIN
+    first = bytes([OP_TEXT, 3]) + b"abc"
+    last = bytes([0x80, 3]) + b"def"
+    assert FrameDecoder().feed(first + last) == [(OP_TEXT, False, b"abcdef")]
+
+
+@pytest.mark.parametrize("params", [{}, {"client_no_context_takeover": None,
+                                         "server_no_context_takeover": None}])
+def test_deflate_roundtrip(params):
+    client = PerMessageDeflate(params, client=True)
+    server = PerMessageDeflate(params, client=False)
+    for i in range(10):
+        msg = f'b:1700000000.{i}:user::1::::0::<n000/><f x12000="0">hello {i}\r\n\x00'.encode()
+        assert server.decompress(client.compress(msg)) == msg
+        assert client.decompress(server.compress(msg)) == msg
+
+
+def test_deflate_parse():
+    assert PerMessageDeflate.parse("x-foo, permessage-deflate; client_max_window_bits=10") \
+        == {"client_max_window_bits": "10"}
+    assert PerMessageDeflate.parse("x-foo") is None
+
+
+def test_loopback():
+    sent = []
+    transport = LoopbackTransport(sent.append)
+    buf = bytearray(4)
+    with pytest.raises(BlockingIOError):
+        transport.recv_into(buf)
+    transport.send(b"ping\x00")
+    transport.deliver(b"pong\x00")
+    assert sent == [b"ping\x00"]
+    assert transport.recv_into(buf) == 4 and buf == b"pong"
+    assert transport.recv_into(buf) == 1 and buf[:1] == b"\x00"
+    transport.hangUp()
+    assert transport.pendingRead and transport.recv_into(buf) == 0
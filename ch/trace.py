@@ -0,0 +1,186 @@
+"""
+Protocol trace recorder and replayer
+
+A trace is an append-only binary file starting with a header, followed by
+one record per frame:
+
+    header: b"CHTRACE" version:u8 meta_length:u32 meta:json
+    record: kind:u8 conn:u16 time:f64 length:u32 payload
+
+kind is one of TRACE_NAME (defines the "room:name" or "pm:" key of a conn id),
+TRACE_IN or TRACE_OUT, time is monotonic seconds since the recording started.
+
+    $ python -m ch.trace bot.trace --speed 10
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, BinaryIO, Generator, Optional
+import argparse
+import json
+import struct
+import time
+
+if TYPE_CHECKING:
+    from . import Conn, RoomManager
+
+MAGIC = b"CHTRACE"
+VERSION = 1
+TRACE_NAME = 0
+TRACE_IN = 1
+TRACE_OUT = 2
+
+_header = struct.Struct("<BI")
+_record = struct.Struct("<BHdI")
+
+
+def _connKey(conn: Conn) -> str:
+    # rooms have a name, the PM doesn't
+    name = getattr(conn, "name", None)
+    return "pm:" if name is None else "room:" + name
+
+
+class TraceRecorder:
+    """Append every frame going through a manager's connections to a trace file"""
+    def __init__(self, path: str, meta: Optional[dict[str, Any]] = None):
+        self.path = path
+        self._file: BinaryIO = open(path, "wb")
+        self._ids: dict[str, int] = dict()
+        self._start = time.monotonic()
+        header = json.dumps(dict(meta or {}, started=time.time())).encode()
+        self._file.write(MAGIC + _header.pack(VERSION, len(header)) + header)
+
+    def record(self, conn: Conn, kind: int, frame: str):
+        """
+        Record a frame.
+
+        @param conn: the connection it went through
+        @param kind: TRACE_IN or TRACE_OUT
+        @param frame: the frame without terminator
+        """
+        now = time.monotonic() - self._start
+        key = _connKey(conn)
+        if (cid := self._ids.get(key)) is None:
+            cid = self._ids[key] = len(self._ids)
+            data = key.encode()
+            self._file.write(_record.pack(TRACE_NAME, cid, now, len(data)) + data)
+        data = frame.encode()
+        self._file.write(_record.pack(kind, cid, now, len(data)) + data)
+
+    def close(self):
+        self._file.close()
+
+
+def readTrace(path: str) -> tuple[dict[str, Any], Generator[tuple[int, str, float, str], None, None]]:  # noqa: E501
+    """
+    Read a trace file.
+
+    @param path: trace file
+
+    @return: the header meta data and a generator of (kind, conn key, time, frame)
+    """
+    f = open(path, "rb")
+    if f.read(len(MAGIC)) != MAGIC:
+        f.close()
+        raise ValueError(path + " is not a ch trace")
+    version, length = _header.unpack(f.read(_header.size))
+    if version != VERSION:
+        f.close()
+        raise ValueError(f"Unsupported trace version {version}")
+    meta = json.loads(f.read(length))
+
+    def records() -> Generator[tuple[int, str, float, str], None, None]:
+        names: dict[int, str] = dict()
+        with f:
+            while len(head := f.read(_record.size)) == _record.size:
+                kind, cid, when, length = _record.unpack(head)
+                data = f.read(length).decode(errors="ignore")
+                if kind == TRACE_NAME:
+                    names[cid] = data
+                else:
+                    yield kind, names[cid], when, data
+
+    return meta, records()
+
+
+class _ReplayConn:
+    """Mixin turning a Room or PM into an offline connection fed from a trace"""
+    def _connect(self):
+        self.connected = True
+        if getattr(self, "name", None) is not None:
+            self._mgr.addConnection(self)
+
+    def _disconnect(self):
+        self.connected = False
+
+    def _write(self, data: bytes):
+        pass
+
+
+def replay(path: str, speed: Optional[float] = None,
+           mgrClass: Optional[type[RoomManager]] = None) -> dict[str, float]:
+    """
+    Feed the inbound frames of a trace through Room._process and PM._process.
+
+    @param path: trace file
+    @param speed: replay speed relative to the recording, None for unthrottled
+    @param mgrClass: manager class whose handlers get the events
+
+    @return: frames, events, seconds, frames_per_sec and events_per_sec
+    """
+    from . import RoomManager, Task
+
+    meta, records = readTrace(path)
+    mgrClass = mgrClass or RoomManager
+    mgr = mgrClass(meta.get("name"), None, pm=False)
+    Room = type("ReplayRoom", (_ReplayConn, mgr._Room), {})
+    PM = type("ReplayPM", (_ReplayConn, mgr._PM), {})
+
+    events = 0
+    callEvent = mgr._callEvent
+
+    def countEvent(conn: Conn, evt: str, *args: Any, **kw: Any):
+        nonlocal events
+        events += 1
+        callEvent(conn, evt, *args, **kw)
+
+    mgr._callEvent = countEvent  # type: ignore
+    conns: dict[str, Any] = dict()
+    frames = 0
+    start = time.perf_counter()
+    for kind, key, when, frame in records:
+        if kind != TRACE_IN:
+            continue
+        if (conn := conns.get(key)) is None:
+            if key == "pm:":
+                conn = conns[key] = PM(mgr=mgr)
+            else:
+                conn = conns[key] = Room(key[len("room:"):], None, mgr=mgr)
+        if speed:
+            if (delay := when / speed - (time.perf_counter() - start)) > 0:
+                time.sleep(delay)
+            Task.tick()
+        conn._process(frame)
+        frames += 1
+    seconds = time.perf_counter() - start
+
+    for conn in conns.values():
+        conn.connected = False
+    return {
+        "frames": frames,
+        "events": events,
+        "seconds": seconds,
+        "frames_per_sec": frames / seconds if seconds else 0.0,
+        "events_per_sec": events / seconds if seconds else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a ch protocol trace")
+    parser.add_argument("trace")
+    parser.add_argument("--speed", type=float, default=None,
+                        help="replay speed relative to the recording, unthrottled if omitted")
+    args = parser.parse_args()
+    print(json.dumps(replay(args.trace, args.speed), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,435 @@
+"""
+Transports, the byte streams under Room and PM
+
+A transport only needs the part of the socket API the connections use,
+so a plain non-blocking socket.socket is the default one, see
+RoomManager.createTransport to use another. Transports other than
+socket.socket also tell the main loop whether they hold data read
+already (pendingRead) or data still to send (pendingWrite).
+"""
+from __future__ import annotations
+from typing import Any, Callable, Optional, Protocol
+import base64
+import hashlib
+import os
+import socket
+import struct
+import zlib
+
+
+class Transport(Protocol):
+    """
+    A Class that describes the required members and functions required
+    of a transport, socket.socket being one
+    """
+    def fileno(self) -> int:
+        """File descriptor to select on, negative for in memory transports."""
+        ...
+
+    def connect_ex(self, address: Any) -> int:
+        ...
+
+    def recv_into(self, buffer: bytearray | memoryview) -> int:
+        """Read into buffer, 0 on EOF, raise BlockingIOError without data."""
+        ...
+
+    def send(self, data: bytes | bytearray) -> int:
+        ...
+
+    def close(self):
+        ...
+
+
+class LoopbackTransport:
+    """
+    In memory transport, what the connection sends goes straight to a peer
+    in the same process and the peer answers through deliver
+
+    It has no file descriptor so the main loop reads it whenever it holds data.
+
+    @param peer: called with the bytes sent by the connection
+    @param onClose: called once the connection closes the transport
+    """
+    def __init__(self, peer: Callable[[bytes], None],
+                 onClose: Optional[Callable[[], None]] = None):
+        self.peer = peer
+        self.onClose = onClose
+        self.closed = False
+        self._inbound = bytearray()
+        self._hungUp = False
+
+    @property
+    def pendingRead(self) -> bool:
+        """True if recv_into would return without blocking."""
+        return bool(self._inbound) or self._hungUp
+
+    def deliver(self, data: bytes | bytearray):
+        """Queue bytes for the connection to read, called by the peer."""
+        self._inbound += data
+
+    def hangUp(self):
+        """Close from the peer side, the connection reads EOF after the queued bytes."""
+        self._hungUp = True
+
+    def fileno(self) -> int:
+        return -1
+
+    def connect_ex(self, address: Any) -> int:
+        return 0
+
+    def recv_into(self, buffer: bytearray | memoryview) -> int:
+        if self.closed:
+            raise OSError("recv on a closed transport")
+        if not self._inbound:
+            if self._hungUp:
+                return 0
+            raise BlockingIOError
+        size = min(len(buffer), len(self._inbound))
+        buffer[:size] = self._inbound[:size]
+        del self._inbound[:size]
+        return size
+
+    def send(self, data: bytes | bytearray) -> int:
+        if self.closed or self._hungUp:
+            raise BrokenPipeError("send on a closed transport")
+        self.peer(bytes(data))
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._inbound.clear()
+            if self.onClose:
+                self.onClose()
+
+
+################################################################
+# WebSocket
+################################################################
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC11B65"
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+def _mask(payload: bytes, key: bytes) -> bytes:
+    if not (size := len(payload)):
+        return b""
+    # xor as one big integer instead of byte by byte
+    key = (key * (size // 4 + 1))[:size]
+    value = int.from_bytes(payload, "little") ^ int.from_bytes(key, "little")
+    return value.to_bytes(size, "little")
+
+
+def acceptKey(key: bytes) -> bytes:
+    """Get the Sec-WebSocket-Accept value for a Sec-WebSocket-Key."""
+    return base64.b64encode(hashlib.sha1(key + WS_GUID).digest())
+
+
+def encodeFrame(opcode: int, payload: bytes, mask: bool = True, compressed: bool = False) -> bytes:
+    """
+    Encode a single final frame.
+
+    @param opcode: frame opcode
+    @param payload: frame payload
+    @param mask: mask the payload, required for frames sent by clients
+    @param compressed: set RSV1, the payload was compressed with permessage-deflate
+    """
+    head = bytearray((0x80 | (0x40 if compressed else 0) | opcode,))
+    bit = 0x80 if mask else 0
+    size = len(payload)
+    if size < 126:
+        head.append(bit | size)
+    elif size < 65536:
+        head.append(bit | 126)
+        head += struct.pack("!H", size)
+    else:
+        head.append(bit | 127)
+        head += struct.pack("!Q", size)
+    if mask:
+        key = os.urandom(4)
+        head += key
+        payload = _mask(payload, key)
+    return bytes(head) + payload
+
+
+class FrameDecoder:
+    """Incremental frame decoder, reassembling fragmented messages"""
+    def __init__(self):
+        self._buf = bytearray()
+        self._fragments = bytearray()
+        self._opcode = OP_TEXT
+        self._compressed = False
+
+    def feed(self, data: bytes | bytearray) -> list[tuple[int, bool, bytes]]:
+        """
+        Feed received bytes.
+
+        @param data: bytes as read from the stream
+
+        @return: (opcode, compressed, payload) of every complete message
+                 and control frame, partial frames are kept for the next feed
+        """
+        buf = self._buf
+        buf += data
+        out: list[tuple[int, bool, bytes]] = []
+        pos = 0
+        while len(buf) - pos >= 2:
+            b0, b1 = buf[pos], buf[pos + 1]
+            size = b1 & 0x7F
+            start = pos + 2
+            if size == 126:
+                if len(buf) - start < 2:
+                    break
+                size = struct.unpack_from("!H", buf, start)[0]
+                start += 2
+            elif size == 127:
+                if len(buf) - start < 8:
+                    break
+                size = struct.unpack_from("!Q", buf, start)[0]
+                start += 8
+            key = None
+            if b1 & 0x80:
+                if len(buf) - start < 4:
+                    break
+                key = bytes(buf[start:start + 4])
+                start += 4
+            if len(buf) - start < size:
+                break
+            payload = bytes(buf[start:start + size])
+            pos = start + size
+            if key:
+                payload = _mask(payload, key)
+
+            opcode = b0 & 0x0F
+            if opcode >= OP_CLOSE:
+                # control frames may come in between fragments
+                out.append((opcode, False, payload))
+                continue
+            if opcode != OP_CONTINUATION:
+                self._opcode = opcode
+                self._compressed = bool(b0 & 0x40)
+                self._fragments.clear()
+            self._fragments += payload
+            if b0 & 0x80:
+                out.append((self._opcode, self._compressed, bytes(self._fragments)))
+                self._fragments.clear()
+        del buf[:pos]
+        return out
+
+
+class PerMessageDeflate:
+    """
+    permessage-deflate (RFC 7692) state of one side of a connection
+
+    @param params: negotiated extension parameters
+    @param client: True for the client side
+    """
+    offer = "permessage-deflate; client_max_window_bits"
+
+    def __init__(self, params: dict[str, str | None], client: bool = True):
+        local, remote = ("client", "server") if client else ("server", "client")
+        # zlib can't compress with a window of 256 bytes
+        self._wbits = max(9, int(params.get(local + "_max_window_bits") or 15))
+        self._resetCompress = local + "_no_context_takeover" in params
+        self._resetDecompress = remote + "_no_context_takeover" in params
+        self._compress = zlib.compressobj(wbits=-self._wbits)
+        self._decompress = zlib.decompressobj(wbits=-15)
+
+    @staticmethod
+    def parse(header: str) -> dict[str, str | None] | None:
+        """
+        Find the permessage-deflate parameters in a Sec-WebSocket-Extensions header.
+
+        @return: the parameters, None if it isn't there
+        """
+        for ext in header.split(","):
+            name, *params = [p.strip() for p in ext.split(";")]
+            if name == "permessage-deflate":
+                return {k.strip(): v.strip().strip('"') if v else None
+                        for k, _, v in (p.partition("=") for p in params if p)}
+        return None
+
+    def compress(self, data: bytes) -> bytes:
+        out = self._compress.compress(data) + self._compress.flush(zlib.Z_SYNC_FLUSH)
+        if self._resetCompress:
+            self._compress = zlib.compressobj(wbits=-self._wbits)
+        # the empty stored block ending every flush is implied
+        return out[:-4]
+
+    def decompress(self, data: bytes) -> bytes:
+        out = self._decompress.decompress(data + b"\x00\x00\xff\xff")
+        if self._resetDecompress:
+            self._decompress = zlib.decompressobj(wbits=-15)
+        return out
+
+
+class WebSocketTransport:
+    """
+    WebSocket client over a non-blocking socket, optionally compressed
+    with permessage-deflate
+
+    Every command written goes out as one text message and every message
+    received is handed to the connection as a \\x00 terminated command,
+    so Room and PM process it like the plain socket stream.
+
+    @param sock: unconnected non-blocking socket
+    @param compress: offer permessage-deflate
+    @param port: port to connect to instead of the one of the connection
+    @param path: request path
+    @param origin: Origin header, the servers check it
+    """
+    def __init__(self, sock: socket.socket, compress: bool = True, port: Optional[int] = None,
+                 path: str = "/", origin: str = "http://st.chatango.com"):
+        self.sock = sock
+        self.port = port
+        self.compress = compress
+        self.path = path
+        self.origin = origin
+        # handshake done
+        self.open = False
+        self.deflate: PerMessageDeflate | None = None
+        # bytes on the wire, compressed and framed
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self._key = base64.b64encode(os.urandom(16))
+        self._handshake = bytearray()
+        self._decoder = FrameDecoder()
+        self._decoded = bytearray()
+        self._out = bytearray()
+        # commands written before the handshake finished
+        self._waiting: list[bytes] = list()
+        # a command split between two writes
+        self._partial = bytearray()
+        self._eof = False
+
+    @property
+    def pendingRead(self) -> bool:
+        """True if recv_into would return without reading the socket."""
+        return bool(self._decoded) or self._eof
+
+    @property
+    def pendingWrite(self) -> bool:
+        """True while framed bytes are waiting for the socket."""
+        return bool(self._out)
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def connect_ex(self, address: Any) -> int:
+        host, port = address
+        port = self.port or port
+        headers = [
+            f"GET {self.path} HTTP/1.1",
+            f"Host: {host}:{port}",
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            "Sec-WebSocket-Key: " + self._key.decode(),
+            "Sec-WebSocket-Version: 13",
+            "Origin: " + self.origin,
+        ]
+        if self.compress:
+            headers.append("Sec-WebSocket-Extensions: " + PerMessageDeflate.offer)
+        self._out += ("\r\n".join(headers) + "\r\n\r\n").encode()
+        return self.sock.connect_ex((host, port))
+
+    def recv_into(self, buffer: bytearray | memoryview) -> int:
+        if not self._decoded:
+            if self._eof:
+                return 0
+            data = self.sock.recv(65536)
+            if not data:
+                return 0
+            self.bytesIn += len(data)
+            if not self.open:
+                data = self._upgrade(data)
+            if data:
+                self._receive(data)
+            self._flush()
+            if not self._decoded:
+                if self._eof:
+                    return 0
+                raise BlockingIOError
+        size = min(len(buffer), len(self._decoded))
+        buffer[:size] = self._decoded[:size]
+        del self._decoded[:size]
+        return size
+
+    def send(self, data: bytes | bytearray) -> int:
+        self._partial += data
+        if (end := self._partial.rfind(b"\x00") + 1):
+            commands = [c + b"\x00" for c in bytes(self._partial[:end]).split(b"\x00")[:-1]]
+            del self._partial[:end]
+            if self.open:
+                for command in commands:
+                    self._out += self._frame(command)
+            else:
+                self._waiting += commands
+        self._flush()
+        return len(data)
+
+    def close(self):
+        if self.open and not self._eof:
+            try:
+                self.sock.send(encodeFrame(OP_CLOSE, struct.pack("!H", 1000)))
+            except OSError:
+                pass
+        self.open = False
+        self.sock.close()
+
+    def _frame(self, payload: bytes) -> bytes:
+        if self.deflate is not None:
+            return encodeFrame(OP_TEXT, self.deflate.compress(payload), compressed=True)
+        return encodeFrame(OP_TEXT, payload)
+
+    def _flush(self):
+        try:
+            while self._out:
+                size = self.sock.send(self._out)
+                self.bytesOut += size
+                del self._out[:size]
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _upgrade(self, data: bytes) -> bytes:
+        """Read the handshake response, return the bytes following it."""
+        self._handshake += data
+        if (end := self._handshake.find(b"\r\n\r\n")) < 0:
+            if len(self._handshake) > 16384:
+                raise ConnectionError("WebSocket handshake response too long")
+            return b""
+        status, *lines = self._handshake[:end].decode(errors="ignore").split("\r\n")
+        rest = bytes(self._handshake[end + 4:])
+        self._handshake.clear()
+        if status.split(" ")[1:2] != ["101"]:
+            raise ConnectionError("WebSocket handshake refused: " + status)
+        headers = {k.strip().lower(): v.strip()
+                   for k, _, v in (line.partition(":") for line in lines)}
+        if headers.get("sec-websocket-accept", "").encode() != acceptKey(self._key):
+            raise ConnectionError("WebSocket handshake with a wrong accept key")
+        if self.compress and (params := PerMessageDeflate.parse(
+                headers.get("sec-websocket-extensions", ""))) is not None:
+            self.deflate = PerMessageDeflate(params)
+        self.open = True
+        for command in self._waiting:
+            self._out += self._frame(command)
+        self._waiting.clear()
+        return rest
+
+    def _receive(self, data: bytes):
+        for opcode, compressed, payload in self._decoder.feed(data):
+            if opcode == OP_TEXT or opcode == OP_BINARY:
+                if compressed and self.deflate is not None:
+                    payload = self.deflate.decompress(payload)
+                self._decoded += payload
+                if not payload.endswith(b"\x00"):
+                    self._decoded += b"\x00"
+            elif opcode == OP_PING:
+                self._out += encodeFrame(OP_PONG, payload)
+            elif opcode == OP_CLOSE:
+                if not self._eof:
+                    self._out += encodeFrame(OP_CLOSE, payload[:2])
+                self._eof = True